@@ -0,0 +1,107 @@
+"""
+cleaners_bench.py
+Micro-benchmark of ingestion.cleaners against the original multi-pass implementation: clean_text()
+on one large text and clean_row()/clean_rows() on a large synthetic sheet. Both implementations are
+checked to give identical results before timing.
+
+Run from the project root:
+    python -m benchmarks.cleaners_bench --text-mb 50 --cells 1000000
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+from ingestion import cleaners
+
+
+def legacy_clean_text(text):
+    """clean_text() as it was before the single-pass cleaner."""
+    text = text.strip()
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"\n\s*\n+", "\n\n", text)
+    text = re.sub(r"[ \t]+", " ", text)
+    return text
+
+
+def legacy_clean_row(row_data):
+    """clean_row() as it was before the single-pass cleaner."""
+    cleaned_cells = []
+    for cell in row_data:
+        if cell is None:
+            cleaned_cells.append("")
+        elif isinstance(cell, (int, float)):
+            cleaned_cells.append(str(cell))
+        elif isinstance(cell, str):
+            cleaned_cells.append(legacy_clean_text(cell))
+        else:
+            cleaned_cells.append(str(cell))
+    return cleaned_cells
+
+
+def make_text(size_bytes, seed=0):
+    """Synthetic extracted-PDF text: words, single/multiple spaces, tabs, CRLF and blank lines."""
+    rng = random.Random(seed)
+    words = ["exascale", "numerical", "board", "games", "children", "Calvert", "2015", "(p.", "12)"]
+    separators = [" "] * 20 + ["  ", "\t", "\n", "\r\n", "\n\n\n", " \n  \n"]
+    parts = []
+    size = 0
+    while size < size_bytes:
+        part = rng.choice(words) + rng.choice(separators)
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def make_rows(num_cells, columns=10, seed=0):
+    """Synthetic sheet with string, numeric and empty cells."""
+    rng = random.Random(seed)
+    values = ["  Fostering early numerical competencies ", "paper.pdf", "A\tB", "x  y\r\nz", "", None, 3, 2.5]
+    return [[rng.choice(values) for _ in range(columns)] for _ in range(num_cells // columns)]
+
+
+def best_of(function, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--text-mb", type=float, default=20)
+    parser.add_argument("--cells", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    text = make_text(int(args.text_mb * 1024 * 1024))
+    rows = make_rows(args.cells)
+    report = {}
+
+    legacy_seconds, legacy_result = best_of(lambda: legacy_clean_text(text), args.repeat)
+    new_seconds, new_result = best_of(lambda: cleaners.clean_text(text), args.repeat)
+    assert new_result == legacy_result
+    report["clean_text"] = {"legacy_s": round(legacy_seconds, 4), "new_s": round(new_seconds, 4),
+                            "speedup": round(legacy_seconds / new_seconds, 2)}
+
+    legacy_seconds, legacy_result = best_of(lambda: [legacy_clean_row(row) for row in rows], args.repeat)
+    row_seconds, row_result = best_of(lambda: [cleaners.clean_row(row) for row in rows], args.repeat)
+    batch_seconds, batch_result = best_of(lambda: cleaners.clean_rows(rows), args.repeat)
+    assert row_result == legacy_result and batch_result == legacy_result
+    report["sheet"] = {"cells": len(rows) * len(rows[0]), "legacy_clean_row_s": round(legacy_seconds, 4),
+                       "clean_row_s": round(row_seconds, 4), "clean_rows_s": round(batch_seconds, 4),
+                       "speedup_clean_row": round(legacy_seconds / row_seconds, 2),
+                       "speedup_clean_rows": round(legacy_seconds / batch_seconds, 2)}
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
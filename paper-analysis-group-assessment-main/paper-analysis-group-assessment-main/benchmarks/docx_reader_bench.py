@@ -0,0 +1,129 @@
+"""
+docx_reader_bench.py
+Benchmark of ingestion.docx_reader against the original way of reading a converted paper:
+docx.Document(), simplify() for the JSON and doc.paragraphs for the text. A synthetic DOCX
+(paragraphs with several runs, tabs and breaks, plus tables) is generated, both readers are checked
+to give identical JSON and paragraphs, then each is timed in a fresh process that imports the same
+modules, and its peak memory is reported both as the peak RSS of the process (which includes the
+memory of the XML parser) and as the peak of Python allocations seen by tracemalloc.
+
+Run from the project root:
+    python -m benchmarks.docx_reader_bench --paragraphs 20000 --tables 200
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import resource
+import tracemalloc
+import argparse
+import tempfile
+import multiprocessing
+
+import docx
+from simplify_docx import simplify
+
+from ingestion.docx_reader import read_docx
+
+
+def legacy_read_docx(docx_file):
+    """What convert_document did before the single-pass reader."""
+    doc = docx.Document(docx_file)
+    simplified = simplify(doc, {"special-characters-as-text": False})
+    return simplified, [para.text for para in doc.paragraphs]
+
+
+def new_read_docx(docx_file):
+    content = read_docx(docx_file)
+    return content.simplified, content.paragraphs
+
+
+def make_docx(docx_file, num_paragraphs, num_tables, seed=0):
+    """Synthetic converted paper: multi-run paragraphs, tabs, line breaks and small tables."""
+    rng = random.Random(seed)
+    words = ["Fiona", "Calvert", "numerical", "board", "games", "“children”", "2015", "—", "(p.", "12)"]
+    doc = docx.Document()
+    table_every = max(num_paragraphs // max(num_tables, 1), 1)
+    for index in range(num_paragraphs):
+        paragraph = doc.add_paragraph()
+        for _ in range(rng.randint(1, 4)):
+            run = paragraph.add_run(" ".join(rng.choice(words) for _ in range(rng.randint(3, 15))) + " ")
+            if rng.random() < 0.1:
+                run.add_tab()
+            if rng.random() < 0.05:
+                run.add_break()
+        if num_tables and index % table_every == 0:
+            table = doc.add_table(rows=3, cols=3)
+            for cell in table._cells:
+                cell.text = " ".join(rng.choice(words) for _ in range(3))
+    doc.save(docx_file)
+
+
+def _measure(reader_name, docx_file, repeat, results):
+    reader = {'legacy': legacy_read_docx, 'new': new_read_docx}[reader_name]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = reader(docx_file)
+        timings.append(time.perf_counter() - start)
+    # ru_maxrss is in KiB on Linux
+    peak_rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    # One more read to trace Python allocations, which slows it down
+    tracemalloc.start()
+    reader(docx_file)
+    peak_traced_mib = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    results.put((min(timings), peak_rss_mib, peak_traced_mib, output))
+
+
+def measure(reader_name, docx_file, repeat):
+    """
+    Time a reader and measure its peak memory in a new process.
+
+    :return: (best time in seconds, peak RSS in MiB, peak traced Python memory in MiB, output)
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_measure, args=(reader_name, docx_file, repeat, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        docx_file = os.path.join(tmp_dir, "bench.docx")
+        make_docx(docx_file, args.paragraphs, args.tables)
+
+        legacy_seconds, legacy_rss, legacy_traced, legacy_output = measure('legacy', docx_file, args.repeat)
+        new_seconds, new_rss, new_traced, new_output = measure('new', docx_file, args.repeat)
+        assert new_output == legacy_output
+
+        report = {
+            "docx_kib": round(os.path.getsize(docx_file) / 1024, 1),
+            "paragraphs": len(new_output[1]),
+            "legacy_s": round(legacy_seconds, 4),
+            "new_s": round(new_seconds, 4),
+            "speedup": round(legacy_seconds / new_seconds, 2),
+            "legacy_peak_rss_mib": round(legacy_rss, 1),
+            "new_peak_rss_mib": round(new_rss, 1),
+            "legacy_peak_traced_mib": round(legacy_traced, 1),
+            "new_peak_traced_mib": round(new_traced, 1),
+        }
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
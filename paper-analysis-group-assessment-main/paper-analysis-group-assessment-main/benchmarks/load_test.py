@@ -0,0 +1,213 @@
+"""
+load_test.py
+Measure the requests per second and latency of the HTTP query server (ingestion/query_server.py)
+under concurrent clients on one machine.
+
+The server is started as its own process ('document_processor serve') over a synthetic database
+built with the corpus of sqlite_profile, unless --url points at a server already running. Every
+client is a process with one keep-alive HTTP connection that sends requests back to back for
+--duration seconds, drawn from a mix of "get papers that mention" questions, /papers filters,
+'top'/'cooccur' questions and pages of the whole paper list. The clients are processes so that
+the measurement does not share a GIL with the server or with each other.
+
+Run from the project root:
+    python -m benchmarks.load_test --concurrency 1 4 16 --duration 10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.client
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.sqlite_profile import QUERY_TYPES, make_corpus, make_queries, percentile
+from ingestion import document_processor as dp
+from ingestion.entity_resolver import EntityResolver
+
+SERVER_START_SECONDS = 30
+
+
+def build_database(db_file, num_papers, mentions_per_paper, vocabulary_size):
+    """
+    Load a synthetic corpus into a new database.
+
+    :return: list of (entity name, entity type) of the corpus vocabulary
+    """
+    corpus, vocabulary = make_corpus(num_papers, mentions_per_paper, vocabulary_size)
+    conn = dp.get_database_connection(db_file)
+    dp.setup_database(conn)
+    cur = conn.cursor()
+    resolver = EntityResolver(cur)
+    for paper, entities in corpus:
+        dp.update_database(cur, paper, entities, resolver=resolver)
+    conn.commit()
+    conn.close()
+    return vocabulary
+
+
+def make_requests(vocabulary, num_papers, num_requests, seed=2):
+    """
+    :return: list of request paths, in the proportions of a dashboard workload
+    """
+    rng = random.Random(seed)
+    candidates = [(text, label) for text, label in vocabulary if label in QUERY_TYPES]
+    questions = make_queries(vocabulary, num_requests, seed=seed)
+    requests = []
+    for index in range(num_requests):
+        kind = rng.random()
+        if kind < 0.5:
+            params = {'q': questions[index]}
+            path = '/query'
+        elif kind < 0.7:
+            (text, label), (other_text, other_label) = rng.sample(candidates, 2)
+            params = {QUERY_TYPES[label]: text, QUERY_TYPES[other_label]: other_text,
+                      'match': rng.choice(['all', 'any'])}
+            path = '/papers'
+        elif kind < 0.8:
+            params = {'q': rng.choice(["top", "top 20 people", "top organisations"])}
+            path = '/query'
+        elif kind < 0.9:
+            text, label = rng.choice(candidates)
+            params = {'q': f"cooccur {QUERY_TYPES[label]} {text}"}
+            path = '/query'
+        else:
+            params = {'q': "get all papers", 'limit': 100, 'offset': 100 * rng.randrange(max(1, num_papers // 100))}
+            path = '/query'
+        requests.append(f"{path}?{urlencode(params)}")
+    return requests
+
+
+def run_client(host, port, requests, duration, seed):
+    """
+    Send requests over one connection until duration seconds have passed.
+
+    :return: (list of latencies in milliseconds, number of failed requests)
+    """
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        path = rng.choice(requests)
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+    return latencies, errors
+
+
+def run_level(host, port, requests, concurrency, duration):
+    """
+    :return: dictionary of the throughput and latencies of concurrency clients
+    """
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        futures = [executor.submit(run_client, host, port, requests, duration, seed)
+                   for seed in range(concurrency)]
+        results = [future.result() for future in futures]
+        seconds = time.perf_counter() - start
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    errors = sum(client_errors for _, client_errors in results)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": round(len(latencies) / seconds, 1),
+        "latency_ms_p50": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "latency_ms_p95": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "latency_ms_p99": round(percentile(latencies, 0.99), 3) if latencies else None,
+    }
+
+
+def get_json(host, port, path):
+    conn = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        conn.request("GET", path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def start_server(db_file, pool_size):
+    """
+    Start 'document_processor serve' on a free port and wait until it answers.
+
+    :return: (subprocess.Popen, port)
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    command = [sys.executable, "-m", "ingestion.document_processor", "--db", db_file, "serve", "--port", str(port)]
+    if pool_size is not None:
+        command += ["--pool-size", str(pool_size)]
+    server = subprocess.Popen(command)
+    deadline = time.perf_counter() + SERVER_START_SECONDS
+    while True:
+        try:
+            get_json("127.0.0.1", port, "/stats")
+            return server, port
+        except OSError:
+            if server.poll() is not None or time.perf_counter() > deadline:
+                server.kill()
+                raise RuntimeError("The query server did not start")
+            time.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="server to test, e.g. http://127.0.0.1:8765 (default: start one)")
+    parser.add_argument("--papers", type=int, default=1000)
+    parser.add_argument("--mentions", type=int, default=300, help="entity mentions per paper")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="distinct entities in the corpus")
+    parser.add_argument("--requests", type=int, default=5000, help="distinct requests the clients draw from")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--pool-size", type=int, help="database connections of the started server")
+    args = parser.parse_args(argv)
+
+    # Without a database of our own, ask for the names a database built with the same options holds
+    _, vocabulary = make_corpus(0, 0, args.vocabulary)
+    report = {"levels": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server = None
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            db_file = os.path.join(tmp_dir, "load_test.sqlite")
+            vocabulary = build_database(db_file, args.papers, args.mentions, args.vocabulary)
+            server, port = start_server(db_file, args.pool_size)
+            host = "127.0.0.1"
+        try:
+            requests = make_requests(vocabulary, args.papers, args.requests)
+            for concurrency in args.concurrency:
+                report["levels"][str(concurrency)] = run_level(host, port, requests, concurrency, args.duration)
+            report["server"] = get_json(host, port, "/stats")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+sqlite_profile.py
+Compare load and query latency of the paper/entity database with SQLite defaults (no pragmas,
+no secondary indexes) against the tuned profile (WAL, larger cache, mmap, covering indexes).
+
+Run from the project root:
+    python -m benchmarks.sqlite_profile --papers 2000 --profile both
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+from ingestion import document_processor as dp
+from ingestion.entity_resolver import EntityResolver
+from ingestion.entity_store import FILE_SUFFIX as ENTS_SUFFIX, EntityTable
+
+ENTITY_TYPES = ["PERSON", "ORG", "GPE", "WORK_OF_ART", "DATE", "CARDINAL"]
+QUERY_TYPES = {"PERSON": "person", "ORG": "organisation", "WORK_OF_ART": "work"}
+
+
+def make_corpus(num_papers, mentions_per_paper, vocabulary_size, seed=0):
+    """
+    Build synthetic papers and entity mentions with a Zipf-like name distribution.
+
+    :return: list of (paper dictionary, EntityTable)
+    """
+    rng = random.Random(seed)
+    vocabulary = [(f"Entity Name {i}", ENTITY_TYPES[i % len(ENTITY_TYPES)]) for i in range(vocabulary_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocabulary_size)]
+    corpus = []
+    for paper_idx in range(num_papers):
+        name = f"paper{paper_idx}.pdf"
+        paper = {
+            'paper_name': f"Synthetic paper {paper_idx}",
+            'paper_pdf': os.path.join(dp.SOURCE_PATH, name),
+            'paper_docx': os.path.join(dp.DOCS_PATH, name + '.docx'),
+            'paper_json': os.path.join(dp.JSON_PATH, name + '.json'),
+            'paper_entities': os.path.join(dp.ENTS_PATH, name + ENTS_SUFFIX),
+        }
+        mentions = rng.choices(vocabulary, weights, k=mentions_per_paper)
+        entities = EntityTable()
+        for text, label in mentions:
+            entities.append(text, 0, len(text), label)
+        corpus.append((paper, entities))
+    return corpus, vocabulary
+
+
+def make_queries(vocabulary, num_queries, seed=1):
+    """
+    Build "get all papers that mention ..." questions over the synthetic vocabulary.
+
+    :return: list of question strings
+    """
+    rng = random.Random(seed)
+    candidates = [(text, label) for text, label in vocabulary if label in QUERY_TYPES]
+    queries = []
+    for _ in range(num_queries):
+        text, label = rng.choice(candidates)
+        question = f"get all papers that mention {QUERY_TYPES[label]} {text}"
+        if rng.random() < 0.3:
+            other_text, other_label = rng.choice(candidates)
+            question += f" or {QUERY_TYPES[other_label]} {other_text}"
+        queries.append(question)
+    return queries
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_profile(db_file, tuned, corpus, queries, batch_size):
+    """
+    Load the corpus into a fresh database and run the queries against it.
+
+    :return: dictionary of load and query latencies in milliseconds
+    """
+    conn = dp.get_database_connection(db_file, tuned=tuned)
+    dp.setup_database(conn)
+    cur = conn.cursor()
+    if not tuned:
+        # update_database needs the tables of the migrations, but the baseline goes without their indexes
+        indexes = cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'").fetchall()
+        for (index_name,) in indexes:
+            cur.execute(f"DROP INDEX {index_name}")
+        conn.commit()
+    resolver = EntityResolver(cur)
+
+    load_latencies = []
+    start = time.perf_counter()
+    for paper_idx, (paper, entities) in enumerate(corpus, start=1):
+        paper_start = time.perf_counter()
+        dp.update_database(cur, paper, entities, resolver=resolver)
+        if paper_idx % batch_size == 0:
+            conn.commit()
+        load_latencies.append((time.perf_counter() - paper_start) * 1000)
+    conn.commit()
+    load_seconds = time.perf_counter() - start
+
+    query_latencies = []
+    for question in queries:
+        query_plan = dp.parse_user_query(question)
+        query_start = time.perf_counter()
+        cur.execute(query_plan.sql, query_plan.params)
+        cur.fetchall()
+        query_latencies.append((time.perf_counter() - query_start) * 1000)
+    conn.close()
+
+    return {
+        "load_seconds": round(load_seconds, 3),
+        "load_ms_p50": round(percentile(load_latencies, 0.5), 3),
+        "load_ms_p95": round(percentile(load_latencies, 0.95), 3),
+        "query_ms_mean": round(statistics.mean(query_latencies), 3),
+        "query_ms_p50": round(percentile(query_latencies, 0.5), 3),
+        "query_ms_p95": round(percentile(query_latencies, 0.95), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--papers", type=int, default=500)
+    parser.add_argument("--mentions", type=int, default=2000, help="entity mentions per paper")
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct entities in the corpus")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=dp.NER_PAPERS_PER_BATCH, help="papers per commit")
+    parser.add_argument("--profile", choices=["default", "tuned", "both"], default="both")
+    args = parser.parse_args(argv)
+
+    corpus, vocabulary = make_corpus(args.papers, args.mentions, args.vocabulary)
+    queries = make_queries(vocabulary, args.queries)
+    profiles = ["default", "tuned"] if args.profile == "both" else [args.profile]
+
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for profile in profiles:
+            db_file = os.path.join(tmp_dir, f"{profile}.sqlite")
+            report[profile] = run_profile(db_file, profile == "tuned", corpus, queries, args.batch_size)
+
+    if len(profiles) == 2:
+        report["speedup"] = {
+            key: round(report["default"][key] / report["tuned"][key], 2)
+            for key in report["tuned"] if report["tuned"][key]
+        }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+suite.py
+End-to-end benchmark of the ingestion and query stages, run offline on a synthetic corpus it
+generates itself: PDF papers, DOCX papers and an XLSX paper index of configurable sizes, with the
+rule-based stand-in for the spaCy model from text_source_bench.
+
+Stages, each timed per item:
+- xlsx_index:       load_paper_index() over the index workbook (one item per read)
+- pdf_text:         extract_text_from_pdf() per PDF
+- pdf_paragraphs:   read_pdf_paragraphs() per PDF
+- docx_text:        extract_text_from_docx() per DOCX
+- clean_text:       clean_text() over the text of each PDF
+- extract_entities: extract_entities() over the paragraphs of each PDF
+- load_entities:    EntityTable.load() and mention_counts() over the saved entities of each PDF
+- update_database:  update_database() per paper, into a fresh tuned database
+- query:            parse_user_query() and execution per question
+
+For every stage the report gives throughput, p50/p95 latency and the peak RSS of the process at the
+end of the stage (a high-water mark, so it only grows from one stage to the next). With --baseline,
+the run is compared with a report saved earlier by --save-baseline: a stage regresses when its p50
+latency grows, or its throughput drops, by more than --tolerance, and the exit status is then 1.
+
+Run from the project root:
+    python -m benchmarks.suite --save-baseline baseline.json
+    python -m benchmarks.suite --baseline baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import argparse
+import resource
+import tempfile
+import statistics
+
+import openpyxl
+
+from benchmarks.docx_reader_bench import make_docx
+from benchmarks.sqlite_profile import percentile
+from benchmarks.text_source_bench import ORGANISATIONS, PEOPLE, make_pdfs, make_rule_model
+from ingestion import document_processor as dp
+from ingestion.cleaners import clean_text
+from ingestion.docx_extractor import extract_text_from_docx
+from ingestion.entity_resolver import EntityResolver
+from ingestion.entity_store import EntityTable
+from ingestion.pdf_extractor import extract_text_from_pdf, read_pdf_paragraphs
+
+QUERY_TYPES = {**{name: "person" for name in PEOPLE}, **{name: "organisation" for name in ORGANISATIONS}}
+SEARCH_WORDS = ["numerical", "board", "games", "estimation", "children", "number line"]
+
+
+def make_index(xlsx_file, num_rows, pdf_names):
+    """Synthetic paper index in the layout of index.xlsx, cycling over the generated PDFs."""
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Sheet1"
+    sheet.append(["paper_name", "paper_pdf"])
+    for row in range(num_rows):
+        sheet.append([f"Synthetic paper {row}", pdf_names[row % len(pdf_names)]])
+    workbook.save(xlsx_file)
+
+
+def make_queries(num_queries, seed=0):
+    """Questions over the names of the synthetic papers: single, 'and'/'or' pairs and searches."""
+    rng = random.Random(seed)
+    names = list(QUERY_TYPES)
+    queries = []
+    for _ in range(num_queries):
+        kind = rng.random()
+        if kind < 0.2:
+            queries.append("search " + rng.choice(SEARCH_WORDS))
+            continue
+        name = rng.choice(names)
+        question = f"get all papers that mention {QUERY_TYPES[name]} {name}"
+        if kind > 0.6:
+            other = rng.choice(names)
+            question += f" {rng.choice(['and', 'or'])} {QUERY_TYPES[other]} {other}"
+        queries.append(question)
+    return queries
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_stage(function, items, item_bytes=None):
+    """
+    Call function on every item and time each call.
+
+    :param function: callable taking one item
+    :param items: list of items
+    :param item_bytes: list of the input size of each item in bytes, for MB/s
+    :return: (list of results, dictionary of stage measurements)
+    """
+    results = []
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        results.append(function(item))
+        latencies.append(time.perf_counter() - item_start)
+    seconds = time.perf_counter() - start
+
+    stage = {
+        "items": len(items),
+        "seconds": round(seconds, 4),
+        "items_per_second": round(len(items) / seconds, 2) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+    }
+    if item_bytes is not None:
+        stage["mb_per_second"] = round(sum(item_bytes) / (1024 * 1024) / seconds, 3) if seconds else None
+    stage["peak_rss_mib"] = round(peak_rss_mib(), 1)
+    return results, stage
+
+
+def run_suite(tmp_dir, args):
+    """
+    Generate the corpus in tmp_dir and run every stage over it.
+
+    :return: dictionary mapping stage names to their measurements
+    """
+    pdf_files = make_pdfs(tmp_dir, args.papers, args.pages, seed=args.seed)
+    docx_files = []
+    for index in range(args.docx_papers):
+        docx_file = os.path.join(tmp_dir, f"paper{index}.docx")
+        make_docx(docx_file, args.docx_paragraphs, args.docx_paragraphs // 100, seed=args.seed + index)
+        docx_files.append(docx_file)
+    xlsx_file = os.path.join(tmp_dir, "index.xlsx")
+    make_index(xlsx_file, args.rows, [os.path.basename(pdf_file) for pdf_file in pdf_files])
+    nlp_model = make_rule_model()
+    stages = {}
+
+    _, stages["xlsx_index"] = run_stage(dp.load_paper_index, [xlsx_file] * args.repeat,
+                                        [os.path.getsize(xlsx_file)] * args.repeat)
+    pdf_sizes = [os.path.getsize(pdf_file) for pdf_file in pdf_files]
+    texts, stages["pdf_text"] = run_stage(extract_text_from_pdf, pdf_files, pdf_sizes)
+    paragraphs, stages["pdf_paragraphs"] = run_stage(read_pdf_paragraphs, pdf_files, pdf_sizes)
+    _, stages["docx_text"] = run_stage(extract_text_from_docx, docx_files,
+                                       [os.path.getsize(docx_file) for docx_file in docx_files])
+    _, stages["clean_text"] = run_stage(clean_text, texts, [len(text.encode()) for text in texts])
+    entities, stages["extract_entities"] = run_stage(lambda paper: dp.extract_entities(paper, nlp_model),
+                                                     paragraphs)
+    entity_files = []
+    for index, table in enumerate(entities):
+        entity_files.append(os.path.join(tmp_dir, f"paper{index}.ents"))
+        table.save(entity_files[-1])
+    _, stages["load_entities"] = run_stage(lambda path: EntityTable.load(path).mention_counts(), entity_files,
+                                           [os.path.getsize(path) for path in entity_files])
+
+    conn = dp.get_database_connection(os.path.join(tmp_dir, "bench.sqlite"))
+    dp.setup_database(conn)
+    cur = conn.cursor()
+    resolver = EntityResolver(cur)
+    papers = [{
+        'paper_name': f"Synthetic paper {index}",
+        'paper_pdf': pdf_file,
+        'paper_docx': pdf_file + '.docx',
+        'paper_json': pdf_file + '.json',
+        'paper_entities': pdf_file + '.ents',
+    } for index, pdf_file in enumerate(pdf_files)]
+    _, stages["update_database"] = run_stage(
+        lambda item: dp.update_database(cur, item[0], item[1], item[2], resolver),
+        list(zip(papers, entities, paragraphs)))
+    conn.commit()
+
+    def run_query(question):
+        query_plan = dp.parse_user_query(question)
+        return cur.execute(query_plan.sql, query_plan.params).fetchall()
+
+    _, stages["query"] = run_stage(run_query, make_queries(args.queries, seed=args.seed))
+    conn.close()
+    return stages
+
+
+def compare(report, baseline, tolerance):
+    """
+    Compare the stages of a report with those of a baseline report.
+
+    :return: dictionary with the ratios of each stage common to both and the list of regressions
+    """
+    stages = {}
+    regressions = []
+    for name, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if previous is None:
+            continue
+        ratios = {
+            "p50": round(current["p50_ms"] / previous["p50_ms"], 3) if previous["p50_ms"] else None,
+            "p95": round(current["p95_ms"] / previous["p95_ms"], 3) if previous["p95_ms"] else None,
+            "throughput": round(current["items_per_second"] / previous["items_per_second"], 3)
+            if previous["items_per_second"] else None,
+        }
+        stages[name] = ratios
+        if ((ratios["p50"] is not None and ratios["p50"] > 1 + tolerance)
+                or (ratios["throughput"] is not None and ratios["throughput"] < 1 / (1 + tolerance))):
+            regressions.append(name)
+    return {
+        "same_config": baseline.get("config") == report["config"],
+        "tolerance": tolerance,
+        "stages": stages,
+        "regressions": regressions,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--papers", type=int, default=20, help="synthetic PDF papers")
+    parser.add_argument("--pages", type=int, default=5, help="pages per PDF paper")
+    parser.add_argument("--docx-papers", type=int, default=5, help="synthetic DOCX papers")
+    parser.add_argument("--docx-paragraphs", type=int, default=2000, help="paragraphs per DOCX paper")
+    parser.add_argument("--rows", type=int, default=10000, help="rows of the XLSX index")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5, help="reads of the XLSX index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", help="report saved by --save-baseline to compare with")
+    parser.add_argument("--save-baseline", help="write the report to this file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative slowdown of a stage reported as a regression (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    # The extractors log every file at INFO level, which would be timed with them
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stages = run_suite(tmp_dir, args)
+
+    report = {
+        "config": {name: getattr(args, name) for name in ("papers", "pages", "docx_papers", "docx_paragraphs",
+                                                          "rows", "queries", "repeat", "seed")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "stages": stages,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report["comparison"] = compare(report, json.load(baseline_file), args.tolerance)
+        status = 1 if report["comparison"]["regressions"] else 0
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
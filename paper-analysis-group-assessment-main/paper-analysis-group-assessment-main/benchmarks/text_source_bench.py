@@ -0,0 +1,151 @@
+"""
+text_source_bench.py
+Compare the two text sources of document_processor for entity extraction:
+- docx: PDF -> DOCX with pdf2docx, paragraphs read back from the DOCX (the original path)
+- pdf:  paragraphs read straight from the PDF with PyMuPDF
+
+For every paper both paths are timed (text extraction and NER) and the entities found from the
+PDF text are compared with the ones found from the DOCX text, taken as the reference: recall is
+the share of the reference (text, label) mentions also found by the fast path.
+
+Without --pdfs, synthetic papers are generated; without --model, a rule-based model that tags the
+names used in the synthetic papers stands in for en_core_web_trf, so that the benchmark measures
+text extraction rather than the model.
+
+Run from the project root:
+    python -m benchmarks.text_source_bench --papers 10 --pages 5
+    python -m benchmarks.text_source_bench --pdfs Papers/ --model en_core_web_trf
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+import fitz  # PyMuPDF
+import spacy
+from pdf2docx import parse
+
+from ingestion import document_processor as dp
+from ingestion.docx_reader import read_docx
+from ingestion.pdf_extractor import read_pdf_paragraphs
+
+PEOPLE = ["Fiona Calvert", "Alan Turing", "Ada Lovelace", "Grace Hopper", "Robert Siegler"]
+ORGANISATIONS = ["Google", "Carnegie Mellon University", "University of Oxford", "Microsoft Research"]
+FILLER = ["numerical", "board", "games", "improve", "estimation", "children", "and", "the", "of", "with",
+          "study", "results", "early", "competencies", "number", "line"]
+
+
+def make_pdfs(directory, num_papers, num_pages, seed=0):
+    """
+    Synthetic papers: pages of paragraphs wrapped over several lines, mentioning people and
+    organisations.
+
+    :return: list of paths to the PDF files
+    """
+    rng = random.Random(seed)
+    pdf_files = []
+    for paper_index in range(num_papers):
+        pdf = fitz.open()
+        for _ in range(num_pages):
+            page = pdf.new_page()
+            y = 72
+            while y < 700:
+                words = [rng.choice(FILLER) for _ in range(rng.randint(20, 50))]
+                for _ in range(rng.randint(1, 3)):
+                    words.insert(rng.randrange(len(words)), rng.choice(PEOPLE + ORGANISATIONS))
+                paragraph = " ".join(words) + "."
+                rect = fitz.Rect(72, y, 523, y + 120)
+                # insert_textbox returns the unused height, negative if the text does not fit
+                unused = page.insert_textbox(rect, paragraph, fontsize=10)
+                if unused < 0:
+                    break
+                y += 120 - unused + 12
+        pdf_file = os.path.join(directory, f"paper{paper_index}.pdf")
+        pdf.save(pdf_file)
+        pdf.close()
+        pdf_files.append(pdf_file)
+    return pdf_files
+
+
+def make_rule_model():
+    nlp_model = spacy.blank("en")
+    ruler = nlp_model.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "PERSON", "pattern": name} for name in PEOPLE]
+                       + [{"label": "ORG", "pattern": name} for name in ORGANISATIONS])
+    return nlp_model
+
+
+def docx_paragraphs(pdf_file, directory):
+    docx_file = os.path.join(directory, os.path.basename(pdf_file) + ".docx")
+    parse(pdf_file, docx_file)
+    return read_docx(docx_file).paragraphs
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def summarize(timings):
+    return {"mean_s": round(statistics.mean(timings), 4), "p50_s": round(statistics.median(timings), 4),
+            "max_s": round(max(timings), 4)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdfs", help="directory of PDF files to use instead of synthetic papers")
+    parser.add_argument("--model", help="spaCy model to load instead of the rule-based stand-in")
+    parser.add_argument("--papers", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    nlp_model = spacy.load(args.model) if args.model else make_rule_model()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.pdfs:
+            pdf_files = sorted(os.path.join(args.pdfs, name) for name in os.listdir(args.pdfs)
+                               if name.lower().endswith(".pdf"))
+        else:
+            pdf_files = make_pdfs(tmp_dir, args.papers, args.pages)
+
+        timings = {"docx": {"text": [], "ner": [], "total": []}, "pdf": {"text": [], "ner": [], "total": []}}
+        reference_mentions = 0
+        found_mentions = 0
+        fast_mentions = 0
+        for pdf_file in pdf_files:
+            mentions = {}
+            for mode, read_paragraphs in (("docx", lambda path: docx_paragraphs(path, tmp_dir)),
+                                          ("pdf", read_pdf_paragraphs)):
+                paragraphs, text_seconds = timed(read_paragraphs, pdf_file)
+                entities, ner_seconds = timed(dp.extract_entities, paragraphs, nlp_model)
+                timings[mode]["text"].append(text_seconds)
+                timings[mode]["ner"].append(ner_seconds)
+                timings[mode]["total"].append(text_seconds + ner_seconds)
+                mentions[mode] = entities.mention_counts()
+
+            reference_mentions += sum(mentions["docx"].values())
+            fast_mentions += sum(mentions["pdf"].values())
+            found_mentions += sum((mentions["docx"] & mentions["pdf"]).values())
+
+    report = {
+        "papers": len(pdf_files),
+        "docx": {stage: summarize(values) for stage, values in timings["docx"].items()},
+        "pdf": {stage: summarize(values) for stage, values in timings["pdf"].items()},
+        "speedup_per_paper": round(statistics.mean(timings["docx"]["total"])
+                                   / statistics.mean(timings["pdf"]["total"]), 2),
+        "reference_mentions": reference_mentions,
+        "recall": round(found_mentions / reference_mentions, 4) if reference_mentions else None,
+        "precision": round(found_mentions / fast_mentions, 4) if fast_mentions else None,
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+aggregates.py
+Module for the aggregate tables behind the analytical queries ("top organisations", "who is
+mentioned together with Fiona Calvert").
+
+'entity_stats' holds, per entity, the number of papers that mention it and its total number of
+mentions. 'entity_cooccurrence' holds, per entity, the entities mentioned by the same papers and in
+how many papers; for each paper only the pairs among its COOCCURRENCE_ENTITIES_PER_PAPER most
+mentioned entities are counted, and each entity keeps its COOCCURRENCE_TOP_K most frequent partners.
+Both tables are maintained by update_database in the transaction that loads the paper, so the
+queries read a handful of index entries instead of scanning 'papers_have_entities'.
+
+The co-occurrence counts are approximate: a pair dropped from the top-k of an entity starts from
+zero if it comes back, and a merge of two entities adds their partners up.
+
+We provide:
+1) AGGREGATE_TABLES           -> Statements creating the tables (schema migration 6)
+2) remove_paper_aggregates()  -> Take back the contribution of a paper before it is reloaded
+3) add_paper_aggregates()     -> Add the contribution of a paper
+4) merge_entity_aggregates()  -> Fold the aggregates of a merged entity into its target
+5) rebuild_aggregates()       -> Fill the tables from the links already stored
+"""
+
+import logging
+from itertools import groupby
+
+COOCCURRENCE_ENTITIES_PER_PAPER = 32  # most mentioned entities of a paper paired with each other
+COOCCURRENCE_TOP_K = 50  # partners kept per entity
+
+AGGREGATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS entity_stats (
+        entity_id INTEGER PRIMARY KEY,
+        entity_type TEXT NOT NULL,
+        paper_count INTEGER NOT NULL,
+        mention_count INTEGER NOT NULL,
+        FOREIGN KEY(entity_id) REFERENCES entities(entity_id)
+    )
+    """,
+    # One ranking index for every type: a type filter walks it until the limit is reached, which is
+    # cheaper than maintaining a second index on each update of a count
+    "CREATE INDEX IF NOT EXISTS idx_entity_stats_rank ON entity_stats(paper_count DESC, mention_count DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS entity_cooccurrence (
+        entity_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        paper_count INTEGER NOT NULL,
+        FOREIGN KEY(entity_id) REFERENCES entities(entity_id),
+        FOREIGN KEY(other_id) REFERENCES entities(entity_id),
+        PRIMARY KEY(entity_id, other_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_entity_cooccurrence_other ON entity_cooccurrence(other_id)",
+]
+
+
+def cooccurrence_pairs(entity_counts):
+    """
+    :param entity_counts: dictionary mapping the entity ids of a paper to their number of mentions
+    :return: list of (entity_id, other_id), both directions of every pair counted for the paper
+    """
+    ranked = sorted(entity_counts.items(), key=lambda item: (-item[1], item[0]))
+    top = [entity_id for entity_id, _ in ranked[:COOCCURRENCE_ENTITIES_PER_PAPER]]
+    return [(entity_id, other_id) for entity_id in top for other_id in top if entity_id != other_id]
+
+
+def remove_paper_aggregates(cur, paper_id):
+    """
+    Subtract the links a paper has in 'papers_have_entities' from the aggregates; call it before
+    the links are deleted.
+
+    :param cur: connection cursor
+    :param paper_id: int, paper's ID
+    """
+    entity_counts = dict(cur.execute("SELECT entity_id, count FROM papers_have_entities WHERE paper_id = ?",
+                                     (paper_id,)).fetchall())
+    if not entity_counts:
+        return
+    cur.executemany("""
+        UPDATE entity_stats SET paper_count = paper_count - 1, mention_count = mention_count - ?
+        WHERE entity_id = ?
+    """, ((count, entity_id) for entity_id, count in entity_counts.items()))
+    cur.executemany("DELETE FROM entity_stats WHERE entity_id = ? AND paper_count <= 0",
+                    ((entity_id,) for entity_id in entity_counts))
+
+    pairs = cooccurrence_pairs(entity_counts)
+    cur.executemany("""
+        UPDATE entity_cooccurrence SET paper_count = paper_count - 1 WHERE entity_id = ? AND other_id = ?
+    """, pairs)
+    cur.executemany("DELETE FROM entity_cooccurrence WHERE entity_id = ? AND other_id = ? AND paper_count <= 0",
+                    pairs)
+
+
+def add_paper_aggregates(cur, entity_counts, entity_types):
+    """
+    Add the entities of a paper to the aggregates.
+
+    :param cur: connection cursor
+    :param entity_counts: dictionary mapping the entity ids of the paper to their number of mentions
+    :param entity_types: dictionary mapping the same entity ids to their entity type
+    """
+    cur.executemany("""
+        INSERT INTO entity_stats(entity_id, entity_type, paper_count, mention_count) VALUES(?, ?, 1, ?)
+        ON CONFLICT(entity_id) DO UPDATE SET
+            paper_count = paper_count + 1,
+            mention_count = mention_count + excluded.mention_count
+    """, ((entity_id, entity_types[entity_id], count) for entity_id, count in entity_counts.items()))
+    pairs = cooccurrence_pairs(entity_counts)
+    add_cooccurrences(cur, pairs)
+    prune_cooccurrence(cur, {entity_id for entity_id, _ in pairs})
+
+
+def add_cooccurrences(cur, pairs):
+    cur.executemany("""
+        INSERT INTO entity_cooccurrence(entity_id, other_id, paper_count) VALUES(?, ?, 1)
+        ON CONFLICT(entity_id, other_id) DO UPDATE SET paper_count = paper_count + 1
+    """, pairs)
+
+
+def prune_cooccurrence(cur, entity_ids=None):
+    """
+    Keep the COOCCURRENCE_TOP_K most frequent partners of each entity.
+
+    :param cur: connection cursor
+    :param entity_ids: collection of entity ids to prune, every entity if None
+    """
+    if entity_ids is not None and not entity_ids:
+        return
+    entity_filter = ""
+    params = []
+    if entity_ids is not None:
+        entity_filter = f"WHERE entity_id IN ({', '.join('?' * len(entity_ids))})"
+        params = list(entity_ids)
+    cur.execute(f"""
+        DELETE FROM entity_cooccurrence WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, row_number() OVER (PARTITION BY entity_id ORDER BY paper_count DESC, other_id) AS rank
+                FROM entity_cooccurrence {entity_filter}
+            ) WHERE rank > ?
+        )
+    """, params + [COOCCURRENCE_TOP_K])
+
+
+def merge_entity_aggregates(cur, source_id, target_id):
+    """
+    Fold the aggregates of entity source_id into target_id, after EntityResolver.merge moved the
+    paper links of source_id to target_id.
+
+    :param cur: connection cursor
+    :param source_id: int, id of the merged entity
+    :param target_id: int, id of the entity it was merged into
+    """
+    cur.execute("DELETE FROM entity_stats WHERE entity_id IN (?, ?)", (source_id, target_id))
+    cur.execute("""
+        INSERT INTO entity_stats(entity_id, entity_type, paper_count, mention_count)
+        SELECT entities.entity_id, entities.entity_type, count(*), sum(papers_have_entities.count)
+        FROM entities
+        INNER JOIN papers_have_entities ON papers_have_entities.entity_id = entities.entity_id
+        WHERE entities.entity_id = ?
+        GROUP BY entities.entity_id
+    """, (target_id,))
+
+    cur.execute("""
+        INSERT INTO entity_cooccurrence(entity_id, other_id, paper_count)
+        SELECT ?, other_id, paper_count FROM entity_cooccurrence WHERE entity_id = ? AND other_id != ?
+        ON CONFLICT(entity_id, other_id) DO UPDATE SET paper_count = paper_count + excluded.paper_count
+    """, (target_id, source_id, target_id))
+    cur.execute("""
+        INSERT INTO entity_cooccurrence(entity_id, other_id, paper_count)
+        SELECT entity_id, ?, paper_count FROM entity_cooccurrence WHERE other_id = ? AND entity_id != ?
+        ON CONFLICT(entity_id, other_id) DO UPDATE SET paper_count = paper_count + excluded.paper_count
+    """, (target_id, source_id, target_id))
+    cur.execute("DELETE FROM entity_cooccurrence WHERE entity_id = ? OR other_id = ?", (source_id, source_id))
+    prune_cooccurrence(cur, [target_id])
+
+
+def rebuild_aggregates(cur):
+    """
+    Rebuild 'entity_stats' and 'entity_cooccurrence' from 'papers_have_entities'.
+
+    :param cur: connection cursor
+    """
+    cur.execute("DELETE FROM entity_stats")
+    cur.execute("DELETE FROM entity_cooccurrence")
+    cur.execute("""
+        INSERT INTO entity_stats(entity_id, entity_type, paper_count, mention_count)
+        SELECT entities.entity_id, entities.entity_type, count(*), sum(papers_have_entities.count)
+        FROM entities
+        INNER JOIN papers_have_entities ON papers_have_entities.entity_id = entities.entity_id
+        GROUP BY entities.entity_id
+    """)
+
+    links = cur.connection.execute("""
+        SELECT paper_id, entity_id, count FROM papers_have_entities ORDER BY paper_id
+    """)
+    papers = 0
+    for _, paper_links in groupby(links, key=lambda link: link[0]):
+        add_cooccurrences(cur, cooccurrence_pairs({entity_id: count for _, entity_id, count in paper_links}))
+        papers += 1
+    prune_cooccurrence(cur)
+    logging.info(f"Computed the entity aggregates of {papers} papers")
@@ -0,0 +1,136 @@
+"""
+chunking.py
+Module for splitting long documents into chunks that fit the NER model.
+
+Chunks are made of whole sentences (and so never cross a paragraph in the middle of a sentence),
+consecutive chunks share up to `overlap` tokens of context, and entities found in several chunks
+are merged back into one list with character offsets into the full text.
+
+We provide:
+1) join_paragraphs()        -> Full text of a document from its paragraphs
+2) chunk_spans()            -> (start_char, end_char) of each chunk of a text
+3) merge_chunk_entities()   -> Deduplicate entities found in overlapping chunks
+"""
+
+import re
+from bisect import bisect_left
+
+PARAGRAPH_SEPARATOR = "\n"
+
+# 句末标点 (可带引号/括号) 后面跟空白, 视为句子边界
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+
+def join_paragraphs(full_text_array):
+    """
+    Join the paragraphs of a document into its full text; entity offsets refer to this text.
+
+    :param full_text_array: list of text paragraphs
+    :return: str, full text
+    """
+    return PARAGRAPH_SEPARATOR.join(full_text_array)
+
+
+def _sentence_spans(text):
+    """
+    Yield (start_char, end_char) of every sentence of every paragraph, without surrounding whitespace.
+    """
+    paragraph_start = 0
+    for paragraph in text.split(PARAGRAPH_SEPARATOR):
+        sentence_start = 0
+        for match in _SENTENCE_END.finditer(paragraph):
+            yield from _trimmed_span(paragraph, paragraph_start, sentence_start, match.end())
+            sentence_start = match.end()
+        yield from _trimmed_span(paragraph, paragraph_start, sentence_start, len(paragraph))
+        paragraph_start += len(paragraph) + len(PARAGRAPH_SEPARATOR)
+
+
+def _trimmed_span(paragraph, offset, start, end):
+    sentence = paragraph[start:end]
+    stripped = sentence.strip()
+    if stripped:
+        start += len(sentence) - len(sentence.lstrip())
+        yield offset + start, offset + start + len(stripped)
+
+
+def chunk_spans(text, token_spans, max_tokens, overlap=0):
+    """
+    Split a text into chunks of at most max_tokens tokens. Chunks are packed with whole sentences;
+    a sentence longer than max_tokens is split on token boundaries. Each chunk starts with the last
+    sentences (at most `overlap` tokens) of the previous one, so that an entity near a chunk boundary
+    is also seen with its context.
+
+    :param text: str, full text
+    :param token_spans: list of (start_char, end_char) of the tokens of the text, in order
+    :param max_tokens: int, maximum number of tokens per chunk
+    :param overlap: int, maximum number of tokens shared by consecutive chunks, less than max_tokens
+    :return: list of (start_char, end_char) of the chunks
+    """
+    if overlap >= max_tokens:
+        raise ValueError("overlap must be smaller than max_tokens")
+    token_starts = [start for start, _ in token_spans]
+
+    # (start_char, end_char, first token, end token) of every sentence
+    units = []
+    for start, end in _sentence_spans(text):
+        first_token = bisect_left(token_starts, start)
+        end_token = bisect_left(token_starts, end)
+        if end_token > first_token:
+            units.append((start, end, first_token, end_token))
+
+    chunks = []
+    i = 0
+    while i < len(units):
+        # Take as many whole sentences as fit
+        j = i
+        while j < len(units) and units[j][3] - units[i][2] <= max_tokens:
+            j += 1
+
+        if j == i:
+            # A single sentence longer than max_tokens: fall back to overlapping token windows
+            first_token, end_token = units[i][2], units[i][3]
+            step = max_tokens - overlap
+            for window_start in range(first_token, end_token, step):
+                window_end = min(window_start + max_tokens, end_token)
+                chunks.append((token_spans[window_start][0], token_spans[window_end - 1][1]))
+                if window_end == end_token:
+                    break
+            i += 1
+            continue
+
+        chunks.append((units[i][0], units[j - 1][1]))
+        if j == len(units):
+            break
+
+        # Start the next chunk with the trailing sentences that fit in the overlap, and leave room
+        # for the next sentence: a chunk that ends where this one does would only repeat it
+        k = j
+        while k - 1 > i and units[j - 1][3] - units[k - 1][2] <= overlap:
+            k -= 1
+        while k < j and units[j][3] - units[k][2] > max_tokens:
+            k += 1
+        i = k
+
+    return chunks
+
+
+def merge_chunk_entities(entities):
+    """
+    Merge the entities of overlapping chunks. The same entity found in two chunks has the same
+    offsets and is kept once; when entities of different chunks overlap without being equal (one
+    was cut short by a chunk boundary), the longer one is kept.
+
+    :param entities: list of entity dictionaries with start_char, end_char, label and chunk
+    :return: list of entity dictionaries sorted by start_char, without overlaps between chunks
+    """
+    entities = sorted(entities, key=lambda ent: (ent['start_char'], ent['start_char'] - ent['end_char']))
+    merged = []
+    for ent in entities:
+        if merged and ent['start_char'] < merged[-1]['end_char']:
+            previous = merged[-1]
+            if ent['chunk'] != previous['chunk']:
+                if ent['end_char'] - ent['start_char'] > previous['end_char'] - previous['start_char']:
+                    merged[-1] = ent
+                continue
+        merged.append(ent)
+    return merged
@@ -6,11 +6,20 @@ We provide:
 1) clean_text()       -> Basic text-level cleaning
 2) normalize_text()   -> Optional advanced normalization (like full-width to half-width, etc.)
 3) clean_row()        -> For Excel row data cleaning
+4) clean_text_stream(), normalize_text_stream() -> The same for text arriving in pieces (e.g. PDF pages)
+5) clean_texts(), clean_rows() -> Batch versions for a list/column of strings and for many rows
+
+Passes that cannot change the text are skipped, the remaining regex is precompiled and space runs
+are collapsed with str.replace instead of a regex match per space.
 """
 
 import re
 import unicodedata
 
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+# clean_texts() 用来拼接一批字符串的分隔符, 它不是空白, 所以不会和相邻的空白连成一串
+_BATCH_SEPARATOR = "\x00"
+
 def clean_text(text: str) -> str:
     """
     Basic text cleaning steps:
@@ -24,15 +33,28 @@ def clean_text(text: str) -> str:
     """
     # 1) 去掉首尾空白
     text = text.strip()
+    return _collapse_whitespace(text)
+
 
+def _collapse_whitespace(text: str) -> str:
+    """
+    Steps 2) to 4) of clean_text(). Every change happens inside a run of whitespace, so a text can be
+    split anywhere outside such a run and cleaned piece by piece.
+    """
     # 2) 把 Windows/Mac 的换行符统一成 \n
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
 
     # 3) 去掉多余换行（比如连续空行），保留一个空行
-    text = re.sub(r"\n\s*\n+", "\n\n", text)
+    if "\n" in text:
+        text = _BLANK_LINES.sub("\n\n", text)
 
-    # 4) 去掉多余空格（例如把多个连续空格变为1个）
-    text = re.sub(r"[ \t]+", " ", text)
+    # 4) 去掉多余空格: tab 换成空格, 再把连续空格两两合并, 直到没有连续空格
+    #    (等价于 re.sub(r"[ \t]+", " ", text), 但不用对每个空格都做一次正则匹配)
+    if "\t" in text:
+        text = text.replace("\t", " ")
+    while "  " in text:
+        text = text.replace("  ", " ")
 
     return text
 
@@ -56,6 +78,86 @@ def normalize_text(text: str) -> str:
     return text
 
 
+def clean_text_stream(pieces):
+    """
+    Streaming version of clean_text(): clean text that arrives piece by piece without joining it.
+    Trailing whitespace of each piece is held back and merged with the next one, so the output
+    concatenates to exactly clean_text("".join(pieces)) while memory depends on the piece size.
+
+    :param pieces: iterable of raw text pieces
+    :return: generator of cleaned text pieces
+    """
+    pending = ""
+    started = False
+    for piece in pieces:
+        text = pending + piece
+        body = text.rstrip()
+        pending = text[len(body):]
+        if not started:
+            # 去掉开头的空白
+            body = body.lstrip()
+            if not body:
+                pending = ""
+                continue
+            started = True
+        if body:
+            yield _collapse_whitespace(body)
+    # 结尾的空白直接丢弃 (相当于 strip)
+
+
+def normalize_text_stream(pieces):
+    """
+    Streaming version of normalize_text().
+
+    :param pieces: iterable of cleaned text pieces, e.g. from clean_text_stream()
+    :return: generator of normalized text pieces
+    """
+    for piece in pieces:
+        yield normalize_text(piece)
+
+
+def clean_texts(texts) -> list:
+    """
+    Batch version of clean_text(): clean a list (or any iterable, e.g. a column) of strings in one call.
+    The stripped strings are joined with a separator and cleaned in a single regex scan.
+
+    :param texts: iterable of strings
+    :return: list of cleaned strings, same length and order
+    """
+    stripped = [text.strip() for text in texts]
+    if not stripped:
+        return []
+    joined = _BATCH_SEPARATOR.join(stripped)
+    if joined.count(_BATCH_SEPARATOR) != len(stripped) - 1:
+        # 字符串里本身含有分隔符, 只能逐个清洗
+        return [_collapse_whitespace(text) for text in stripped]
+    return _collapse_whitespace(joined).split(_BATCH_SEPARATOR)
+
+
+def clean_rows(rows) -> list:
+    """
+    Batch version of clean_row(): clean many rows at once; the string cells of all rows are cleaned
+    together by clean_texts().
+
+    :param rows: iterable of rows, each a list/tuple of cells
+    :return: list of cleaned rows (lists of strings)
+    """
+    rows = [row for row in rows]
+    cells = [cell for row in rows for cell in row]
+    cleaned_texts = iter(clean_texts([cell for cell in cells if isinstance(cell, str)]))
+    cleaned_cells = ["" if cell is None else next(cleaned_texts) if isinstance(cell, str) else str(cell)
+                     for cell in cells]
+
+    # 按原来每行的长度切回一行一行
+    cleaned_rows = []
+    start = 0
+    for row in rows:
+        end = start + len(row)
+        cleaned_rows.append(cleaned_cells[start:end])
+        start = end
+    return cleaned_rows
+
+
 def clean_row(row_data: list) -> list:
     """
     Clean each cell of a row from Excel or CSV.
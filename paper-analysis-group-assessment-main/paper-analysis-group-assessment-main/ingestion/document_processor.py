@@ -6,23 +6,33 @@ It converts the paper PDF files to DOCX format, extracts entities from the text
 """
 
 import os
+import sys
+import argparse
 from os.path import exists
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib.metadata import version as package_version
 from pathlib import Path
 import json
 import sqlite3
+from collections import Counter, namedtuple
+from functools import lru_cache
 import logging
-
-import openpyxl
-import docx
-from docx.opc.exceptions import PackageNotFoundError
-from pdf2docx import parse
-from simplify_docx import simplify
-import spacy
-import torch
-from prompt_toolkit import prompt
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.completion import WordCompleter
+import queue
+import threading
+import time
+
+# spaCy, torch, pdf2docx, PyMuPDF, openpyxl and prompt_toolkit are imported by the functions that use
+# them: querying an existing database must not pay for loading the ingestion stack.
+from ingestion.aggregates import (AGGREGATE_TABLES, add_paper_aggregates, merge_entity_aggregates,
+                                  rebuild_aggregates, remove_paper_aggregates)
+from ingestion.chunking import chunk_spans, join_paragraphs, merge_chunk_entities
+from ingestion.docx_reader import READER_VERSION, read_docx
+from ingestion.entity_resolver import EntityResolver, normalize_entity_name, rebuild_entity_variants
+from ingestion.entity_store import FILE_SUFFIX as ENTS_SUFFIX, EntityTable
+from ingestion.instrumentation import PROFILE_FILE, TRACE_FILE, TRACE_MEMORY, Instrumentation, PaperTrace, stage_timer
+from ingestion.manifest import Manifest, atomic_path, atomic_write, file_digest, is_stage_fresh, record_stage
+from ingestion.pipeline import StageMetrics, format_stage_metrics, iter_queue, run_batched, run_in_processes, start_stage
+from ingestion.query_cache import GENERATION_TABLE, QueryCache, bump_generation
 
 # Constants for file paths and configurations
 SOURCE_PATH = "Papers/"
@@ -30,20 +40,196 @@ DOCS_PATH = "Docs/"
 JSON_PATH = "JSON/"
 ENTS_PATH = "Ents/"
 DB_FILE = "data/test_db.sqlite"
+MANIFEST_FILE = "data/manifest.json"
+PIPELINE_VERSION = "1"  # bump to force every stage to rerun
+DB_CACHE_SIZE_KIB = int(os.environ.get("PSD_DB_CACHE_KIB", 64 * 1024))
+DB_MMAP_SIZE = int(os.environ.get("PSD_DB_MMAP_SIZE", 256 * 1024 * 1024))
 MAX_TOKEN_LENGTH = 512
+CHUNK_OVERLAP = 64  # tokens of context shared by consecutive NER chunks
+SEARCH_RESULT_LIMIT = 20
+TOP_RESULT_LIMIT = 10  # entities listed by 'top' and 'cooccur' without a number
+QUERY_CACHE_SIZE = 256  # distinct query shapes kept as SQL text / prepared statements
+NUM_WORKERS = int(os.environ.get("PSD_WORKERS", os.cpu_count() or 1))
+NER_BATCH_SIZE = 32  # text chunks per nlp.pipe batch
+NER_N_PROCESS = 1  # nlp.pipe worker processes
+NER_PAPERS_PER_BATCH = 8  # converted papers buffered before running NER over them together
+PIPELINE_QUEUE_SIZE = 16  # papers waiting between two pipeline stages
+DB_COMMIT_EVERY = int(os.environ.get("PSD_COMMIT_EVERY", 8))  # papers written per database transaction
+# Where NER reads the text of a paper: 'docx' from the DOCX rebuilt by pdf2docx, 'pdf' straight from
+# the text layer of the PDF, which skips the slow layout conversion
+TEXT_SOURCES = ('docx', 'pdf')
+TEXT_SOURCE = os.environ.get("PSD_TEXT_SOURCE", "docx")
+# With the 'pdf' text source, still write the DOCX/JSON files, after the papers are loaded
+BUILD_LAYOUT = os.environ.get("PSD_BUILD_LAYOUT", "1") != "0"
+
+# A SQL query and the values bound to its '?' placeholders
+QueryPlan = namedtuple('QueryPlan', ['sql', 'params'])
+
+SEARCH_QUERY = """
+    SELECT papers.*, matches.score, matches.paragraphs
+    FROM (
+        SELECT paper_paragraphs.paper_id AS paper_id,
+               min(paper_text.rank) AS score,
+               count(*) AS paragraphs
+        FROM paper_text
+        INNER JOIN paper_paragraphs ON paper_paragraphs.paragraph_id = paper_text.rowid
+        WHERE paper_text MATCH ?
+        GROUP BY paper_paragraphs.paper_id
+    ) AS matches
+    INNER JOIN papers ON papers.paper_id = matches.paper_id
+    ORDER BY matches.score
+    LIMIT ?
+"""
+
+# Entity type words of the 'top' and 'cooccur' questions, singular and plural
+ENTITY_TYPE_WORDS = {
+    'person': 'PERSON', 'people': 'PERSON', 'persons': 'PERSON',
+    'organisation': 'ORG', 'organisations': 'ORG',
+    'work': 'WORK_OF_ART', 'works': 'WORK_OF_ART',
+}
+
+TOP_ENTITIES_QUERY = """
+    SELECT entities.entity_name, entity_stats.entity_type, entity_stats.paper_count, entity_stats.mention_count
+    FROM entity_stats
+    INNER JOIN entities ON entities.entity_id = entity_stats.entity_id{type_filter}
+    ORDER BY entity_stats.paper_count DESC, entity_stats.mention_count DESC
+    LIMIT ?
+"""
+
+COOCCURRENCE_QUERY = """
+    SELECT entities.entity_name, entities.entity_type, sum(entity_cooccurrence.paper_count) AS papers
+    FROM entity_cooccurrence
+    INNER JOIN entities ON entities.entity_id = entity_cooccurrence.other_id
+    WHERE entity_cooccurrence.entity_id IN (
+        SELECT entity_id FROM entities WHERE entity_name = ?{type_filter}
+        UNION SELECT entity_id FROM entity_variants WHERE variant_key = ?{type_filter}
+    ){partner_filter}
+    GROUP BY entity_cooccurrence.other_id
+    ORDER BY papers DESC, entities.entity_name
+    LIMIT ?
+"""
+
+# Schema changes applied on top of the tables created by setup_database, one list of statements
+# per version. Never edit a released entry, append a new one.
+SCHEMA_MIGRATIONS = [
+    # 1: covering indexes for the query workload. Filters on entity_name (+ entity_type) are served
+    # by the UNIQUE(entity_name, entity_type) index; filters on entity_type alone need their own, and
+    # papers_have_entities needs a paper_id-first index for paper-side joins and per-paper deletes.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_entities_type_name ON entities(entity_type, entity_name)",
+        "CREATE INDEX IF NOT EXISTS idx_papers_have_entities_paper "
+        "ON papers_have_entities(paper_id, entity_id, count)",
+    ],
+    # 2: full-text search over paragraph text. 'paper_text' is an external-content FTS5 index over
+    # 'paper_paragraphs', so the text is stored once and a paper's paragraphs can be replaced
+    # through the paper_id index.
+    [
+        """
+        CREATE TABLE IF NOT EXISTS paper_paragraphs (
+            paragraph_id INTEGER PRIMARY KEY,
+            paper_id INTEGER NOT NULL,
+            paragraph_index INTEGER NOT NULL,
+            paragraph_text TEXT NOT NULL,
+            FOREIGN KEY(paper_id) REFERENCES papers(paper_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_paper_paragraphs_paper ON paper_paragraphs(paper_id)",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS paper_text USING fts5(
+            paragraph_text,
+            content='paper_paragraphs',
+            content_rowid='paragraph_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS paper_paragraphs_after_insert AFTER INSERT ON paper_paragraphs BEGIN
+            INSERT INTO paper_text(rowid, paragraph_text) VALUES (new.paragraph_id, new.paragraph_text);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS paper_paragraphs_after_delete AFTER DELETE ON paper_paragraphs BEGIN
+            INSERT INTO paper_text(paper_text, rowid, paragraph_text)
+            VALUES ('delete', old.paragraph_id, old.paragraph_text);
+        END
+        """,
+    ],
+    # 3: normalized entity dictionary. 'entity_variants' (created by setup_database) maps the
+    # normalized surface forms of names to canonical entities; it is filled from the entities already
+    # stored, merging the ones that are variants of the same name. Entries may be callables taking
+    # the cursor.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_entity_variants_entity ON entity_variants(entity_id)",
+        rebuild_entity_variants,
+    ],
+    # 4: ingestion journal, written in the same transaction as the paper it describes. 'loaded' papers
+    # whose PDF (size, mtime) and stage versions are unchanged are skipped by the next run; 'failed'
+    # papers are the dead letters, only processed again with retry_failed or when their PDF changes.
+    [
+        """
+        CREATE TABLE IF NOT EXISTS ingest_journal (
+            paper_pdf TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            pdf_size INTEGER,
+            pdf_mtime_ns INTEGER,
+            versions TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ingest_journal_status ON ingest_journal(status)",
+    ],
+    # 5: generation counter of the papers and entities, bumped by every write so that query results
+    # cached by the query prompt (query_cache.QueryCache) are dropped when the data changes.
+    [
+        GENERATION_TABLE,
+        "INSERT OR IGNORE INTO data_generation(id, generation) VALUES(0, 0)",
+    ],
+    # 6: aggregate tables of the 'top' and 'cooccur' questions (see aggregates), maintained by
+    # update_database and filled here from the papers already loaded.
+    [
+        *AGGREGATE_TABLES,
+        rebuild_aggregates,
+    ],
+]
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
 
-def get_database_connection(db_file):
+def get_database_connection(db_file, tuned=True, cache_size_kib=DB_CACHE_SIZE_KIB, mmap_size=DB_MMAP_SIZE):
     """
     Create a database connection to a SQLite database.
 
     :param db_file: str, path to the SQLite database file.
+    :param tuned: bool, apply the performance profile (False keeps SQLite defaults, for comparison)
+    :param cache_size_kib: int, page cache size in KiB
+    :param mmap_size: int, number of bytes of the database file to memory-map
     :returns: sqlite3.Connection: A connection object to the SQLite database.
     """
-    return sqlite3.connect(db_file)
+    # Keep a prepared statement for every cached query shape
+    conn = sqlite3.connect(db_file, cached_statements=QUERY_CACHE_SIZE)
+    if tuned:
+        configure_connection(conn, cache_size_kib, mmap_size)
+    return conn
+
+
+def configure_connection(conn, cache_size_kib=DB_CACHE_SIZE_KIB, mmap_size=DB_MMAP_SIZE):
+    """
+    Apply the performance profile to a connection: WAL journal, so readers do not block the writer,
+    synchronous NORMAL, which is durable in WAL mode except for the last commits on power loss,
+    a larger page cache, memory-mapped reads and in-memory temp tables.
+
+    :param conn: connection to a SQLite database
+    :param cache_size_kib: int, page cache size in KiB
+    :param mmap_size: int, number of bytes of the database file to memory-map
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{int(cache_size_kib)}")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
 
 
 def load_paper_index(xlsx_path):
@@ -53,31 +239,62 @@ def load_paper_index(xlsx_path):
     :param path to Excel file.
     :returns: list of dictionaries containing the information of papers to precess.
     """
-    workbook = openpyxl.load_workbook(xlsx_path, data_only=True)
-    index_sheet = workbook['Sheet1']
-    headers = [cell.value.strip() for cell in index_sheet[1]]
-    papers_to_process = []
+    return list(iter_paper_index(xlsx_path))
+
+
+def iter_paper_index(xlsx_path):
+    """
+    Stream the paper index from given path: the workbook is read in read-only mode and papers are
+    yielded one row at a time. Rows are only logged at DEBUG level, with a progress line at INFO
+    level every LOG_EVERY_ROWS rows.
+
+    :param path to Excel file.
+    :returns: generator of dictionaries containing the information of papers to precess.
+    """
+    from ingestion.excel_extractor import iter_rows_from_excel
 
-    for row in index_sheet.iter_rows(min_row=2):  # Ignore header row
+    rows = iter_rows_from_excel(xlsx_path, sheet_name='Sheet1')
+    header_row = next(rows, None)
+    if header_row is None:
+        return
+    headers = [value.strip() if isinstance(value, str) else value for value in header_row]
+
+    for row in rows:
         # Create a dictionary for each row with headers as keys
-        row_dict = {key: cell.value for key, cell in zip(headers, row)}
-        logging.info(f"Processed row: {row_dict}")
+        row_dict = dict(zip(headers, row))
+        # Lazy %-formatting: the message is only built when DEBUG is enabled
+        logging.debug("Processed row: %s", row_dict)
+        if not row_dict.get('paper_pdf'):
+            # Read-only sheets can report trailing empty rows
+            continue
 
         # Construct file paths
-        row_dict['paper_docx'] = os.path.join(DOCS_PATH, row_dict['paper_pdf'] + '.docx')
-        row_dict['paper_json'] = os.path.join(JSON_PATH, row_dict['paper_pdf'] + '.json')
-        row_dict['paper_entities'] = os.path.join(ENTS_PATH, row_dict['paper_pdf'] + '.json')
-        row_dict['paper_pdf'] = os.path.join(SOURCE_PATH, row_dict['paper_pdf'])
-        papers_to_process.append(row_dict)
+        row_dict.update(paper_paths(row_dict['paper_pdf']))
+        yield row_dict
 
-    return papers_to_process
 
+def paper_paths(pdf_name, source_path=SOURCE_PATH):
+    """
+    Paths of the files of a paper, from the file name of its PDF.
 
-def setup_database(conn):
+    :param pdf_name: str, file name of the PDF as listed in the index
+    :param source_path: str, directory of the PDF
+    :returns: dictionary with paper_pdf, paper_docx, paper_json and paper_entities
     """
-    Create tables: papers, entities and papers_have_entities
+    return {
+        'paper_pdf': os.path.join(source_path, pdf_name),
+        'paper_docx': os.path.join(DOCS_PATH, pdf_name + '.docx'),
+        'paper_json': os.path.join(JSON_PATH, pdf_name + '.json'),
+        'paper_entities': os.path.join(ENTS_PATH, pdf_name + ENTS_SUFFIX),
+    }
+
+
+def setup_database(conn, migrate=True):
+    """
+    Create tables: papers, entities, entity_variants and papers_have_entities
 
     :param conn: connection to a SQLite database
+    :param migrate: bool, bring the schema up to the latest version with migrate_database
     """
     cur = conn.cursor()
     # Create 'papers' table
@@ -100,6 +317,16 @@ def setup_database(conn):
             UNIQUE(entity_name, entity_type)
         );
     """)
+    # Create 'entity_variants' table: normalized name -> canonical entity, NULL if ambiguous
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS entity_variants (
+            variant_key TEXT NOT NULL,
+            entity_type TEXT NOT NULL,
+            entity_id INTEGER,
+            FOREIGN KEY(entity_id) REFERENCES entities(entity_id),
+            PRIMARY KEY(variant_key, entity_type)
+        );
+    """)
     # Create 'papers_have_entities' table
     cur.execute("""
         CREATE TABLE IF NOT EXISTS papers_have_entities (
@@ -111,6 +338,30 @@ def setup_database(conn):
             PRIMARY KEY(entity_id, paper_id)
         );
     """)
+    conn.commit()
+
+    if migrate:
+        migrate_database(conn)
+
+
+def migrate_database(conn):
+    """
+    Apply the SCHEMA_MIGRATIONS the database has not seen yet. The schema version is kept in
+    PRAGMA user_version and each migration is committed together with its version bump.
+
+    :param conn: connection to a SQLite database
+    """
+    cur = conn.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    for target_version, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            if callable(statement):
+                statement(cur)
+            else:
+                cur.execute(statement)
+        cur.execute(f"PRAGMA user_version={target_version}")
+        conn.commit()
+        logging.info(f"Migrated database to schema version {target_version}")
 
 
 def load_nlp_model():
@@ -119,124 +370,814 @@ def load_nlp_model():
 
     :returns: spacy.Language: loaded spaCy NLP model.
     """
+    import spacy
+
     return spacy.load("en_core_web_trf")
 
 
-def process_documents(papers_to_process, nlp_model, conn):
+def get_stage_versions(nlp_model, text_source=TEXT_SOURCE):
+    """
+    Versions of the code and model behind each processing stage. A change of version makes the
+    stage rerun even if its input is unchanged.
+
+    :param nlp_model: spaCy NLP model
+    :param text_source: str, one of TEXT_SOURCES; the entities depend on where the text was read
+    :returns: dictionary mapping stage names to version strings
+    """
+    if text_source not in TEXT_SOURCES:
+        raise ValueError(f"Unknown text source {text_source!r}, expected one of {TEXT_SOURCES}")
+    entities_version = (f"{PIPELINE_VERSION}/{nlp_model.meta.get('lang')}_{nlp_model.meta.get('name')}"
+                        f"-{nlp_model.meta.get('version')}/{MAX_TOKEN_LENGTH}-{CHUNK_OVERLAP}")
+    if text_source == 'pdf':
+        entities_version += f"/pdf-pymupdf-{package_version('PyMuPDF')}"
+    return {
+        'docx': f"{PIPELINE_VERSION}/pdf2docx-{package_version('pdf2docx')}",
+        'json': f"{PIPELINE_VERSION}/docx-reader-{READER_VERSION}",
+        'entities': entities_version,
+        # The schema version is part of it so that new tables are filled for papers already loaded
+        'database': f"{PIPELINE_VERSION}/schema-{len(SCHEMA_MIGRATIONS)}",
+    }
+
+
+def get_versions_key(versions):
+    """
+    :param versions: dictionary of stage versions
+    :returns: str, the versions as recorded in the journal
+    """
+    return json.dumps(versions, sort_keys=True)
+
+
+def process_documents(papers_to_process, nlp_model, conn, workers=1, manifest=None, text_source=TEXT_SOURCE,
+                      build_layout=BUILD_LAYOUT, instrumentation=None, commit_every=DB_COMMIT_EVERY,
+                      retry_failed=False):
     """
     Process files_to_proces in source_path by implementing named entity recognitnion via nlp and updating
     tables in the database.
 
+    Processing is split into three stages: conversion (PDF->DOCX and DOCX simplification), NER and
+    the database writer. With workers > 1 they run as a pipeline (see iter_pipelined_documents):
+    conversion in a pool of worker processes, NER in a thread over batches of converted papers and
+    the writer in this thread, which owns the SQLite connection. The stages are joined by queues of
+    at most PIPELINE_QUEUE_SIZE papers, so the model is busy while the next papers are converted and
+    the run takes about as long as its slowest stage. With workers == 1 the stages run one after the
+    other in-process. A paper that fails is logged and reported, the rest of the batch carries on.
+
+    NER runs over up to NER_PAPERS_PER_BATCH papers at a time, so the chunks of several papers share
+    nlp.pipe batches. Entity mentions are resolved by one EntityResolver, warmed from the database
+    once per run.
+
+    The run is checkpointed: the database writes of each paper happen in a savepoint, so a paper
+    that fails halfway leaves nothing behind, and are committed every commit_every papers together
+    with the manifest. The outcome of each paper is recorded in table 'ingest_journal' in the same
+    transaction. A rerun skips the papers the journal shows as loaded from an unchanged PDF with the
+    same stage versions, without hashing them, and so continues where a crashed run stopped. Failed
+    papers are kept in the journal as dead letters with their error and number of attempts; they
+    are skipped until their PDF changes, and retry_failed processes only them.
+
+    Each paper gets a PaperTrace (stage durations, sizes, entity counts, resolver cache hits) that
+    is written to the trace file of the instrumentation when the paper is done; a summary of the
+    stages and the slowest papers is logged at the end of the run.
+
+    Every stage is skipped when the manifest shows it already ran on the same input with the same
+    version, so reprocessing an unchanged corpus only costs hashing the PDFs.
+
+    With text_source 'pdf' the text is read from the PDF and the conversion stage does not build
+    the DOCX; the DOCX/JSON files are then written after all papers are loaded (see build_layouts),
+    or not at all if build_layout is False.
+
     :param papers_to_process: list of dictionaries containing the information of papers to precess
     :param nlp_model: spaCy NLP model
     :param conn: connection to SQLite database
+    :param workers: int, number of conversion worker processes (1 runs everything in-process)
+    :param manifest: Manifest of stage records, loaded from MANIFEST_FILE if not given
+    :param text_source: str, one of TEXT_SOURCES
+    :param build_layout: bool, write the DOCX/JSON files when the text source is 'pdf'
+    :param instrumentation: Instrumentation collecting the paper traces, configured from the
+        environment if not given
+    :param commit_every: int, papers written per database transaction
+    :param retry_failed: bool, process only the papers that failed in earlier runs
+    :returns: dictionary mapping the pdf path of each failed paper to its error message
     """
     cur = conn.cursor()
+    instrumentation = instrumentation or Instrumentation()
     processed_files = []
-
-    for paper in papers_to_process:
-        process_single_document(paper, nlp_model, cur)
-        processed_files.append(paper['paper_pdf'])
+    failed_files = {}
+    loaded_papers = []
+    if manifest is None:
+        manifest = Manifest(MANIFEST_FILE)
+    versions = get_stage_versions(nlp_model, text_source)
+    versions_key = get_versions_key(versions)
+    resolver = EntityResolver(cur)
+
+    papers_to_process = iter_unfinished_papers(papers_to_process, load_journal(cur), versions_key, retry_failed,
+                                               instrumentation)
+    jobs = ((paper, manifest.get(paper['paper_pdf']), versions, text_source) for paper in papers_to_process)
+    stage_metrics = [StageMetrics('convert', workers), StageMetrics('ner'), StageMetrics('database')]
+    if workers > 1:
+        documents = iter_pipelined_documents(jobs, nlp_model, versions, workers, stage_metrics, instrumentation)
+    else:
+        documents = iter_extracted_documents(jobs, nlp_model, versions, stage_metrics, instrumentation)
+
+    database_metrics = stage_metrics[-1]
+    uncommitted = 0
+    for document in documents:
+        start = time.perf_counter()
+        if write_document(document, cur, manifest, versions, resolver, instrumentation, processed_files,
+                          failed_files):
+            loaded_papers.append(document[0])
+
+        uncommitted += 1
+        if uncommitted >= commit_every:
+            conn.commit()
+            manifest.save()
+            uncommitted = 0
+        database_metrics.record(1, time.perf_counter() - start)
+    database_metrics.finish()
 
     logging.info(f"Processed files: {processed_files}")
+    if failed_files:
+        logging.warning(f"Failed files: {list(failed_files)}")
+    logging.info("Pipeline stages:\n" + format_stage_metrics(stage_metrics))
+    logging.info(f"Entity resolver: {resolver.stats()}")
+    logging.info("Paper traces:\n" + instrumentation.format_summary())
+    instrumentation.close()
     conn.commit()
+    manifest.save()
+
+    if text_source == 'pdf' and build_layout:
+        build_layouts(loaded_papers, manifest, versions, workers)
+    return failed_files
 
 
-def process_single_document(paper, nlp_model, cur):
+def write_document(document, cur, manifest, versions, resolver, instrumentation, processed_files, failed_files):
     """
-    Process a paper in the form of docx and extracts entities from the full text,
-    stores the results in JSON and the database
+    Write one paper of a run to the database in a savepoint and journal the outcome. A paper that
+    fails leaves nothing behind but its journal row. The caller commits.
 
-    :param file_dict: name, pdf, docx, json files and entities of a file
-    :param nlp_model: NLP processing module from spaCy
+    :param document: tuple returned by extract_document_entities, or (paper, None, None, None,
+        exception) if the paper could not be converted
+    :param cur: connection cursor
+    :param manifest: Manifest the stage records of the paper are stored in
+    :param versions: dictionary of stage versions
+    :param resolver: EntityResolver of the run
+    :param instrumentation: Instrumentation of the run; the trace of the paper is finished
+    :param processed_files: list the pdf path of the paper is appended to if it is loaded
+    :param failed_files: dictionary the pdf path and error of the paper are added to if it failed
+    :returns: bool, True if the paper was loaded
+    """
+    paper, _, records, _, error = document
+    versions_key = get_versions_key(versions)
+    if records is not None:
+        manifest.update(paper['paper_pdf'], records)
+    if not cur.connection.in_transaction:
+        # Keep the savepoints below nested in the batch transaction, releasing an outermost
+        # savepoint would commit
+        cur.execute("BEGIN")
+    cur.execute("SAVEPOINT paper")
+    if error is not None:
+        logging.error(f"Failed to process {paper['paper_pdf']}: {error}")
+        failed_files[paper['paper_pdf']] = str(error)
+    else:
+        with stage_timer(instrumentation.trace(paper['paper_pdf']), 'database'):
+            load_documents([document], cur, versions, processed_files, failed_files, resolver, instrumentation)
+
+    loaded = paper['paper_pdf'] not in failed_files
+    if not loaded:
+        cur.execute("ROLLBACK TO paper")
+        # The resolver may remember entities of the rolled back writes
+        resolver.invalidate()
+        journal_paper(cur, paper, versions_key, failed_files[paper['paper_pdf']])
+        instrumentation.finish(paper['paper_pdf'], 'failed', failed_files[paper['paper_pdf']])
+    else:
+        journal_paper(cur, paper, versions_key)
+        instrumentation.finish(paper['paper_pdf'])
+    cur.execute("RELEASE paper")
+    return loaded
+
+
+def pdf_fingerprint(pdf_file):
+    """
+    Cheap change detection for the journal: size and modification time of a PDF.
+
+    :returns: (size in bytes, mtime in ns), (None, None) if the file does not exist
+    """
+    try:
+        stat = os.stat(pdf_file)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_journal(cur):
+    """
+    :param cur: connection cursor
+    :returns: dictionary mapping the pdf path of each journaled paper to its row, as a dictionary
+    """
+    cur.execute("SELECT paper_pdf, status, attempts, error, pdf_size, pdf_mtime_ns, versions FROM ingest_journal")
+    columns = [column[0] for column in cur.description]
+    return {row[0]: dict(zip(columns, row)) for row in cur.fetchall()}
+
+
+def journal_paper(cur, paper, versions_key, error=None):
+    """
+    Record the outcome of a paper in table 'ingest_journal': loaded, or failed with its error. The
+    attempts count the failures in a row and are reset when the paper loads.
+
+    :param cur: connection cursor
+    :param paper: name, pdf, docx, json files and entities of a paper, and optionally the
+        pdf_fingerprint of the PDF it was processed from, if the PDF may have changed since
+    :param versions_key: str, stage versions the paper was processed with
+    :param error: exception or message if the paper failed
+    """
+    pdf_size, pdf_mtime_ns = paper.get('pdf_fingerprint') or pdf_fingerprint(paper['paper_pdf'])
+    cur.execute("""
+        INSERT INTO ingest_journal(paper_pdf, status, attempts, error, pdf_size, pdf_mtime_ns, versions, updated_at)
+        VALUES(:paper_pdf, :status, :attempts, :error, :pdf_size, :pdf_mtime_ns, :versions, :updated_at)
+        ON CONFLICT(paper_pdf) DO UPDATE SET
+            status=excluded.status,
+            attempts=CASE WHEN excluded.status = 'failed' THEN attempts + 1 ELSE 0 END,
+            error=excluded.error,
+            pdf_size=excluded.pdf_size,
+            pdf_mtime_ns=excluded.pdf_mtime_ns,
+            versions=excluded.versions,
+            updated_at=excluded.updated_at
+    """, {
+        'paper_pdf': paper['paper_pdf'],
+        'status': 'loaded' if error is None else 'failed',
+        'attempts': 0 if error is None else 1,
+        'error': None if error is None else str(error),
+        'pdf_size': pdf_size,
+        'pdf_mtime_ns': pdf_mtime_ns,
+        'versions': versions_key,
+        'updated_at': time.time(),
+    })
+
+
+def get_dead_letters(cur):
+    """
     :param cur: connection cursor
+    :returns: list of (paper_pdf, attempts, error, updated_at) of the papers that failed, most recent first
+    """
+    cur.execute("""
+        SELECT paper_pdf, attempts, error, updated_at FROM ingest_journal
+        WHERE status = 'failed'
+        ORDER BY updated_at DESC
+    """)
+    return cur.fetchall()
+
+
+def iter_unfinished_papers(papers, journal, versions_key, retry_failed=False, instrumentation=None):
+    """
+    Filter the papers of a run through the journal of earlier runs. A paper is skipped when its
+    journal row has the same stage versions and PDF fingerprint: loaded papers because there is
+    nothing left to do, failed papers (dead letters) because they would fail again. With
+    retry_failed only the failed papers are processed, whether or not they changed.
+
+    :param papers: iterable of dictionaries containing the information of papers
+    :param journal: dictionary returned by load_journal
+    :param versions_key: str, stage versions of this run
+    :param retry_failed: bool, process only the dead letters
+    :param instrumentation: Instrumentation counting the skipped papers
+    :returns: generator of the papers to process
+    """
+    skipped = Counter()
+    for paper in papers:
+        entry = journal.get(paper['paper_pdf'])
+        if retry_failed:
+            if entry is None or entry['status'] != 'failed':
+                continue
+        elif (entry is not None and entry['versions'] == versions_key
+                and (entry['pdf_size'], entry['pdf_mtime_ns']) == pdf_fingerprint(paper['paper_pdf'])):
+            skipped[entry['status']] += 1
+            continue
+        yield paper
+
+    if skipped:
+        logging.info(f"Skipped {skipped['loaded']} papers already loaded and {skipped['failed']} papers that "
+                     f"failed before (retry_failed processes them)")
+    if instrumentation is not None:
+        for status, count in skipped.items():
+            instrumentation.count(f"journal_skipped_{status}", count)
+
+
+def build_layouts(papers, manifest, versions, workers=1):
+    """
+    Deferred conversion for the 'pdf' text source: write the DOCX and JSON files of papers whose
+    text has already been loaded. A failure is only logged, the paper stays loaded.
+
+    :param papers: list of dictionaries containing the information of papers
+    :param manifest: Manifest of stage records, updated and saved
+    :param versions: dictionary of stage versions
+    :param workers: int, number of conversion worker processes
+    """
+    def report(paper, records, error):
+        if error is not None:
+            logging.warning(f"Failed to build the DOCX/JSON of {paper['paper_pdf']}: {error}")
+        else:
+            manifest.update(paper['paper_pdf'], records)
+
+    jobs = [(paper, manifest.get(paper['paper_pdf']), versions) for paper in papers]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(build_layout, *job): job[0] for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    records = future.result()
+                except Exception as e:
+                    report(futures[future], None, e)
+                    continue
+                report(futures[future], records, None)
+    else:
+        for job in jobs:
+            try:
+                records = build_layout(*job)
+            except Exception as e:
+                report(job[0], None, e)
+                continue
+            report(job[0], records, None)
+    manifest.save()
+
+
+def iter_extracted_documents(jobs, nlp_model, versions, stage_metrics, instrumentation):
+    """
+    Convert papers and extract their entities in-process, one stage after the other.
+
+    :param jobs: iterable of arguments of convert_document
+    :param nlp_model: spaCy NLP model
+    :param versions: dictionary of stage versions
+    :param stage_metrics: StageMetrics of the convert and ner stages, in this order
+    :param instrumentation: Instrumentation the paper traces are added to
+    :returns: generator of (paper, list of text paragraphs or None, updated stage records or None,
+        entities dictionary or None, exception or None), see extract_document_entities
+    """
+    convert_metrics, ner_metrics = stage_metrics[:2]
+    pending = []
+    for job in jobs:
+        paper = job[0]
+        start = time.perf_counter()
+        try:
+            full_text_array, records = convert_document(*job, trace=instrumentation.trace(paper['paper_pdf']))
+        except Exception as e:
+            yield paper, None, None, None, e
+            continue
+        finally:
+            convert_metrics.record(1, time.perf_counter() - start)
+
+        pending.append((paper, full_text_array, records))
+        if len(pending) >= NER_PAPERS_PER_BATCH:
+            extracted, seconds = extract_traced_entities(pending, nlp_model, versions, instrumentation)
+            ner_metrics.record(len(pending), seconds)
+            yield from extracted
+            pending = []
+    convert_metrics.finish()
+
+    if pending:
+        extracted, seconds = extract_traced_entities(pending, nlp_model, versions, instrumentation)
+        ner_metrics.record(len(pending), seconds)
+        yield from extracted
+    ner_metrics.finish()
+
+
+def iter_pipelined_documents(jobs, nlp_model, versions, workers, stage_metrics, instrumentation):
+    """
+    Convert papers in a pool of worker processes and extract their entities in a background thread,
+    while the caller writes the results. Conversion keeps at most twice as many papers in flight as
+    there are workers and both stages block when the queue to the next stage is full.
+
+    :param jobs: iterable of arguments of convert_document
+    :param nlp_model: spaCy NLP model
+    :param versions: dictionary of stage versions
+    :param workers: int, number of conversion worker processes
+    :param stage_metrics: StageMetrics of the convert, ner and database stages, in this order
+    :param instrumentation: Instrumentation the paper traces sent back by the workers are added to
+    :returns: generator of the same tuples as iter_extracted_documents, in completion order
+    """
+    convert_metrics, ner_metrics, database_metrics = stage_metrics
+    stop_event = threading.Event()
+    converted_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    extracted_queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+
+    def extract_converted(batch):
+        results = []
+        converted = []
+        for (paper, *_), result, error in batch:
+            if error is not None:
+                results.append((paper, None, None, None, error))
+            else:
+                full_text_array, records, trace = result
+                instrumentation.add(trace)
+                converted.append((paper, full_text_array, records))
+        if converted:
+            results.extend(extract_traced_entities(converted, nlp_model, versions, instrumentation)[0])
+        return results
+
+    threads = [
+        start_stage(run_in_processes, trace_convert_document, jobs, workers, converted_queue, convert_metrics,
+                    stop_event),
+        start_stage(run_batched, extract_converted, converted_queue, extracted_queue, NER_PAPERS_PER_BATCH,
+                    ner_metrics, stop_event),
+    ]
+    try:
+        yield from iter_queue(extracted_queue, database_metrics, stop_event)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    for thread in threads:
+        if thread.error is not None:
+            raise thread.error
+
+
+def convert_document(paper, records, versions, text_source='docx', trace=None):
+    """
+    Convert a paper from PDF to DOCX, simplify the DOCX into JSON and return its paragraphs.
+    This is the CPU-heavy part of processing a paper; it touches no database state so it
+    can run in a worker process.
+
+    Stages whose input hash and version match their record are skipped, and the DOCX is only
+    read when the JSON has to be written, the entities have to be extracted or the database has
+    to be loaded again. It is then read once, for both the JSON and the paragraphs.
+
+    With text_source 'pdf' the DOCX/JSON files are left alone and the paragraphs are read from the
+    PDF. records['text'] tells where the text comes from and the hash the entities depend on.
+
+    :param paper: name, pdf, docx, json files and entities of a paper
+    :param records: dictionary of stage records of the paper
+    :param versions: dictionary of stage versions
+    :param text_source: str, one of TEXT_SOURCES
+    :param trace: PaperTrace the stage durations and sizes are added to, if given
+    :returns: list of text paragraphs of the document or None, updated stage records
+    """
+    records = dict(records)
+    with stage_timer(trace, 'hash'):
+        pdf_hash = file_digest(paper['paper_pdf'])
+    content = None
+    if text_source == 'pdf':
+        text_hash = pdf_hash
+    else:
+        content, records = convert_layout(paper, records, versions, pdf_hash, trace)
+        text_hash = records['docx']['output']
+    records['text'] = {'source': text_source, 'input': text_hash}
+    if trace is not None:
+        trace.bytes['pdf'] = os.path.getsize(paper['paper_pdf'])
+
+    if (is_stage_fresh(records, 'entities', text_hash, versions['entities'], paper['paper_entities'])
+            and is_stage_fresh(records, 'database', records['entities']['output'], versions['database'])):
+        return None, records
+
+    # Extract full text from the document
+    with stage_timer(trace, 'text'):
+        if text_source == 'pdf':
+            from ingestion.pdf_extractor import read_pdf_paragraphs
+
+            full_text_array = read_pdf_paragraphs(paper['paper_pdf'])
+        else:
+            if content is None:
+                content = read_docx(paper['paper_docx'])
+            full_text_array = content.paragraphs
+    if trace is not None:
+        trace.counts['paragraphs'] = len(full_text_array)
+        trace.bytes['text'] = sum(len(paragraph.encode()) for paragraph in full_text_array)
+    return full_text_array, records
+
+
+def trace_convert_document(paper, records, versions, text_source='docx'):
+    """
+    convert_document for a worker process: the trace of the paper is sent back with the result.
+
+    :returns: list of text paragraphs of the document or None, updated stage records, PaperTrace
+    """
+    trace = PaperTrace(paper['paper_pdf'])
+    full_text_array, records = convert_document(paper, records, versions, text_source, trace)
+    return full_text_array, records, trace
+
+
+def convert_layout(paper, records, versions, pdf_hash=None, trace=None):
+    """
+    Run the PDF->DOCX conversion and the DOCX->JSON simplification of a paper, the stages that
+    rebuild its layout, unless they are up to date.
+
+    :param paper: name, pdf, docx, json files and entities of a paper
+    :param records: dictionary of stage records of the paper
+    :param versions: dictionary of stage versions
+    :param pdf_hash: str, content hash of the PDF, computed if not given
+    :param trace: PaperTrace the stage durations are added to, if given
+    :returns: DocxContent of the DOCX if it had to be read, else None; updated stage records
     """
     pdf_file = paper['paper_pdf']
     docx_file = paper['paper_docx']
     json_file = paper['paper_json']
-    entities_file = paper['paper_entities']
+    records = dict(records)
+
+    # Convert PDF to DOCX if the PDF changed since the DOCX was written
+    if pdf_hash is None:
+        pdf_hash = file_digest(pdf_file)
+    if not is_stage_fresh(records, 'docx', pdf_hash, versions['docx'], docx_file):
+        from pdf2docx import parse
 
-    # Convert PDF to DOCX if the DOCX file doesn't exist
-    if not exists(docx_file):
-        parse(pdf_file, docx_file)
+        with stage_timer(trace, 'docx'):
+            with atomic_path(docx_file) as tmp_docx_file:
+                parse(pdf_file, tmp_docx_file)
+            records['docx'] = record_stage(pdf_hash, versions['docx'], docx_file)
+    elif trace is not None:
+        trace.skipped.append('docx')
+    docx_hash = records['docx']['output']
 
-    # Load DOCX file
-    doc = docx.Document(docx_file)
+    content = None
 
     # Simplify DOCX and save as JSON
-    if not exists(json_file):
-        simplified_doc = simplify(doc, {"special-characters-as-text": False})
-        with open(json_file, 'w') as output_json:
-            json.dump(simplified_doc, output_json)
+    if not is_stage_fresh(records, 'json', docx_hash, versions['json'], json_file):
+        with stage_timer(trace, 'json'):
+            content = read_docx(docx_file)
+            with atomic_write(json_file) as output_json:
+                json.dump(content.simplified, output_json)
+            records['json'] = record_stage(docx_hash, versions['json'], json_file)
+    elif trace is not None:
+        trace.skipped.append('json')
+    return content, records
+
+
+def build_layout(paper, records, versions):
+    """
+    convert_layout for the deferred pass: only the stage records are sent back from the worker.
 
-    # Extract full text from the document
-    full_text_array = [para.text for para in doc.paragraphs]
+    :returns: updated stage records
+    """
+    return convert_layout(paper, records, versions)[1]
 
-    # Extract entities and save to JSON
-    if not exists(entities_file):
-        entities = extract_entities(full_text_array, nlp_model)
-        with open(entities_file, 'w') as output_entities:
-            json.dump(entities, output_entities)
-    else:
-        with open(entities_file, 'r') as entities_file_obj:
-            entities = json.load(entities_file_obj)
 
-    # Update database with the extracted entities
-    update_database(cur, paper, entities)
+def read_docx_paragraphs(docx_file):
+    """
+    Read the text paragraphs of a DOCX file.
+
+    :param docx_file: str, path to the DOCX file
+    :returns: list of text paragraphs of the document
+    """
+    return read_docx(docx_file).paragraphs
+
+
+def extract_document_entities(converted, nlp_model, versions):
+    """
+    Extract entities from a batch of converted papers and save them to the entity store. Papers without
+    up-to-date entities go through NER together; if the batch fails, each paper is retried on its
+    own so that the error is reported against the paper that caused it. Touches no database state,
+    so it can run in a pipeline thread.
+
+    :param converted: list of (paper, list of text paragraphs or None, stage records of the paper);
+        the records are updated in place
+    :param nlp_model: NLP processing module from spaCy
+    :param versions: dictionary of stage versions
+    :returns: list of (paper, list of text paragraphs or None, stage records, EntityTable or None if
+        the saved entities are up to date, exception or None)
+    """
+    to_extract = [(paper, full_text_array, records) for paper, full_text_array, records in converted
+                  if not is_stage_fresh(records, 'entities', records['text']['input'], versions['entities'],
+                                        paper['paper_entities'])]
+    extracted = {}
+
+    if to_extract:
+        try:
+            extracted = extract_entities_batch(
+                ((paper['paper_pdf'], full_text_array) for paper, full_text_array, _ in to_extract), nlp_model)
+        except Exception as e:
+            if len(converted) == 1:
+                paper, full_text_array, records = converted[0]
+                return [(paper, full_text_array, records, None, e)]
+            results = []
+            for item in converted:
+                results.extend(extract_document_entities([item], nlp_model, versions))
+            return results
+
+        for paper, _, records in to_extract:
+            extracted[paper['paper_pdf']].save(paper['paper_entities'])
+            records['entities'] = record_stage(records['text']['input'], versions['entities'],
+                                               paper['paper_entities'])
 
     # Clear GPU cache if using CUDA
+    import torch
+
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
 
+    return [(paper, full_text_array, records, extracted.get(paper['paper_pdf']), None)
+            for paper, full_text_array, records in converted]
+
+
+def extract_traced_entities(converted, nlp_model, versions, instrumentation):
+    """
+    extract_document_entities for a batch of papers with pending traces: the time of the batch is
+    shared between the papers in proportion to the length of their text.
+
+    :returns: list of tuples returned by extract_document_entities, seconds spent
+    """
+    start = time.perf_counter()
+    extracted = extract_document_entities(converted, nlp_model, versions)
+    seconds = time.perf_counter() - start
+    instrumentation.share_time([instrumentation.trace(paper['paper_pdf']) for paper, _, _ in converted], 'ner',
+                               seconds, [sum(map(len, full_text_array or ())) for _, full_text_array, _ in converted])
+    return extracted, seconds
+
 
-def extract_entities(full_text_array, nlp_model):
+def load_documents(extracted, cur, versions, processed_files, failed_files, resolver=None, instrumentation=None):
+    """
+    Update the database with the entities and paragraph text of papers. A paper whose database
+    stage is up to date and that is still in the database is left as it is.
+
+    :param extracted: list of tuples returned by extract_document_entities; the records are updated
+        in place
+    :param cur: connection cursor
+    :param versions: dictionary of stage versions
+    :param processed_files: list the pdf path of each ingested paper is appended to
+    :param failed_files: dictionary the pdf path and error of each failed paper is added to
+    :param resolver: EntityResolver, one is created for the batch if not given
+    :param instrumentation: Instrumentation whose paper traces get the entity counts and cache hits
+    """
+    resolver = resolver or EntityResolver(cur)
+    for paper, full_text_array, records, entities, error in extracted:
+        if error is not None:
+            logging.error(f"Failed to process {paper['paper_pdf']}: {error}")
+            failed_files[paper['paper_pdf']] = str(error)
+            continue
+        trace = instrumentation.trace(paper['paper_pdf']) if instrumentation is not None else None
+
+        entities_hash = records['entities']['output']
+        if is_stage_fresh(records, 'database', entities_hash, versions['database']) and paper_exists(cur, paper):
+            processed_files.append(paper['paper_pdf'])
+            if trace is not None:
+                trace.skipped.append('database')
+            continue
+        try:
+            if entities is None:
+                # Mapped, not parsed: update_database counts the mentions on the integer columns
+                entities = EntityTable.load(paper['paper_entities'])
+            if full_text_array is None:
+                # The manifest says the paper is loaded but the database lost it
+                if records['text']['source'] == 'pdf':
+                    from ingestion.pdf_extractor import read_pdf_paragraphs
+
+                    full_text_array = read_pdf_paragraphs(paper['paper_pdf'])
+                else:
+                    full_text_array = read_docx_paragraphs(paper['paper_docx'])
+            hits, misses = resolver.hits, resolver.misses
+            linked_entities = update_database(cur, paper, entities, full_text_array, resolver)
+        except Exception as e:
+            logging.error(f"Failed to process {paper['paper_pdf']}: {e}")
+            failed_files[paper['paper_pdf']] = str(e)
+            continue
+        if trace is not None:
+            trace.counts['mentions'] = len(entities)
+            trace.counts['entities'] = linked_entities
+            trace.cache['entity_hits'] = resolver.hits - hits
+            trace.cache['entity_misses'] = resolver.misses - misses
+        records['database'] = record_stage(entities_hash, versions['database'])
+        processed_files.append(paper['paper_pdf'])
+
+
+def extract_entities(full_text_array, nlp_model, batch_size=NER_BATCH_SIZE, n_process=NER_N_PROCESS):
     """
     Extract entities from the full text using spaCy NLP model
 
     :param full_text_array: list of text paragraphs
     :param nlp_model: spaCy NLP model
+    :param batch_size: int, number of text chunks per nlp.pipe batch
+    :param n_process: int, number of processes nlp.pipe runs the model in
+
+    :returns: EntityTable of the extracted entities (text, start_char, end_char, label, chunk);
+    offsets are character offsets into the paragraphs joined with newlines
+    """
+    return extract_entities_batch([(None, full_text_array)], nlp_model, batch_size, n_process)[None]
+
 
-    :returns:dictionary containing information(text, start_char, end_char, label)
-    of extracted entities
+def extract_entities_batch(documents, nlp_model, batch_size=NER_BATCH_SIZE, n_process=NER_N_PROCESS):
     """
-    full_text = ''.join(full_text_array)
-    doc_tokens = nlp_model.tokenizer(full_text)
-    num_tokens = len(doc_tokens)
-    entities = {"entities": []}
+    Extract entities from many documents with a single streaming nlp.pipe call. The text chunks of
+    every document are fed to the model in batches of batch_size, whichever documents they come
+    from, and each entity is mapped back to its document and chunk. Entities found twice in the
+    overlap of two chunks are merged.
 
-    # Process text in chunks to handle large documents
-    for start_idx in range(0, num_tokens, MAX_TOKEN_LENGTH):
-        end_idx = min(start_idx + MAX_TOKEN_LENGTH, num_tokens)
-        token_chunk = doc_tokens[start_idx:end_idx].text
-        doc_chunk = nlp_model(token_chunk)
+    :param documents: iterable of (key, list of text paragraphs), key identifies the document
+    :param nlp_model: spaCy NLP model
+    :param batch_size: int, number of text chunks per nlp.pipe batch
+    :param n_process: int, number of processes nlp.pipe runs the model in
 
+    :returns: dictionary mapping each key to its EntityTable, as returned by extract_entities
+    """
+    results = {}
+
+    def iter_chunks():
+        for key, full_text_array in documents:
+            results[key] = []
+            for chunk_idx, (start_char, chunk_text) in enumerate(iter_text_chunks(full_text_array, nlp_model)):
+                yield chunk_text, (key, chunk_idx, start_char)
+
+    doc_chunks = nlp_model.pipe(iter_chunks(), as_tuples=True, batch_size=batch_size, n_process=n_process)
+    for doc_chunk, (key, chunk_idx, start_char) in doc_chunks:
         # Extract entities from the chunk
         for ent in doc_chunk.ents:
-            entities["entities"].append({
+            results[key].append({
                 "text": ent.text,
-                "start_char": start_idx + ent.start_char,
-                "end_char": start_idx + ent.end_char,
-                "label": ent.label_
+                "start_char": start_char + ent.start_char,
+                "end_char": start_char + ent.end_char,
+                "label": ent.label_,
+                "chunk": chunk_idx
             })
 
-    return entities
+    return {key: EntityTable.from_entities(merge_chunk_entities(entities)) for key, entities in results.items()}
+
+
+def iter_text_chunks(full_text_array, nlp_model):
+    """
+    Split the full text into chunks of whole sentences of at most MAX_TOKEN_LENGTH tokens, with
+    CHUNK_OVERLAP tokens of overlap, to handle large documents.
+
+    :param full_text_array: list of text paragraphs
+    :param nlp_model: spaCy NLP model, only its tokenizer is used
+    :returns: generator of (character offset of the chunk in the full text, chunk text)
+    """
+    full_text = join_paragraphs(full_text_array)
+    token_spans = [(token.idx, token.idx + len(token)) for token in nlp_model.tokenizer(full_text)]
+
+    for start_char, end_char in chunk_spans(full_text, token_spans, MAX_TOKEN_LENGTH, CHUNK_OVERLAP):
+        yield start_char, full_text[start_char:end_char]
 
 
-def update_database(cur, paper, entities):
+def update_database(cur, paper, entities, full_text_array=None, resolver=None):
     """
     Update the database with paper and entity information.
 
+    Mentions are counted per (name, type) in memory first, then resolved to canonical entities by
+    the resolver in one batch (EntityResolver.resolve_many), so surface variants of a name
+    ("F. Calvert", "Calvert") share one entity and the number of statements does not grow with the
+    number of mentions or of distinct entities of the paper.
+
     :param cur: Database cursor for executing queries.
     :param paper: Dictionary containing paper metadata.
-    :param entities: Dictionary containing extracted entities.
+    :param entities: EntityTable of the extracted entities.
+    :param full_text_array: list of text paragraphs to index for full-text search, if given.
+    :param resolver: EntityResolver, a new one is created if not given
+    :returns: int, number of distinct entities linked to the paper
     """
     # Insert paper into database and retrieve paper_id
     paper_id = insert_paper(cur, paper)
+    # Cached query results are stale once this transaction commits
+    bump_generation(cur)
+
+    if full_text_array is not None:
+        index_paper_text(cur, paper_id, full_text_array)
+
+    # Drop the links of a previous load so that reloading a paper replaces its counts
+    remove_paper_aggregates(cur, paper_id)
+    cur.execute("DELETE FROM papers_have_entities WHERE paper_id = ?", (paper_id,))
+
+    # Count mentions of each distinct entity
+    mention_counts = entities.mention_counts()
+    if not mention_counts:
+        return 0
+
+    # Resolve entities, then insert relationships
+    resolver = resolver or EntityResolver(cur)
+    resolved = resolver.resolve_many(mention_counts)
+    entity_counts = Counter()
+    entity_types = {}
+    for (name, label), entity_id in resolved.items():
+        count = mention_counts[(name, label)]
+        # A later mention may have merged an entity resolved earlier into its full name
+        entity_id = resolver.canonical_id(entity_id)
+        entity_counts[entity_id] += count
+        entity_types[entity_id] = label
+    for source_id, target_id in resolver.pop_merges():
+        merge_entity_aggregates(cur, source_id, target_id)
+    link_paper_entities(cur, paper_id, entity_counts)
+    add_paper_aggregates(cur, entity_counts, entity_types)
+    return len(entity_counts)
+
+
+def index_paper_text(cur, paper_id, full_text_array):
+    """
+    Replace the paragraphs of a paper in table 'paper_paragraphs'; triggers keep the full-text
+    index 'paper_text' in sync.
+
+    :param cur: connection cursor
+    :param paper_id: int, paper's ID
+    :param full_text_array: list of text paragraphs
+    """
+    cur.execute("DELETE FROM paper_paragraphs WHERE paper_id = ?", (paper_id,))
+    cur.executemany("""
+        INSERT INTO paper_paragraphs(paper_id, paragraph_index, paragraph_text)
+        VALUES(?, ?, ?)
+    """, ((paper_id, index, text) for index, text in enumerate(full_text_array) if text.strip()))
 
-    # Insert entities and relationships
-    for entity in entities['entities']:
-        entity_id = insert_entity(cur, entity)
-        link_paper_entity(cur, paper_id, entity_id)
+
+def paper_exists(cur, paper):
+    """
+    Check whether a paper has been stored in table 'papers'
+
+    :param cur: connection cursor
+    :param paper: name, pdf, docx, json files and entities of a paper.
+    :returns: bool
+    """
+    cur.execute("SELECT 1 FROM papers WHERE paper_name = ?", (paper['paper_name'],))
+    return cur.fetchone() is not None
 
 
 def insert_paper(cur, paper):
@@ -261,116 +1202,256 @@ def insert_paper(cur, paper):
     return cur.fetchone()[0]
 
 
-def insert_entity(cur, entity):
-    """
-    Insert entity_name, entity_type of each entity in entities into table 'entities'
-
-    :param cur: connection cursor
-    :param entity: information dictionary of entities detected in the text of the file
-    :returns: entity_id
-    """
-    cur.execute("""
-        INSERT INTO entities(entity_name, entity_type)
-        VALUES(:entity_name, :entity_type)
-        ON CONFLICT(entity_name, entity_type) DO UPDATE SET entity_name=:entity_name
-            RETURNING entity_id
-    """, {'entity_name': entity['text'], 'entity_type': entity['label']})
-    return cur.fetchone()[0]
-
-
-def link_paper_entity(cur, paper_id, entity_id):
+def link_paper_entities(cur, paper_id, entity_counts):
     """
-    Link a paper and an entity in the database by inserting entity_id of each entity in entities
-    and paper_id into table 'papers_have_entities'
+    Link a paper and its entities in table 'papers_have_entities'. As with one row per mention,
+    count ends up as the number of mentions of the entity in the paper.
 
     :param cur: connection cursor
     :param paper_id: int, paper's ID
-    :param entity_id: int, entity's ID
+    :param entity_counts: Counter of mentions keyed by entity_id
     """
-    cur.execute("""
-        INSERT INTO papers_have_entities(entity_id, paper_id)
-        VALUES(:entity_id, :paper_id)
-        ON CONFLICT(entity_id, paper_id) DO UPDATE SET count=count+1
-    """, {'entity_id': entity_id, 'paper_id': paper_id})
+    cur.executemany("""
+        INSERT INTO papers_have_entities(entity_id, paper_id, count)
+        VALUES(?, ?, ?)
+        ON CONFLICT(entity_id, paper_id) DO UPDATE SET count=count+excluded.count
+    """, ((entity_id, paper_id, count) for entity_id, count in entity_counts.items()))
 
 
-def parse_user_query(user_input):
+def parse_user_query(user_input, search_limit=SEARCH_RESULT_LIMIT):
     """
     Construct a SQL query based on a natural language input.
-    example: translate "get all papers that mention person Fiona Calvert" into SQL query
-    "SELECT * FROM papers INNER JOIN papers_have_entities ON papers_have_entities.paper_id = papers.paper_id
-    INNER JOIN entities ON papers_have_entities.entity_id = entities.entity_id WHERE entities.entity_type='PERSON'
-    AND entities.name = 'Fiona Calvert' Limit 1"
+    example: translate "get all papers that mention person Fiona Calvert" into the query plan
+    QueryPlan(sql="SELECT papers.* FROM papers WHERE papers.paper_id IN (SELECT paper_id FROM (
+    SELECT papers_have_entities.paper_id FROM papers_have_entities WHERE papers_have_entities.entity_id IN (
+    SELECT entity_id FROM entities WHERE entity_name = ? AND entity_type = ? UNION SELECT entity_id
+    FROM entity_variants WHERE variant_key = ? AND entity_type = ?))) ORDER BY papers.paper_id",
+    params=('Fiona Calvert', 'PERSON', 'fiona calvert', 'PERSON'))
+
+    A name matches every surface variant of it that was resolved to the same entity, see
+    entity_resolver.
+
+    Values are never interpolated into the SQL: questions of the same shape (same number of conditions,
+    same operators, same optional entity types) share one SQL text, which is built once and reused by
+    the statement cache of the connection. Conditions joined by 'and' must all be mentioned by the same
+    paper and bind tighter than 'or'; they are combined with INTERSECT/UNION over paper ids, so every
+    paper is returned once.
+
+    "search <words>" is a full-text search over paper paragraphs, see parse_search_query; "top ..."
+    and "cooccur ..." are answered from the aggregate tables, see parse_top_query and
+    parse_cooccurrence_query.
 
     :param input_values: a string of query instructions in natural language
-    :return: a constructed SQL query string that can be executed against a database
+    :param search_limit: int, number of papers a search returns, -1 for every match (when the
+        caller pages the results itself)
+    :return: QueryPlan that can be executed against a database, None if the input is not a valid query
     """
     query_tokens = user_input.strip().split()
-    query_parts = {
-        "select": [],
-        "from": [],
-        "where": [],
-        "limit": []
-    }
+    if query_tokens and query_tokens[0].lower() == 'search':
+        return parse_search_query(query_tokens[1:], search_limit)
+    if query_tokens and query_tokens[0].lower() == 'top':
+        return parse_top_query(query_tokens[1:])
+    if query_tokens and query_tokens[0].lower() == 'cooccur':
+        return parse_cooccurrence_query(query_tokens[1:])
+
     current_index = 0
+    limit_one = False
+    conditions = []
+    operators = []
 
     if query_tokens and query_tokens[current_index].lower() == 'get':
         current_index += 1
 
         # Handle 'one' or 'all'
         if current_index < len(query_tokens) and query_tokens[current_index].lower() == 'one':
-            query_parts['limit'].append('LIMIT 1')
+            limit_one = True
             current_index += 1
         elif current_index < len(query_tokens) and query_tokens[current_index].lower() == 'all':
             current_index += 1
 
         # Handle 'papers'
         if current_index < len(query_tokens) and query_tokens[current_index].lower() == 'papers':
-            query_parts['select'].append('papers.*')
-            query_parts['from'].append('papers')
             current_index += 1
+        else:
+            return None
 
         # Handle 'that mention ...'
         if current_index < len(query_tokens) and query_tokens[current_index].lower() == 'that':
             current_index += 1
             if current_index < len(query_tokens) and query_tokens[current_index].lower() == 'mention':
                 current_index += 1
-                query_parts['from'].append(
-                    'INNER JOIN papers_have_entities ON papers_have_entities.paper_id = papers.paper_id')
-                query_parts['from'].append('INNER JOIN entities ON papers_have_entities.entity_id = entities.entity_id')
-                conditions = []
 
                 while current_index < len(query_tokens):
                     current_index = parse_conditions(query_tokens, conditions, current_index)
                     if current_index < len(query_tokens):
                         logical_operator = query_tokens[current_index].lower()
                         if logical_operator in ('and', 'or'):
-                            conditions.append(logical_operator.upper())
+                            operators.append(logical_operator)
                             current_index += 1
                         else:
                             break
 
-                if conditions:
-                    query_parts['where'].append(' '.join(conditions))
+                # A trailing 'and'/'or' has nothing to combine with
+                del operators[max(len(conditions) - 1, 0):]
 
     else:
-        return ""
+        return None
 
-    query_string = f"SELECT {' '.join(query_parts['select'])} FROM {' '.join(query_parts['from'])}"
-    if query_parts['where']:
-        query_string += f" WHERE {' '.join(query_parts['where'])}"
-    if query_parts['limit']:
-        query_string += f" {' '.join(query_parts['limit'])}"
+    return build_mention_plan(conditions, operators, limit_one)
 
+
+def build_mention_plan(conditions, operators, limit_one=False):
+    """
+    Construct the query of the papers that mention entities, from conditions already parsed.
+
+    :param conditions: list of (entity type or None, entity name)
+    :param operators: list of 'and'/'or' between consecutive conditions
+    :param limit_one: bool, return the first paper only
+    :return: QueryPlan
+    """
+    shape = (limit_one, tuple(entity_type is not None for entity_type, _ in conditions), tuple(operators))
+    params = []
+    for entity_type, entity_name in conditions:
+        for value in (entity_name, normalize_entity_name(entity_name)):
+            params.append(value)
+            if entity_type is not None:
+                params.append(entity_type)
+
+    return QueryPlan(build_mention_query(shape), tuple(params))
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def build_mention_query(shape):
+    """
+    Build the SQL text of a "get papers that mention ..." question from its shape.
+
+    :param shape: (limit to one paper, whether each condition has an entity type, operators between
+        conditions)
+    :return: str, SQL query with one '?' per entity name and normalized entity name, each followed
+        by one for the entity type if the condition has one
+    """
+    limit_one, typed_conditions, operators = shape
+
+    query_string = "SELECT papers.* FROM papers"
+    if typed_conditions:
+        # 'and' binds tighter than 'or': split the conditions into groups that are all required
+        groups = [[]]
+        for condition_index, has_type in enumerate(typed_conditions):
+            # Entities stored under the exact name, plus the canonical entity of its normalized
+            # form; each side is a single index lookup
+            type_filter = " AND entity_type = ?" if has_type else ""
+            condition = (
+                "SELECT papers_have_entities.paper_id FROM papers_have_entities "
+                "WHERE papers_have_entities.entity_id IN ("
+                f"SELECT entity_id FROM entities WHERE entity_name = ?{type_filter} "
+                f"UNION SELECT entity_id FROM entity_variants WHERE variant_key = ?{type_filter})"
+            )
+            groups[-1].append(condition)
+            if condition_index < len(operators) and operators[condition_index] == 'or':
+                groups.append([])
+
+        # Compound operators in SQLite have equal precedence, so every group is its own subquery
+        matching_papers = ' UNION '.join(
+            f"SELECT paper_id FROM ({' INTERSECT '.join(group)})" for group in groups)
+        query_string += f" WHERE papers.paper_id IN ({matching_papers})"
+
+    query_string += " ORDER BY papers.paper_id"
+    if limit_one:
+        query_string += " LIMIT 1"
     return query_string
 
 
+def parse_search_query(tokens, limit=SEARCH_RESULT_LIMIT):
+    """
+    Construct a full-text search query: papers having paragraphs that contain all the words,
+    best bm25 rank first, at most limit papers.
+    example: "search number line estimation"
+
+    :param tokens: str, words to search for
+    :param limit: int, maximum number of papers, -1 for all of them
+    :return: QueryPlan, None if there are no words
+    """
+    if not tokens:
+        return None
+
+    # Quote every word so that FTS5 operators and punctuation in the input are taken literally
+    match_expression = ' '.join('"' + token.replace('"', '""') + '"' for token in tokens)
+    return QueryPlan(SEARCH_QUERY, (match_expression, limit))
+
+
+def parse_limit(tokens):
+    """
+    :param tokens: list of str, words of a 'top' or 'cooccur' question after the command
+    :return: (number of results asked for, remaining tokens), None for the number if it is not positive
+    """
+    if tokens and tokens[0].isdigit():
+        limit = int(tokens[0])
+        return (limit if limit > 0 else None), tokens[1:]
+    return TOP_RESULT_LIMIT, tokens
+
+
+def parse_top_query(tokens):
+    """
+    Construct a query for the entities mentioned by the most papers, then by the most mentions.
+    example: "top organisations", "top 5 people", "top"
+
+    :param tokens: list of str, words after 'top': an optional number and an optional entity type
+    :return: QueryPlan of (entity_name, entity_type, paper_count, mention_count) rows, None if the
+        words are not understood
+    """
+    limit, tokens = parse_limit(tokens)
+    if limit is None or len(tokens) > 1 or (tokens and tokens[0].lower() not in ENTITY_TYPE_WORDS):
+        return None
+
+    if tokens:
+        sql = TOP_ENTITIES_QUERY.format(type_filter="\n    WHERE entity_stats.entity_type = ?")
+        return QueryPlan(sql, (ENTITY_TYPE_WORDS[tokens[0].lower()], limit))
+    return QueryPlan(TOP_ENTITIES_QUERY.format(type_filter=""), (limit,))
+
+
+def parse_cooccurrence_query(tokens):
+    """
+    Construct a query for the entities mentioned by the same papers as an entity, most papers first.
+    example: "cooccur person Fiona Calvert", "cooccur 5 organisations with person Fiona Calvert"
+
+    :param tokens: list of str, words after 'cooccur': an optional number, optional "<entity type>
+        with" to only list entities of that type, then "[person|organisation|work] <entity name>"
+    :return: QueryPlan of (entity_name, entity_type, papers) rows, None if the words are not understood
+    """
+    limit, tokens = parse_limit(tokens)
+    if limit is None:
+        return None
+
+    partner_type = None
+    if len(tokens) > 1 and tokens[0].lower() in ENTITY_TYPE_WORDS and tokens[1].lower() == 'with':
+        partner_type = ENTITY_TYPE_WORDS[tokens[0].lower()]
+        tokens = tokens[2:]
+    conditions = []
+    index = parse_conditions(tokens, conditions, 0)
+    if index != len(tokens) or not conditions or not conditions[0][1]:
+        return None
+
+    entity_type, entity_name = conditions[0]
+    type_filter = " AND entity_type = ?" if entity_type is not None else ""
+    params = []
+    for value in (entity_name, normalize_entity_name(entity_name)):
+        params.append(value)
+        if entity_type is not None:
+            params.append(entity_type)
+    partner_filter = ""
+    if partner_type is not None:
+        partner_filter = " AND entities.entity_type = ?"
+        params.append(partner_type)
+    sql = COOCCURRENCE_QUERY.format(type_filter=type_filter, partner_filter=partner_filter)
+    return QueryPlan(sql, tuple(params) + (limit,))
+
+
 def parse_conditions(tokens, conditions, index):
     """
-    Construct the condition clause of a SQL query by parsing user input.
+    Parse one condition of a query ("[person|organisation|work] <entity name>") from user input.
 
     :param tokens: str, words in the natural language input
-    :param conditions: accumulated query conditions
+    :param conditions: accumulated query conditions, list of (entity type or None, entity name)
     :param index: current index of element in tokens to process
 
     :return: updated index after parsing conditions.
@@ -394,16 +1475,7 @@ def parse_conditions(tokens, conditions, index):
         entity_name_tokens.append(tokens[index])
         index += 1
 
-    entity_name = ' '.join(entity_name_tokens).replace("'", "''")  # Escape single quotes
-
-    # Build condition
-    condition = "("
-    if entity_type:
-        condition += f"entities.entity_type = '{entity_type}' AND "
-    condition += f"entities.entity_name = '{entity_name}'"
-    condition += ")"
-
-    conditions.append(condition)
+    conditions.append((entity_type, ' '.join(entity_name_tokens)))
     return index
 
 
@@ -411,11 +1483,20 @@ def run_cli_interface(conn):
     """
     Run the command-line interface for querying the database.
 
+    Results are cached until the data changes; 'stats' prints the hits and misses of the cache.
+
     :param conn: connection to SQLite database
     """
+    from prompt_toolkit import prompt
+    from prompt_toolkit.history import FileHistory
+    from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+    from prompt_toolkit.completion import WordCompleter
+
     cur = conn.cursor()
+    query_cache = QueryCache(cur)
     question_completer = WordCompleter(
-        ['get', 'one', 'all', 'papers', 'that', 'mention', 'person', 'organisation', 'work', 'and', 'or', 'q'],
+        ['get', 'one', 'all', 'papers', 'that', 'mention', 'person', 'organisation', 'work', 'and', 'or', 'search',
+         'top', 'cooccur', 'with', 'people', 'organisations', 'works', 'stats', 'q'],
         ignore_case=True
     )
 
@@ -429,45 +1510,199 @@ def run_cli_interface(conn):
         )
         if user_input.lower() == 'q':
             break
+        if user_input.strip().lower() == 'stats':
+            print(f"Query cache: {query_cache.stats()}")
+            continue
 
-        query_string = parse_user_query(user_input)
-        if not query_string:
+        if not run_query(cur, user_input, query_cache):
             print("Invalid query. Please try again.")
-            continue
+    logging.info(f"Query cache: {query_cache.stats()}")
 
-        cur.execute(query_string)
-        results = cur.fetchall()
-        if not results:
-            print("No results found")
-        else:
-            for result in results:
-                print(result)
 
+def run_query(cur, user_input, query_cache=None):
+    """
+    Run one question against the database and print its results.
 
-def main():
+    :param cur: connection cursor
+    :param user_input: str, question in natural language
+    :param query_cache: QueryCache to answer from, the query is always executed if not given
+    :return: bool, False if the question is not a valid query
     """
-    Main function to orchestrate the document processing and CLI interface.
+    query_plan = parse_user_query(user_input)
+    if query_plan is None:
+        return False
+
+    if query_cache is not None:
+        results = query_cache.execute(query_plan)
+    else:
+        results = cur.execute(query_plan.sql, query_plan.params).fetchall()
+    if not results:
+        print("No results found")
+    else:
+        for result in results:
+            print(result)
+    return True
+
+
+def ingest_papers(conn, xlsx_path, workers=NUM_WORKERS, text_source=TEXT_SOURCE, instrumentation=None,
+                  commit_every=DB_COMMIT_EVERY, retry_failed=False):
+    """
+    Load the NLP model and process every paper of the index into the database.
+
+    :param conn: connection to SQLite database
+    :param xlsx_path: path to the Excel index of papers
+    :param workers: int, number of conversion worker processes
+    :param text_source: str, one of TEXT_SOURCES
+    :param instrumentation: Instrumentation of the run; its profiling hooks cover the processing
+    :param commit_every: int, papers written per database transaction
+    :param retry_failed: bool, process only the papers that failed in earlier runs
+    :returns: dictionary mapping the pdf path of each failed paper to its error message
     """
+    instrumentation = instrumentation or Instrumentation()
+
     # Load spaCy model
     nlp_model = load_nlp_model()
 
     # Load paper index
-    xlsx_path = Path(".", "index.xlsx")
-    papers_to_process = load_paper_index(xlsx_path)
-
-    # Setup database
-    conn = get_database_connection(DB_FILE)
-    setup_database(conn)
+    papers_to_process = iter_paper_index(xlsx_path)
 
     # Process documents
-    process_documents(papers_to_process, nlp_model, conn)
+    with instrumentation.profiling():
+        return process_documents(papers_to_process, nlp_model, conn, workers=workers, text_source=text_source,
+                                 instrumentation=instrumentation, commit_every=commit_every,
+                                 retry_failed=retry_failed)
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the command line. Without a command, papers are ingested and then queried interactively.
+
+    :param argv: list of arguments, sys.argv[1:] if None
+    :returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Extract the entities mentioned by papers and query them.",
+        epilog="Without a command, papers are ingested and the interactive query prompt is started.")
+    parser.add_argument('--db', default=DB_FILE, help=f"SQLite database file (default: {DB_FILE})")
+    subparsers = parser.add_subparsers(dest='command')
+
+    ingest_parser = subparsers.add_parser('ingest', help="process the papers of the index into the database")
+    subparsers.add_parser('query', help="query an existing database interactively")
+    ask_parser = subparsers.add_parser('ask', help="run one query against an existing database and exit")
+    ask_parser.add_argument('question', nargs='+', help='e.g. get all papers that mention person Fiona Calvert')
+    subparsers.add_parser('failed', help="list the papers that failed to ingest (dead letters)")
+    serve_parser = subparsers.add_parser('serve', help="answer queries over HTTP/JSON")
+    serve_parser.add_argument('--host', default=None, help="address to listen on (default: 127.0.0.1, PSD_SERVER_HOST)")
+    serve_parser.add_argument('--port', type=int, default=None,
+                              help="port to listen on, 0 for any free port (default: 8765, PSD_SERVER_PORT)")
+    serve_parser.add_argument('--pool-size', type=int, default=None, metavar='N',
+                              help="read-only database connections (default: up to 8, PSD_POOL_SIZE)")
+    watch_parser = subparsers.add_parser('watch', help="ingest new and changed PDFs of a directory as they appear")
+    watch_parser.add_argument('--dir', default=SOURCE_PATH, help=f"directory watched for PDFs (default: {SOURCE_PATH})")
+    watch_parser.add_argument('--poll', type=float, default=None, metavar='SECONDS',
+                              help="seconds between two scans of the directory (default: 2, PSD_WATCH_POLL)")
+    watch_parser.add_argument('--once', action='store_true', help="ingest the PDFs present now and exit")
+    watch_parser.add_argument('--index', default=argparse.SUPPRESS,
+                              help="Excel index the titles of the papers are read from (default: index.xlsx)")
+    watch_parser.add_argument('--workers', type=int, default=argparse.SUPPRESS,
+                              help=f"conversion worker processes (default: {NUM_WORKERS})")
+    watch_parser.add_argument('--text-source', choices=TEXT_SOURCES, default=argparse.SUPPRESS,
+                              help=f"where NER reads the text of a paper (default: {TEXT_SOURCE})")
+    watch_parser.add_argument('--trace', default=argparse.SUPPRESS, metavar='FILE',
+                              help="append a JSON line of stage timings per paper to FILE")
+
+    for command_parser in (parser, ingest_parser):
+        command_parser.add_argument('--index', default=argparse.SUPPRESS,
+                                    help="Excel index of the papers (default: index.xlsx)")
+        command_parser.add_argument('--workers', type=int, default=argparse.SUPPRESS,
+                                    help=f"conversion worker processes (default: {NUM_WORKERS})")
+        command_parser.add_argument('--text-source', choices=TEXT_SOURCES, default=argparse.SUPPRESS,
+                                    help=f"where NER reads the text of a paper (default: {TEXT_SOURCE})")
+        command_parser.add_argument('--trace', default=argparse.SUPPRESS, metavar='FILE',
+                                    help="append a JSON line of stage timings per paper to FILE")
+        command_parser.add_argument('--profile', default=argparse.SUPPRESS, metavar='FILE',
+                                    help="profile the run with cProfile and write the stats to FILE")
+        command_parser.add_argument('--trace-memory', action='store_true', default=argparse.SUPPRESS,
+                                    help="trace Python allocations with tracemalloc")
+        command_parser.add_argument('--commit-every', type=int, default=argparse.SUPPRESS, metavar='N',
+                                    help=f"papers written per database transaction (default: {DB_COMMIT_EVERY})")
+        command_parser.add_argument('--retry-failed', action='store_true', default=argparse.SUPPRESS,
+                                    help="process only the papers that failed in earlier runs")
+
+    args = parser.parse_args(argv)
+    for name, default in (('index', str(Path(".", "index.xlsx"))), ('workers', NUM_WORKERS),
+                          ('text_source', TEXT_SOURCE), ('trace', TRACE_FILE), ('profile', PROFILE_FILE),
+                          ('trace_memory', TRACE_MEMORY), ('commit_every', DB_COMMIT_EVERY),
+                          ('retry_failed', False)):
+        if not hasattr(args, name):
+            setattr(args, name, default)
+    return args
+
+
+def main(argv=None):
+    """
+    Main function to orchestrate the document processing and CLI interface.
+
+    :param argv: list of command line arguments, sys.argv[1:] if None
+    :returns: int, exit status
+    """
+    args = parse_arguments(argv)
+
+    if args.command == 'watch':
+        import asyncio
+        from ingestion.watcher import WATCH_POLL_SECONDS, WATCH_RECENT_PAPERS, PaperWatcher
 
-    # Run CLI interface
-    run_cli_interface(conn)
+        watcher = PaperWatcher(args.db, watch_dir=args.dir, xlsx_path=args.index, workers=args.workers,
+                               text_source=args.text_source,
+                               poll_seconds=args.poll if args.poll is not None else WATCH_POLL_SECONDS,
+                               instrumentation=Instrumentation(args.trace, max_finished=WATCH_RECENT_PAPERS))
+        failed_files = asyncio.run(watcher.run(once=args.once))
+        return 1 if args.once and failed_files else 0
+
+    if args.command in ('query', 'ask', 'failed', 'serve') and not exists(args.db):
+        print(f"Database {args.db} not found, run the 'ingest' command first.", file=sys.stderr)
+        return 1
+
+    # Setup database
+    conn = get_database_connection(args.db)
+    setup_database(conn)
 
-    # Close database connection
-    conn.close()
+    status = 0
+    try:
+        if args.command in (None, 'ingest'):
+            # Process documents
+            ingest_papers(conn, args.index, workers=args.workers, text_source=args.text_source,
+                          instrumentation=Instrumentation(args.trace, args.profile, args.trace_memory),
+                          commit_every=args.commit_every, retry_failed=args.retry_failed)
+
+        if args.command in (None, 'query'):
+            # Run CLI interface
+            run_cli_interface(conn)
+        elif args.command == 'failed':
+            dead_letters = get_dead_letters(conn.cursor())
+            for paper_pdf, attempts, error, updated_at in dead_letters:
+                print(f"{paper_pdf}\t{attempts} attempt(s)\t{time.strftime('%Y-%m-%d %H:%M', time.localtime(updated_at))}"
+                      f"\t{error}")
+            if not dead_letters:
+                print("No failed papers")
+        elif args.command == 'serve':
+            from ingestion import query_server
+
+            # This connection set up WAL mode and the schema; the server reads through its own pool
+            query_server.serve(args.db,
+                               host=args.host if args.host is not None else query_server.SERVER_HOST,
+                               port=args.port if args.port is not None else query_server.SERVER_PORT,
+                               pool_size=args.pool_size if args.pool_size is not None else query_server.POOL_SIZE)
+        elif args.command == 'ask':
+            if not run_query(conn.cursor(), ' '.join(args.question)):
+                print("Invalid query.", file=sys.stderr)
+                status = 2
+    finally:
+        # Close database connection
+        conn.execute("PRAGMA optimize")
+        conn.close()
+    return status
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,31 +1,45 @@
 """
 docx_extractor.py
-Module for extracting text from DOCX files using python-docx.
+Module for extracting text from DOCX files, read in a single streaming pass by docx_reader.
 """
 
-import docx
 import logging
 from pathlib import Path
 
-def extract_text_from_docx(docx_file_path: str) -> str:
+from ingestion.docx_reader import read_docx
+
+def read_text_from_docx(docx_file_path: str) -> str:
     """
-    Extract all text from a DOCX file.
+    Read all text from a DOCX file. Errors are logged and raised, so that a caller never takes an
+    unreadable document for an empty one.
 
     :param docx_file_path: str, path to the DOCX file
-    :return: str, the extracted text content
+    :return: str, the non-blank paragraphs joined with newlines
+    :raises FileNotFoundError: if the file does not exist
     """
     docx_path = Path(docx_file_path)
     if not docx_path.is_file():
         logging.error(f"DOCX file not found: {docx_file_path}")
-        return ""
+        raise FileNotFoundError(f"DOCX file not found: {docx_file_path}")
 
     try:
-        doc = docx.Document(docx_file_path)
-        paragraphs = [p.text for p in doc.paragraphs if p.text.strip()]
-        combined_text = "\n".join(paragraphs)
-        logging.info(f"Extracted text from {docx_file_path}, length: {len(combined_text)} chars.")
-        return combined_text
-
+        combined_text = read_docx(docx_file_path).text
     except Exception as e:
         logging.error(f"Error reading DOCX {docx_file_path}: {e}")
+        raise
+    logging.info(f"Extracted text from {docx_file_path}, length: {len(combined_text)} chars.")
+    return combined_text
+
+
+def extract_text_from_docx(docx_file_path: str) -> str:
+    """
+    Extract all text from a DOCX file.
+
+    :param docx_file_path: str, path to the DOCX file
+    :return: str, the extracted text content, empty if the file cannot be read
+    """
+    try:
+        return read_text_from_docx(docx_file_path)
+    except Exception:
+        # Already logged by read_text_from_docx
         return ""
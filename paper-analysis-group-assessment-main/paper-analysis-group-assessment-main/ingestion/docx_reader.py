@@ -0,0 +1,345 @@
+"""
+docx_reader.py
+Module for reading a DOCX file in a single pass over its XML.
+
+python-docx loads the whole document into an object tree, simplify-docx walks that tree once more
+to build the simplified JSON and the paragraph text needs a third walk. Here word/document.xml is
+streamed with iterparse: each top-level block (paragraph or table) is turned into its simplified
+JSON, its text and its paragraph as soon as it has been parsed, and then dropped from the tree,
+so memory does not grow with the size of the XML.
+
+The simplified JSON has the layout simplify-docx produces with the options used by this project
+(friendly names, hyperlinks/fields/smart tags flattened, empty paragraphs and text dropped,
+paragraph edges trimmed, "special-characters-as-text" off), for the content pdf2docx writes:
+paragraphs, runs, tables and direct paragraph indents. Indents inherited from styles or numbering
+definitions, forms and embedded documents are not resolved.
+
+We provide:
+1) DocxContent        -> Simplified JSON, paragraphs and plain text of a document
+2) read_docx()        -> Read all three in one pass
+3) iter_docx_blocks() -> Stream the top-level blocks of a document
+"""
+
+import zipfile
+import posixpath
+from collections import namedtuple
+
+from lxml import etree
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+M_NS = "http://schemas.openxmlformats.org/officeDocument/2006/math"
+RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+OFFICE_DOCUMENT_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+DEFAULT_DOCUMENT_PART = "word/document.xml"
+READER_VERSION = "1"  # bump when the simplified JSON or the paragraphs change
+
+
+def _w(tag):
+    return f"{{{W_NS}}}{tag}"
+
+
+# simplified JSON, paragraphs of the body, text (non-blank paragraphs joined with newlines)
+DocxContent = namedtuple('DocxContent', ['simplified', 'paragraphs', 'text'])
+
+_BODY = _w('body')
+_P = _w('p')
+_R = _w('r')
+_T = _w('t')
+_BR = _w('br')
+_TBL = _w('tbl')
+_TR = _w('tr')
+_TC = _w('tc')
+_SDT = _w('sdt')
+_CUSTOM_XML = _w('customXml')
+_HYPERLINK = _w('hyperlink')
+_FLD_CHAR = _w('fldChar')
+_PPR = _w('pPr')
+_IND = _w('ind')
+_NUM_PR = _w('numPr')
+_VAL = _w('val')
+
+# Paragraph content whose runs are read as if they were direct children of the paragraph
+_FLATTENED_CONTENT = {_HYPERLINK, _w('smartTag'), _CUSTOM_XML, _w('fldSimple'), _w('ins'), _w('moveTo')}
+_MATH = {f"{{{M_NS}}}oMath", f"{{{M_NS}}}oMathPara"}
+
+# Run content without text of its own
+_SPECIAL_CHARACTERS = {
+    _BR: "Break",
+    _w('cr'): "CarriageReturn",
+    _w('tab'): "TabChar",
+    _w('noBreakHyphen'): "NoBreakHyphen",
+    _w('softHyphen'): "SoftHyphen",
+    _w('ptab'): "PositionalTab",
+}
+_EMPTY_RUN_CONTENT = {_w(tag) for tag in (
+    'instrText', 'dayShort', 'monthShort', 'yearShort', 'dayLong', 'monthLong', 'yearLong', 'annotationRef',
+    'footnoteRef', 'endnoteRef', 'footnoteReference', 'endnoteReference', 'commentReference', 'object',
+    'drawing', 'contentPart')}
+
+# Text equivalents of run content in paragraph.text of python-docx (w:br only for line breaks)
+_RUN_TEXT = {_w('cr'): "\n", _w('noBreakHyphen'): "-", _w('ptab'): "\t", _w('tab'): "\t"}
+
+_INDENT_PROPS = ('left', 'right', 'firstLine', 'hanging')
+
+# simplify-docx's dumb-quotes, dumb-spaces, dumb-hyphens and ignore-joiners options, in its order
+# (so U+201B becomes a quote and U+00A0 a hyphen, as in its output)
+_TEXT_TRANSLATION = str.maketrans({
+    **dict.fromkeys("\u2018\u2019\u201a\u201b", "'"),
+    **dict.fromkeys("\u201c\u201d", '"'),
+    **dict.fromkeys("\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a", " "),
+    **dict.fromkeys("\u2010\u2011\u2012\u2013\u2014\u2015\u00a0", "-"),
+    **dict.fromkeys("\u200c\u200d", None),
+})
+
+
+def read_docx(docx_file):
+    """
+    Read a DOCX file once and return its simplified JSON, its paragraphs and its text.
+
+    :param docx_file: str, path to the DOCX file
+    :return: DocxContent; paragraphs are the texts of the body paragraphs, equal to
+        [p.text for p in docx.Document(docx_file).paragraphs]
+    """
+    blocks = []
+    paragraphs = []
+    for block, paragraph_text in iter_docx_blocks(docx_file):
+        if block is not None:
+            blocks.append(block)
+        if paragraph_text is not None:
+            paragraphs.append(paragraph_text)
+
+    simplified = {"TYPE": "document", "VALUE": [{"TYPE": "body", "VALUE": blocks}]}
+    text = "\n".join(paragraph for paragraph in paragraphs if paragraph.strip())
+    return DocxContent(simplified, paragraphs, text)
+
+
+def iter_docx_blocks(docx_file):
+    """
+    Stream the top-level blocks of the body of a DOCX file.
+
+    :param docx_file: str, path to the DOCX file
+    :return: generator of (simplified JSON of the block or None if it is dropped, text of the block
+        if it is a paragraph else None)
+    """
+    with zipfile.ZipFile(docx_file) as package:
+        with package.open(_document_part_name(package)) as document_xml:
+            depth = 0
+            body = None
+            for event, element in etree.iterparse(document_xml, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2 and element.tag == _BODY:
+                        body = element
+                    continue
+
+                depth -= 1
+                if depth != 2 or body is None or element.getparent() is not body:
+                    continue
+
+                # A complete top-level block: convert it, then free it and the blocks before it
+                if element.tag == _P:
+                    yield _paragraph_json(element), _paragraph_text(element)
+                else:
+                    for block in _block_json(element):
+                        yield block, None
+                element.clear()
+                while element.getprevious() is not None:
+                    del body[0]
+
+
+def _document_part_name(package):
+    """
+    Name of the main document part, from the package relationships.
+    """
+    try:
+        rels = etree.fromstring(package.read('_rels/.rels'))
+    except KeyError:
+        return DEFAULT_DOCUMENT_PART
+    for rel in rels.iter(f"{{{RELS_NS}}}Relationship"):
+        if rel.get('Type') == OFFICE_DOCUMENT_REL:
+            return posixpath.normpath(rel.get('Target').lstrip('/'))
+    return DEFAULT_DOCUMENT_PART
+
+
+def _paragraph_text(p):
+    """
+    Text of a paragraph as python-docx computes it: runs and hyperlink runs that are direct
+    children, with tabs, line breaks and hyphens translated.
+    """
+    parts = []
+    for child in p:
+        if child.tag == _R:
+            _append_run_text(child, parts)
+        elif child.tag == _HYPERLINK:
+            for run in child.iterchildren(_R):
+                _append_run_text(run, parts)
+    return "".join(parts)
+
+
+def _append_run_text(run, parts):
+    for child in run:
+        tag = child.tag
+        if tag == _T:
+            parts.append(child.text or "")
+        elif tag == _BR:
+            if child.get(_w('type'), 'textWrapping') == 'textWrapping':
+                parts.append("\n")
+        elif tag in _RUN_TEXT:
+            parts.append(_RUN_TEXT[tag])
+
+
+def _block_json(element):
+    """
+    Simplified JSON of a block-level element (paragraph, table, ...).
+
+    :return: list of JSON elements, empty if the element is ignored
+    """
+    tag = element.tag
+    if tag == _P:
+        paragraph = _paragraph_json(element)
+        return [paragraph] if paragraph is not None else []
+    if tag == _TBL:
+        return [_table_json(element)]
+    if tag == _SDT:
+        return [_empty_json(element)]
+    if tag == _CUSTOM_XML:
+        return [block for child in element for block in _block_json(child)]
+    # sectPr, bookmarks, proofing marks, altChunk...
+    return []
+
+
+def _table_json(tbl):
+    rows = []
+    for row in _iter_nested(tbl, _TR):
+        if row.tag == _SDT:
+            rows.append(_empty_json(row))
+            continue
+        cells = []
+        for cell in _iter_nested(row, _TC):
+            if cell.tag == _SDT:
+                cells.append(_empty_json(cell))
+                continue
+            contents = [block for child in cell for block in _block_json(child)]
+            cells.append({"TYPE": "table-cell", "VALUE": contents})
+        rows.append({"TYPE": "table-row", "VALUE": cells})
+
+    table = {"TYPE": "table", "VALUE": rows}
+    table_properties = tbl.find(_w('tblPr'))
+    if table_properties is not None:
+        for name in ('tblCaption', 'tblDescription'):
+            prop = table_properties.find(_w(name))
+            if prop is not None and prop.get(_VAL):
+                table[name] = prop.get(_VAL)
+    return table
+
+
+def _iter_nested(element, tag):
+    """
+    Yield the children of element with the given tag or w:sdt, looking inside w:customXml.
+    """
+    for child in element:
+        if child.tag == tag or child.tag == _SDT:
+            yield child
+        elif child.tag == _CUSTOM_XML:
+            yield from _iter_nested(child, tag)
+
+
+def _paragraph_json(p):
+    """
+    Simplified JSON of a paragraph, None if it has no content.
+    """
+    contents = []
+    _append_paragraph_contents(p, contents, [None])
+    contents = _merge_text(contents)
+
+    # Trim the whitespace at the edges of the paragraph
+    while contents and contents[0]["TYPE"] == "text":
+        contents[0]["VALUE"] = contents[0]["VALUE"].lstrip()
+        if contents[0]["VALUE"]:
+            break
+        contents.pop(0)
+    while contents and contents[-1]["TYPE"] == "text":
+        contents[-1]["VALUE"] = contents[-1]["VALUE"].rstrip()
+        if contents[-1]["VALUE"]:
+            break
+        contents.pop()
+    if not contents:
+        return None
+
+    paragraph = {"TYPE": "paragraph", "VALUE": contents}
+    paragraph_properties = p.find(_PPR)
+    if paragraph_properties is not None:
+        style = {}
+        indent = paragraph_properties.find(_IND)
+        if indent is not None:
+            style["indent"] = {"TYPE": "CT_Ind"}
+            for name in _INDENT_PROPS:
+                value = indent.get(_w(name))
+                if value is not None:
+                    style["indent"][name] = int(value)
+        numbering = paragraph_properties.find(_NUM_PR)
+        if numbering is not None:
+            style["numPr"] = {"TYPE": "numPr"}
+            for name in ('ilvl', 'numId'):
+                prop = numbering.find(_w(name))
+                if prop is not None:
+                    style["numPr"][name] = int(prop.get(_VAL))
+        if style:
+            paragraph["style"] = style
+    return paragraph
+
+
+def _append_paragraph_contents(element, contents, field_state):
+    """
+    Append the simplified run contents of a paragraph (or of flattened paragraph content).
+    field_state[0] follows complex fields: 'code' between their begin and separate characters,
+    where the field instructions are skipped, else None.
+    """
+    for child in element:
+        tag = child.tag
+        if tag == _R:
+            _append_run_contents(child, contents, field_state)
+        elif tag in _FLATTENED_CONTENT:
+            _append_paragraph_contents(child, contents, field_state)
+        elif tag in _MATH and field_state[0] is None:
+            contents.append(_empty_json(child))
+
+
+def _append_run_contents(run, contents, field_state):
+    for child in run:
+        tag = child.tag
+        if tag == _FLD_CHAR:
+            field_char_type = child.get(_w('fldCharType'))
+            field_state[0] = 'code' if field_char_type == 'begin' else None
+            continue
+        if field_state[0] is not None:
+            continue
+
+        if tag == _T:
+            contents.append({"TYPE": "text", "VALUE": (child.text or "").translate(_TEXT_TRANSLATION)})
+        elif tag in _SPECIAL_CHARACTERS:
+            contents.append({"TYPE": _SPECIAL_CHARACTERS[tag]})
+        elif tag == _w('sym'):
+            contents.append({"TYPE": "text", "VALUE": child.get(_w('char'))})
+        elif tag in _EMPTY_RUN_CONTENT:
+            contents.append(_empty_json(child))
+
+
+def _merge_text(contents):
+    """
+    Drop empty text and merge consecutive text elements.
+    """
+    merged = []
+    for item in contents:
+        if item["TYPE"] == "text":
+            if not item["VALUE"]:
+                continue
+            if merged and merged[-1]["TYPE"] == "text":
+                merged[-1]["VALUE"] += item["VALUE"]
+                continue
+        merged.append(item)
+    return merged
+
+
+def _empty_json(element):
+    return {"TYPE": "CT_Empty", "VALUE": f"[w:{etree.QName(element).localname}]"}
@@ -0,0 +1,420 @@
+"""
+entity_resolver.py
+Module for resolving entity mentions to canonical entities.
+
+The surface forms of a name ("Fiona Calvert", "FIONA  CALVERT", "F. Calvert", "Calvert") are folded
+into normalized keys, and table 'entity_variants' maps every key to the id of its canonical entity.
+A person's full name also claims its short forms (initial + surname, surname); a short form claimed
+by two different people is ambiguous and stored with a NULL entity_id, so mentions of it keep their
+own entity. An entity created from a short form before the full name was seen is merged into the
+full name once it appears.
+
+We provide:
+1) normalize_entity_name()   -> Normalized key of an entity name (Unicode, casing, whitespace, dots)
+2) alias_keys()              -> Short forms a full person name also answers to
+3) EntityResolver            -> Resolve mentions to entity ids through a bounded in-memory LRU dictionary,
+                                one at a time or a paper's worth in a fixed number of statements
+4) rebuild_entity_variants() -> Fill 'entity_variants' from table 'entities', merging duplicates
+"""
+
+import logging
+from collections import OrderedDict
+
+from ingestion.cleaners import normalize_text
+
+ENTITY_CACHE_SIZE = 100000  # (key, type) pairs kept in memory
+ALIASED_TYPES = ('PERSON',)
+_EDGE_CHARACTERS = " ,;:!?'\"()[]{}"
+
+
+def normalize_entity_name(name):
+    """
+    Fold the surface form of an entity name into its lookup key:
+    1) NFKC normalization (cleaners.normalize_text)
+    2) Case folding
+    3) Dots read as spaces, so "F.Calvert" and "F. Calvert" agree
+    4) Whitespace runs collapsed, surrounding punctuation stripped
+
+    :param name: str, entity name as found in the text
+    :return: str, normalized key, empty if the name has no letters or digits
+    """
+    text = normalize_text(name).casefold().replace(".", " ")
+    return " ".join(text.split()).strip(_EDGE_CHARACTERS)
+
+
+def alias_keys(key, entity_type):
+    """
+    Short forms of a full person name: "fiona m calvert" -> ["fiona calvert", "f calvert", "calvert"].
+
+    :param key: str, normalized key of the name
+    :param entity_type: str, entity label
+    :return: list of normalized keys, empty for other types and for names that are not words
+    """
+    if entity_type not in ALIASED_TYPES:
+        return []
+    tokens = key.split()
+    if len(tokens) < 2 or not all(token.replace("-", "").replace("'", "").isalpha() for token in tokens):
+        return []
+
+    first, surname = tokens[0], tokens[-1]
+    aliases = []
+    if len(tokens) > 2:
+        aliases.append(f"{first} {surname}")
+    if len(first) > 1:
+        aliases.append(f"{first[0]} {surname}")
+    aliases.append(surname)
+    return aliases
+
+
+class EntityResolver:
+    """
+    Map entity mentions to canonical entity ids. Lookups go through an LRU dictionary of at most
+    cache_size normalized keys, warmed from 'entity_variants' when the resolver is created, so only
+    keys outside the dictionary cost a database round trip. Every change is written through to the
+    database, so the dictionary can be dropped at any time.
+    """
+
+    def __init__(self, cur, cache_size=ENTITY_CACHE_SIZE):
+        """
+        :param cur: connection cursor; the resolver uses its own cursor on the same connection
+        :param cache_size: int, maximum number of (key, type) pairs kept in memory
+        """
+        self.cur = cur.connection.cursor()
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # Reverse index of the dictionary: entity_id -> set of its (key, type) pairs, for merge()
+        self._keys_by_id = {}
+        self._merged = {}
+        self._merge_log = []
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.merges = 0
+        self.warm()
+
+    def warm(self):
+        """Load the most recently written variants into the dictionary."""
+        if self.cache_size <= 0:
+            return
+        rows = self.cur.execute("""
+            SELECT variant_key, entity_type, entity_id FROM entity_variants ORDER BY rowid DESC LIMIT ?
+        """, (self.cache_size,)).fetchall()
+        # Oldest first, so the most recent rows end up least likely to be evicted
+        for variant_key, entity_type, entity_id in reversed(rows):
+            self._remember((variant_key, entity_type), entity_id)
+
+    def resolve(self, name, entity_type):
+        """
+        Entity id of a mention, creating the entity if its key is unknown.
+
+        :param name: str, entity name as found in the text
+        :param entity_type: str, entity label
+        :return: int, entity_id
+        """
+        key = normalize_entity_name(name) or name
+        found, entity_id = self._lookup(key, entity_type)
+        if entity_id is not None:
+            return entity_id
+
+        entity_id = self._insert_entity(name, entity_type)
+        if not found:
+            self._register(key, entity_type, entity_id)
+        # else: the key is an ambiguous short form, the mention keeps an entity of its own name
+        return entity_id
+
+    def resolve_many(self, mentions):
+        """
+        Entity ids of many mentions, the same as resolve() gives them one after the other, longest
+        name first so that a full name claims its short forms before they are looked up (ties keep
+        the order of the mentions). The mentions are resolved in a fixed number of statements: the keys and short forms outside the dictionary are looked up
+        in one query, the new entities are inserted with one executemany and their ids read back in
+        one query, and the new variants are written with one executemany. Only a short form claimed
+        by an entity that existed before costs queries of its own: the check of its name, the
+        merge, and the insert of the new entities resolved after the merge.
+
+        :param mentions: iterable of (name, entity_type)
+        :return: dictionary of entity_id by (name, entity_type)
+        """
+        normalized = {mention: normalize_entity_name(mention[0]) for mention in mentions}
+        mentions = sorted(normalized, key=lambda mention: -len(normalized[mention]))
+        keys = {mention: normalized[mention] or mention[0] for mention in mentions}
+
+        # Dictionary hits first, then one query for the other keys and short forms
+        wanted = dict.fromkeys((variant_key, entity_type) for (_, entity_type), key in keys.items()
+                               for variant_key in [key] + alias_keys(key, entity_type))
+        known = {}
+        for cache_key in wanted:
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                known[cache_key] = self._cache[cache_key]
+        missing = [cache_key for cache_key in wanted if cache_key not in known]
+        self.hits += len(known)
+        self.misses += len(missing)
+        for variant_key, entity_type, entity_id in self._select_batch("""
+            SELECT entity_variants.variant_key, entity_variants.entity_type, entity_variants.entity_id
+            FROM resolver_batch
+            INNER JOIN entity_variants ON entity_variants.variant_key = resolver_batch.name
+                AND entity_variants.entity_type = resolver_batch.entity_type
+        """, missing):
+            known[(variant_key, entity_type)] = entity_id
+            self._remember((variant_key, entity_type), entity_id)
+
+        # Resolve in order in memory; new entity i is known by the id -(i + 1) until it is inserted
+        new_entities = []
+        variants = {}
+        merges = []
+        resolved = {}
+        for mention in mentions:
+            cache_key = (keys[mention], mention[1])
+            entity_id = known.get(cache_key)
+            if entity_id is None:
+                new_entities.append(mention)
+                entity_id = -len(new_entities)
+                if cache_key not in known:
+                    known[cache_key] = variants[cache_key] = entity_id
+                    for alias in alias_keys(*cache_key):
+                        merge = self._claim_known_alias(known, variants, (alias, mention[1]), entity_id, new_entities)
+                        if merge is not None:
+                            # Entities resolved after the merge are inserted after it, as by resolve()
+                            merges.append(merge + (len(new_entities),))
+                # else: the key is an ambiguous short form, the mention keeps an entity of its own name
+            resolved[mention] = entity_id
+
+        inserted = {}
+
+        def real_id(entity_id):
+            return inserted[new_entities[-entity_id - 1]] if entity_id is not None and entity_id < 0 else entity_id
+
+        start = 0
+        for source_id, target_id, end in merges + [(None, None, len(new_entities))]:
+            inserted.update(self._insert_entities(new_entities[start:end]))
+            start = end
+            if source_id is not None:
+                self.merge(real_id(source_id), real_id(target_id))
+
+        variants = [(key, entity_type, real_id(entity_id)) for (key, entity_type), entity_id in variants.items()]
+        self.cur.executemany("""
+            INSERT INTO entity_variants(variant_key, entity_type, entity_id) VALUES(?, ?, ?)
+            ON CONFLICT(variant_key, entity_type) DO UPDATE SET entity_id=excluded.entity_id
+        """, variants)
+        for key, entity_type, entity_id in variants:
+            self._remember((key, entity_type), entity_id)
+        return {mention: real_id(entity_id) for mention, entity_id in resolved.items()}
+
+    def canonical_id(self, entity_id):
+        """Id an entity was merged into, the id itself if it was not merged."""
+        while entity_id in self._merged:
+            entity_id = self._merged[entity_id]
+        return entity_id
+
+    def merge(self, source_id, target_id):
+        """
+        Merge entity source_id into target_id: its paper links are added to the target's, its
+        variants point to the target and its row is deleted.
+        """
+        self.cur.execute("""
+            INSERT INTO papers_have_entities(entity_id, paper_id, count)
+            SELECT ?, paper_id, count FROM papers_have_entities WHERE entity_id = ?
+            ON CONFLICT(entity_id, paper_id) DO UPDATE SET count=count+excluded.count
+        """, (target_id, source_id))
+        self.cur.execute("DELETE FROM papers_have_entities WHERE entity_id = ?", (source_id,))
+        self.cur.execute("UPDATE entity_variants SET entity_id = ? WHERE entity_id = ?", (target_id, source_id))
+        self.cur.execute("DELETE FROM entities WHERE entity_id = ?", (source_id,))
+        source_keys = self._keys_by_id.pop(source_id, set())
+        for cache_key in source_keys:
+            self._cache[cache_key] = target_id
+        if source_keys:
+            self._keys_by_id.setdefault(target_id, set()).update(source_keys)
+        self._merged[source_id] = target_id
+        self._merge_log.append((source_id, target_id))
+        self.merges += 1
+
+    def pop_merges(self):
+        """
+        :return: list of (source_id, target_id) of the merges made since the last call, oldest first
+        """
+        merges, self._merge_log = self._merge_log, []
+        return merges
+
+    def invalidate(self):
+        """Forget the dictionary, e.g. after the writes it remembers were rolled back."""
+        self._cache.clear()
+        self._keys_by_id.clear()
+        self._merged.clear()
+        self._merge_log.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'lookups': lookups,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'cached_keys': len(self._cache),
+            'created': self.created,
+            'merged': self.merges,
+        }
+
+    def _lookup(self, key, entity_type):
+        """
+        :return: (whether the key is known, entity_id or None if it is ambiguous)
+        """
+        cache_key = (key, entity_type)
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            self.hits += 1
+            return True, self._cache[cache_key]
+
+        self.misses += 1
+        row = self.cur.execute("SELECT entity_id FROM entity_variants WHERE variant_key = ? AND entity_type = ?",
+                               cache_key).fetchone()
+        if row is None:
+            return False, None
+        self._remember(cache_key, row[0])
+        return True, row[0]
+
+    def _remember(self, cache_key, entity_id):
+        if self.cache_size <= 0:
+            return
+        previous_id = self._cache.get(cache_key)
+        if previous_id != entity_id:
+            self._unindex(cache_key, previous_id)
+            if entity_id is not None:
+                self._keys_by_id.setdefault(entity_id, set()).add(cache_key)
+        self._cache[cache_key] = entity_id
+        self._cache.move_to_end(cache_key)
+        if len(self._cache) > self.cache_size:
+            self._unindex(*self._cache.popitem(last=False))
+
+    def _unindex(self, cache_key, entity_id):
+        keys = self._keys_by_id.get(entity_id)
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del self._keys_by_id[entity_id]
+
+    def _insert_entity(self, name, entity_type):
+        # DO UPDATE rather than DO NOTHING, so that RETURNING also gives the id of an existing row
+        self.cur.execute("""
+            INSERT INTO entities(entity_name, entity_type) VALUES(?, ?)
+            ON CONFLICT(entity_name, entity_type) DO UPDATE SET entity_name=excluded.entity_name
+            RETURNING entity_id
+        """, (name, entity_type))
+        self.created += 1
+        return self.cur.fetchone()[0]
+
+    def _insert_entities(self, names):
+        """
+        :param names: list of (name, entity_type)
+        :return: dictionary of entity_id by (name, entity_type), for new and existing rows alike
+        """
+        if not names:
+            return {}
+        self.cur.executemany("""
+            INSERT INTO entities(entity_name, entity_type) VALUES(?, ?)
+            ON CONFLICT(entity_name, entity_type) DO NOTHING
+        """, names)
+        self.created += len(names)
+        return {(name, entity_type): entity_id for name, entity_type, entity_id in self._select_batch("""
+            SELECT entities.entity_name, entities.entity_type, entities.entity_id
+            FROM resolver_batch
+            INNER JOIN entities ON entities.entity_name = resolver_batch.name
+                AND entities.entity_type = resolver_batch.entity_type
+        """, names)}
+
+    def _set_variant(self, key, entity_type, entity_id):
+        self.cur.execute("""
+            INSERT INTO entity_variants(variant_key, entity_type, entity_id) VALUES(?, ?, ?)
+            ON CONFLICT(variant_key, entity_type) DO UPDATE SET entity_id=excluded.entity_id
+        """, (key, entity_type, entity_id))
+        self._remember((key, entity_type), entity_id)
+
+    def _register(self, key, entity_type, entity_id):
+        """Record the key of a new canonical entity and the short forms it claims."""
+        self._set_variant(key, entity_type, entity_id)
+        for alias in alias_keys(key, entity_type):
+            self._claim_alias(alias, entity_type, entity_id)
+
+    def _claim_alias(self, alias, entity_type, entity_id):
+        found, current_id = self._lookup(alias, entity_type)
+        if not found:
+            self._set_variant(alias, entity_type, entity_id)
+        elif current_id is None or current_id == entity_id:
+            return
+        elif self._is_short_form_entity(current_id, alias):
+            # "Calvert" was seen before "Fiona Calvert": it becomes a variant of the full name
+            self.merge(current_id, entity_id)
+        else:
+            # Claimed by another name: nobody gets it
+            self._set_variant(alias, entity_type, None)
+
+    def _claim_known_alias(self, known, variants, alias_key, entity_id, new_entities):
+        """
+        _claim_alias() of resolve_many(), on the keys it has looked up and the variants it is going
+        to write; entity ids below 0 stand for new_entities.
+
+        :return: (source_id, target_id) of the merge to make, None if there is none
+        """
+        if alias_key not in known:
+            known[alias_key] = variants[alias_key] = entity_id
+            return None
+        current_id = known[alias_key]
+        if current_id is None or current_id == entity_id:
+            return None
+        if current_id < 0:
+            is_short_form = normalize_entity_name(new_entities[-current_id - 1][0]) == alias_key[0]
+        else:
+            is_short_form = self._is_short_form_entity(current_id, alias_key[0])
+        if not is_short_form:
+            known[alias_key] = variants[alias_key] = None
+            return None
+        # Keys of the short form entity now resolve to the full name, as after merge()
+        for cache_key, known_id in known.items():
+            if known_id == current_id:
+                known[cache_key] = entity_id
+                if cache_key in variants:
+                    variants[cache_key] = entity_id
+        return current_id, entity_id
+
+    def _select_batch(self, sql, pairs):
+        """
+        :param sql: str, query that joins temporary table 'resolver_batch' (name, entity_type)
+        :param pairs: list of (name, entity_type) the table is filled with
+        :return: list of the rows of sql
+        """
+        if not pairs:
+            return []
+        self.cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS resolver_batch (
+                name TEXT NOT NULL,
+                entity_type TEXT NOT NULL
+            )
+        """)
+        self.cur.execute("DELETE FROM resolver_batch")
+        self.cur.executemany("INSERT INTO resolver_batch(name, entity_type) VALUES(?, ?)", pairs)
+        return self.cur.execute(sql).fetchall()
+
+    def _is_short_form_entity(self, entity_id, alias):
+        row = self.cur.execute("SELECT entity_name FROM entities WHERE entity_id = ?", (entity_id,)).fetchone()
+        return row is not None and normalize_entity_name(row[0]) == alias
+
+
+def rebuild_entity_variants(cur):
+    """
+    Rebuild table 'entity_variants' from table 'entities'. Entities whose names fold into the same
+    key, or into a short form of a full name, are merged into one, the longest name first.
+
+    :param cur: connection cursor
+    """
+    cur.execute("DELETE FROM entity_variants")
+    resolver = EntityResolver(cur)
+    rows = cur.execute("SELECT entity_id, entity_name, entity_type FROM entities").fetchall()
+    rows.sort(key=lambda row: (-len(normalize_entity_name(row[1])), row[0]))
+
+    for entity_id, entity_name, entity_type in rows:
+        entity_id = resolver.canonical_id(entity_id)
+        key = normalize_entity_name(entity_name) or entity_name
+        found, canonical_id = resolver._lookup(key, entity_type)
+        if canonical_id is not None and canonical_id != entity_id:
+            resolver.merge(entity_id, canonical_id)
+        elif not found:
+            resolver._register(key, entity_type, entity_id)
+    logging.info(f"Indexed {len(rows)} entities, {resolver.merges} merged as variants of another")
@@ -0,0 +1,235 @@
+"""
+entity_store.py
+Module for storing the entity mentions of a paper in a compact columnar form.
+
+An EntityTable keeps one column per field of a mention instead of one dictionary per mention:
+surface forms and labels are interned into string tables, and the mentions are rows of integer
+columns (text id, label code, start_char, end_char, chunk) held in arrays. On disk a table is one
+binary file (FILE_SUFFIX) with a fixed header, the integer columns and the UTF-8 bytes of the
+string tables. EntityTable.load() maps the file into memory and reads the columns in place, without
+parsing; strings are only decoded when they are asked for, once per distinct surface form.
+
+File layout (integers in the byte order recorded in the header, every section 4-byte aligned):
+    magic (8 bytes) | header: byte order, mentions, strings, labels, string bytes, label bytes
+    text ids  u32[mentions] | label codes  u32[mentions] | start_char u32[mentions]
+    end_char  u32[mentions] | chunk        u32[mentions]
+    string offsets u32[strings + 1] | label offsets u32[labels + 1]
+    string bytes | label bytes
+
+We provide:
+1) FILE_SUFFIX  -> File name suffix of the store files
+2) EntityTable  -> Columnar mentions of a paper: build, count, save and memory-map
+"""
+
+import os
+import sys
+import mmap
+import struct
+from array import array
+from collections import Counter
+
+from ingestion.manifest import atomic_write
+
+FILE_SUFFIX = ".ents"
+MAGIC = b"PSDENTS1"
+_HEADER = struct.Struct("<6I")
+_BYTE_ORDERS = {'little': 0, 'big': 1}
+COLUMNS = ('text_ids', 'label_codes', 'starts', 'ends', 'chunks')
+
+
+def _column(values=()):
+    column = array('I', values)
+    assert column.itemsize == 4
+    return column
+
+
+def _padding(size):
+    return b"\0" * (-size % 4)
+
+
+class EntityTable:
+    """
+    The entity mentions of one paper. Columns are array('I') when the table is built in memory and
+    memoryviews of the mapped file when it is loaded; both index and iterate as ints.
+    """
+
+    def __init__(self):
+        self.text_ids = _column()
+        self.label_codes = _column()
+        self.starts = _column()
+        self.ends = _column()
+        self.chunks = _column()
+        self._strings = []
+        self._labels = []
+        self._string_ids = {}
+        self._label_codes = {}
+        self._string_blob = None
+        self._string_offsets = None
+        self._label_blob = None
+        self._label_offsets = None
+        self._mmap = None
+        self._view = None
+
+    @classmethod
+    def from_entities(cls, entities):
+        """
+        :param entities: iterable of entity dictionaries with text, start_char, end_char, label and chunk
+        :return: EntityTable
+        """
+        table = cls()
+        for ent in entities:
+            table.append(ent['text'], ent['start_char'], ent['end_char'], ent['label'], ent.get('chunk', 0))
+        return table
+
+    def append(self, text, start_char, end_char, label, chunk=0):
+        if self._mmap is not None:
+            raise ValueError("A table loaded from a file is read-only")
+        text_id = self._string_ids.get(text)
+        if text_id is None:
+            text_id = self._string_ids[text] = len(self._strings)
+            self._strings.append(text)
+        label_code = self._label_codes.get(label)
+        if label_code is None:
+            label_code = self._label_codes[label] = len(self._labels)
+            self._labels.append(label)
+        self.text_ids.append(text_id)
+        self.label_codes.append(label_code)
+        self.starts.append(start_char)
+        self.ends.append(end_char)
+        self.chunks.append(chunk)
+
+    def __len__(self):
+        return len(self.text_ids)
+
+    def string(self, text_id):
+        """Surface form of a text id."""
+        if self._string_blob is None:
+            return self._strings[text_id]
+        return str(self._string_blob[self._string_offsets[text_id]:self._string_offsets[text_id + 1]], 'utf-8')
+
+    def label(self, label_code):
+        """Label of a label code."""
+        if self._label_blob is None:
+            return self._labels[label_code]
+        return str(self._label_blob[self._label_offsets[label_code]:self._label_offsets[label_code + 1]], 'utf-8')
+
+    def mention_counts(self):
+        """
+        Number of mentions of each distinct (text, label), counted on the integer columns so that
+        every string is decoded once.
+
+        :return: Counter mapping (text, label) to its number of mentions, in order of first mention
+        """
+        counts = Counter(zip(self.text_ids, self.label_codes))
+        return Counter({(self.string(text_id), self.label(label_code)): count
+                        for (text_id, label_code), count in counts.items()})
+
+    def __iter__(self):
+        """Mentions as entity dictionaries, for code that wants the extract_entities layout."""
+        for index in range(len(self)):
+            yield {
+                "text": self.string(self.text_ids[index]),
+                "start_char": self.starts[index],
+                "end_char": self.ends[index],
+                "label": self.label(self.label_codes[index]),
+                "chunk": self.chunks[index],
+            }
+
+    def write(self, file_obj):
+        """
+        Write the table to a binary file object in the layout described in the module docstring.
+        """
+        strings = [self.string(text_id).encode('utf-8') for text_id in range(self._string_count())]
+        labels = [self.label(code).encode('utf-8') for code in range(self._label_count())]
+        string_bytes = b"".join(strings)
+        label_bytes = b"".join(labels)
+
+        file_obj.write(MAGIC)
+        file_obj.write(_HEADER.pack(_BYTE_ORDERS[sys.byteorder], len(self), len(strings), len(labels),
+                                    len(string_bytes), len(label_bytes)))
+        for name in COLUMNS:
+            file_obj.write(_column(getattr(self, name)).tobytes())
+        for encoded in (strings, labels):
+            offsets = _column([0])
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+            file_obj.write(offsets.tobytes())
+        file_obj.write(string_bytes + _padding(len(string_bytes)))
+        file_obj.write(label_bytes)
+
+    def save(self, file_path):
+        with atomic_write(file_path, 'wb') as file_obj:
+            self.write(file_obj)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Map a table file into memory. The columns and string tables are views of the mapping; a
+        file written on a machine of the other byte order is copied and swapped instead.
+
+        :param file_path: str, path to a file written by save()
+        :return: EntityTable, read-only
+        """
+        with open(file_path, 'rb') as file_obj:
+            size = os.fstat(file_obj.fileno()).st_size
+            if size < len(MAGIC) + _HEADER.size:
+                raise ValueError(f"{file_path} is not an entity table file")
+            data = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(MAGIC)] != MAGIC:
+            data.close()
+            raise ValueError(f"{file_path} is not an entity table file")
+        byte_order, mentions, strings, labels, string_size, label_size = _HEADER.unpack_from(data, len(MAGIC))
+        swap = byte_order != _BYTE_ORDERS[sys.byteorder]
+
+        table = cls()
+        table._mmap = data
+        table._view = view = memoryview(data)
+        position = len(MAGIC) + _HEADER.size
+
+        def take_column(length):
+            nonlocal position
+            end = position + 4 * length
+            if end > size:
+                raise ValueError(f"{file_path} is truncated")
+            if swap:
+                column = _column()
+                column.frombytes(view[position:end])
+                column.byteswap()
+            else:
+                column = view[position:end].cast('I')
+            position = end
+            return column
+
+        def take_bytes(length):
+            nonlocal position
+            end = position + length
+            if end > size:
+                raise ValueError(f"{file_path} is truncated")
+            blob = view[position:end]
+            position = end + (-length % 4)
+            return blob
+
+        for name in COLUMNS:
+            setattr(table, name, take_column(mentions))
+        table._string_offsets = take_column(strings + 1)
+        table._label_offsets = take_column(labels + 1)
+        table._string_blob = take_bytes(string_size)
+        table._label_blob = take_bytes(label_size)
+        return table
+
+    def close(self):
+        """Release the file mapping of a loaded table; its columns can no longer be read."""
+        if self._mmap is None:
+            return
+        views = [getattr(self, name) for name in COLUMNS]
+        views += [self._string_offsets, self._label_offsets, self._string_blob, self._label_blob, self._view]
+        for view in views:
+            if isinstance(view, memoryview):
+                view.release()
+        self._mmap.close()
+
+    def _string_count(self):
+        return len(self._strings) if self._string_offsets is None else len(self._string_offsets) - 1
+
+    def _label_count(self):
+        return len(self._labels) if self._label_offsets is None else len(self._label_offsets) - 1
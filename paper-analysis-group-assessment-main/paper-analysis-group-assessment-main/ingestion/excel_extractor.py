@@ -7,27 +7,58 @@ import openpyxl
 import logging
 from pathlib import Path
 
-def extract_data_from_excel(excel_file_path: str) -> list:
+LOG_EVERY_ROWS = 10000  # 大表只每隔这么多行打一条 INFO 日志
+
+def iter_rows_from_excel(excel_file_path: str, sheet_name: str = None):
     """
-    Extract rows of data from an Excel file (first sheet).
+    Yield rows of data from an Excel file one at a time. The workbook is opened in read-only mode,
+    so rows are parsed lazily from the file instead of being loaded into memory all at once.
+
+    Errors are logged and raised, also in the middle of the rows, so that a caller never takes a
+    partly read sheet for a complete one.
 
     :param excel_file_path: str, path to the Excel (.xlsx) file
-    :return: list of lists (each sub-list is a row of data)
+    :param sheet_name: str, name of the worksheet to read; the first (active) sheet by default
+    :return: generator of tuples (each tuple is a row of cell values)
+    :raises FileNotFoundError: if the file does not exist
+    :raises KeyError: if the workbook has no sheet_name
     """
     xlsx_path = Path(excel_file_path)
     if not xlsx_path.is_file():
         logging.error(f"Excel file not found: {excel_file_path}")
-        return []
+        raise FileNotFoundError(f"Excel file not found: {excel_file_path}")
 
+    workbook = None
     try:
-        workbook = openpyxl.load_workbook(excel_file_path, data_only=True)
-        sheet = workbook.active  # 默认使用第一个工作表
-        rows_data = []
+        workbook = openpyxl.load_workbook(excel_file_path, read_only=True, data_only=True)
+        sheet = workbook[sheet_name] if sheet_name else workbook.active  # 默认使用第一个工作表
+        row_count = 0
         for row in sheet.iter_rows(values_only=True):
-            rows_data.append(row)
-        logging.info(f"Extracted {len(rows_data)} rows from {excel_file_path}.")
-        return rows_data
+            row_count += 1
+            if row_count % LOG_EVERY_ROWS == 0:
+                logging.info(f"Read {row_count} rows from {excel_file_path}...")
+            yield row
+        logging.info(f"Extracted {row_count} rows from {excel_file_path}.")
 
     except Exception as e:
         logging.error(f"Error reading Excel {excel_file_path}: {e}")
+        raise
+
+    finally:
+        # read-only 模式下工作簿一直占着文件句柄, 读完要手动关闭
+        if workbook is not None:
+            workbook.close()
+
+
+def extract_data_from_excel(excel_file_path: str) -> list:
+    """
+    Extract rows of data from an Excel file (first sheet).
+
+    :param excel_file_path: str, path to the Excel (.xlsx) file
+    :return: list of lists (each sub-list is a row of data), empty if the file cannot be read
+    """
+    try:
+        return list(iter_rows_from_excel(excel_file_path))
+    except Exception:
+        # Already logged by iter_rows_from_excel
         return []
@@ -0,0 +1,250 @@
+"""
+instrumentation.py
+Module for timing and tracing the processing of each paper (or file) of a run.
+
+A PaperTrace holds the stage durations, byte sizes, counts (paragraphs, mentions, entities) and
+cache hits of one paper. It is plain data, so a worker process can fill it in and send it back with
+its result. An Instrumentation object collects the traces of a run. It writes each trace as one JSON
+line as soon as the paper is done, keeps run counters, and ends the run with a summary table of the
+stages and the slowest papers. Optionally the run is profiled with cProfile and its Python
+allocations are traced with tracemalloc.
+
+We provide:
+1) PaperTrace      -> Measurements of one paper
+2) stage_timer()   -> Time a stage into a trace (no-op without a trace)
+3) Instrumentation -> Traces, counters, JSONL output, summary and profiling hooks of a run
+"""
+
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+
+TRACE_FILE = os.environ.get("PSD_TRACE_FILE")  # JSONL file of per-paper traces, none by default
+PROFILE_FILE = os.environ.get("PSD_PROFILE_FILE")  # cProfile stats of the run, none by default
+TRACE_MEMORY = os.environ.get("PSD_TRACE_MEMORY", "0") != "0"
+SLOWEST_PAPERS = 10  # papers listed in the summary
+PROFILE_TOP = 25  # functions logged from the cProfile stats
+
+
+class PaperTrace:
+    """
+    Measurements of one paper: seconds per stage, sizes in bytes, counts and cache hits.
+    """
+
+    def __init__(self, paper):
+        self.paper = paper
+        self.status = None
+        self.error = None
+        self.stages = {}
+        self.bytes = {}
+        self.counts = {}
+        self.cache = {}
+        self.skipped = []
+        self.started = time.time()
+
+    def add_time(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        return {
+            'paper': self.paper,
+            'status': self.status,
+            'error': self.error,
+            'started': round(self.started, 3),
+            'total_seconds': round(sum(self.stages.values()), 6),
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            'bytes': self.bytes,
+            'counts': self.counts,
+            'cache': self.cache,
+            'skipped': self.skipped,
+        }
+
+
+@contextmanager
+def stage_timer(trace, stage):
+    """
+    Add the time spent in the with-block to a stage of the trace.
+
+    :param trace: PaperTrace, or None to time nothing
+    :param stage: str, stage name
+    """
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_time(stage, time.perf_counter() - start)
+
+
+class Instrumentation:
+    """
+    Traces and counters of a run. Traces can be started in one thread (or process) and finished in
+    another; finished traces are written to trace_file and kept for the summary, the last
+    max_finished of them if a run has no end (e.g. the watch service).
+    """
+
+    def __init__(self, trace_file=TRACE_FILE, profile_file=PROFILE_FILE, trace_memory=TRACE_MEMORY,
+                 max_finished=None):
+        """
+        :param trace_file: str, JSONL file the traces are appended to, None to keep them in memory only
+        :param profile_file: str, file the cProfile stats of profiling() are dumped to, None to not profile
+        :param trace_memory: bool, trace Python allocations during profiling() with tracemalloc
+        :param max_finished: int, number of finished traces kept for the summary, all of them if None;
+            the counters always cover the whole run
+        """
+        self.trace_file = trace_file
+        self.profile_file = profile_file
+        self.trace_memory = trace_memory
+        self.counters = Counter()
+        self.finished = deque(maxlen=max_finished)
+        self.memory = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._output = None
+
+    def trace(self, paper):
+        """
+        The pending trace of a paper, started if there is none.
+
+        :param paper: str, key of the paper (its pdf path, or the file name)
+        :return: PaperTrace
+        """
+        with self._lock:
+            if paper not in self._pending:
+                self._pending[paper] = PaperTrace(paper)
+            return self._pending[paper]
+
+    def add(self, trace):
+        """Keep a trace filled in elsewhere, e.g. sent back by a worker process, as pending."""
+        with self._lock:
+            self._pending[trace.paper] = trace
+
+    def share_time(self, traces, stage, seconds, weights):
+        """
+        Split the time of a stage that ran over several papers at once (e.g. NER over a batch)
+        between their traces, in proportion to weights (e.g. the length of their text).
+        """
+        total = sum(weights)
+        for trace, weight in zip(traces, weights):
+            trace.add_time(stage, seconds * weight / total if total else seconds / len(traces))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def discard(self, paper):
+        """Drop the pending trace of a paper that will not be finished."""
+        with self._lock:
+            self._pending.pop(paper, None)
+
+    def finish(self, paper, status='ok', error=None):
+        """
+        Close the trace of a paper and write it out.
+
+        :param paper: str, key of the paper
+        :param status: str, e.g. 'ok', 'failed' or 'unchanged'
+        :param error: exception or message, if the paper failed
+        :return: PaperTrace
+        """
+        with self._lock:
+            trace = self._pending.pop(paper, None) or PaperTrace(paper)
+            trace.status = status
+            trace.error = None if error is None else str(error)
+            self.counters[f"papers_{status}"] += 1
+            self.finished.append(trace)
+            if self.trace_file:
+                if self._output is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.trace_file)), exist_ok=True)
+                    self._output = open(self.trace_file, 'a', encoding='utf-8')
+                # One line per paper, flushed so that a crashed run keeps the papers it finished
+                self._output.write(json.dumps(trace.as_dict()) + "\n")
+                self._output.flush()
+        return trace
+
+    def close(self):
+        if self._output is not None:
+            self._output.close()
+            self._output = None
+
+    @contextmanager
+    def profiling(self):
+        """
+        Run the with-block under cProfile if profile_file is set, and under tracemalloc if
+        trace_memory is set. The stats are written to profile_file and the top functions and
+        allocation sites are logged.
+        """
+        profiler = cProfile.Profile() if self.profile_file else None
+        started_tracemalloc = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield self
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_file)
+                report = io.StringIO()
+                pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                logging.info(f"Profile written to {self.profile_file}:\n{report.getvalue()}")
+            if self.trace_memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+                self.memory = {'current_mib': round(current / (1024 * 1024), 2),
+                               'peak_mib': round(peak / (1024 * 1024), 2)}
+                logging.info(f"Traced memory: {self.memory}\n" + "\n".join(str(stat) for stat in top))
+                if started_tracemalloc:
+                    tracemalloc.stop()
+
+    def summary(self):
+        """
+        :return: dictionary with the counters, per stage totals and latency percentiles over the
+            (kept) papers that ran the stage, and the slowest of them
+        """
+        stage_seconds = {}
+        for trace in self.finished:
+            for stage, seconds in trace.stages.items():
+                stage_seconds.setdefault(stage, []).append(seconds)
+
+        stages = {}
+        for stage, samples in stage_seconds.items():
+            samples.sort()
+            stages[stage] = {
+                'papers': len(samples),
+                'total_seconds': round(sum(samples), 3),
+                'p50_ms': round(samples[len(samples) // 2] * 1000, 2),
+                'p95_ms': round(samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2),
+            }
+        slowest = sorted(self.finished, key=lambda trace: sum(trace.stages.values()), reverse=True)
+        return {
+            'counters': dict(self.counters),
+            'stages': stages,
+            'slowest': [(trace.paper, round(sum(trace.stages.values()), 3)) for trace in slowest[:SLOWEST_PAPERS]],
+            'memory': self.memory,
+        }
+
+    def format_summary(self):
+        """
+        :return: str, table of the stages followed by the slowest papers
+        """
+        summary = self.summary()
+        lines = [f"{'stage':<12}{'papers':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+        for stage, row in summary['stages'].items():
+            lines.append(f"{stage:<12}{row['papers']:>8}{row['total_seconds']:>10.2f}{row['p50_ms']:>10.1f}"
+                         f"{row['p95_ms']:>10.1f}{row['max_ms']:>10.1f}")
+        lines.append("counters: " + ", ".join(f"{name}={value}" for name, value in sorted(summary['counters'].items())))
+        if summary['slowest']:
+            lines.append("slowest: " + ", ".join(f"{paper} ({seconds:.2f}s)" for paper, seconds in summary['slowest']))
+        return "\n".join(lines)
@@ -0,0 +1,154 @@
+"""
+manifest.py
+Module for incremental processing: records, for every paper and processing stage, the content hash
+of the stage input, the version of the code/model that produced the output and a fingerprint of the
+output itself. A stage only has to run again when one of these no longer matches.
+
+We provide:
+1) file_digest()      -> Content hash of a file
+2) atomic_write()     -> Write a file through a temp file and a rename
+3) atomic_path()      -> Same, for writers that want a path instead of a file object
+4) is_stage_fresh()   -> Whether the recorded output of a stage can be reused
+5) record_stage()     -> Build the record of a stage that just ran
+6) Manifest           -> Load/save the records of all papers as one JSON file
+"""
+
+import os
+import json
+import hashlib
+import logging
+import secrets
+from contextlib import contextmanager
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 digest of a file, reading it in chunks.
+
+    :param file_path: str, path to the file
+    :param chunk_size: int, number of bytes read at a time
+    :return: str, hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def atomic_path(file_path):
+    """
+    Yield a temporary path next to file_path; when the block exits without error the temporary
+    file is renamed over file_path, otherwise it is removed. Readers never see a half-written file.
+
+    :param file_path: str, final path of the file
+    """
+    directory, name = os.path.split(file_path)
+    # Only pick a unique name: the writer creates the file, so it gets the usual permissions
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{secrets.token_hex(4)}.tmp")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+@contextmanager
+def atomic_write(file_path, mode='w', **kwargs):
+    """
+    Open a temporary file next to file_path for writing; it is flushed, synced and renamed over
+    file_path when the block exits without error.
+
+    :param file_path: str, final path of the file
+    :param mode: str, file mode, 'w' or 'wb'
+    """
+    with atomic_path(file_path) as tmp_path:
+        with open(tmp_path, mode, **kwargs) as file_obj:
+            yield file_obj
+            file_obj.flush()
+            os.fsync(file_obj.fileno())
+
+
+def _output_fingerprint(output_path):
+    stat = os.stat(output_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def is_stage_fresh(records, stage, input_hash, version, output_path=None):
+    """
+    Check whether a stage has already been run on the same input with the same version and its
+    output is still the file it wrote.
+
+    :param records: dictionary of stage records of a paper
+    :param stage: str, name of the stage
+    :param input_hash: str, content hash of the stage input
+    :param version: str, version of the code/model the stage runs
+    :param output_path: str, path of the stage output, None for stages without an output file
+    :return: bool
+    """
+    record = records.get(stage)
+    if not record or record['input'] != input_hash or record['version'] != version:
+        return False
+    if output_path is None:
+        return True
+    if not os.path.exists(output_path):
+        return False
+    return record.get('fingerprint') == _output_fingerprint(output_path)
+
+
+def record_stage(input_hash, version, output_path=None, output_hash=None):
+    """
+    Build the record of a stage that has just written its output.
+
+    :param input_hash: str, content hash of the stage input
+    :param version: str, version of the code/model the stage ran
+    :param output_path: str, path of the stage output, if any
+    :param output_hash: str, content hash of the output; computed from output_path if not given
+    :return: dictionary to store under the stage name
+    """
+    record = {'input': input_hash, 'version': version, 'output': output_hash}
+    if output_path is not None:
+        if output_hash is None:
+            record['output'] = file_digest(output_path)
+        record['fingerprint'] = _output_fingerprint(output_path)
+    return record
+
+
+class Manifest:
+    """
+    Stage records of all papers, keyed by paper, kept in a single JSON file.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.papers = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r') as manifest_file:
+                    self.papers = json.load(manifest_file).get('papers', {})
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable manifest {manifest_path}: {e}")
+
+    def get(self, paper_key):
+        """
+        :param paper_key: str, key of the paper
+        :return: a copy of the stage records of the paper
+        """
+        return dict(self.papers.get(paper_key, {}))
+
+    def update(self, paper_key, records):
+        """
+        :param paper_key: str, key of the paper
+        :param records: dictionary of stage records of the paper
+        """
+        self.papers[paper_key] = records
+
+    def save(self):
+        """
+        Write the manifest atomically.
+        """
+        with atomic_write(self.manifest_path) as manifest_file:
+            json.dump({'papers': self.papers}, manifest_file)
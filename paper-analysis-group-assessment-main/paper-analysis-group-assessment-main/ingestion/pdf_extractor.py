@@ -1,36 +1,84 @@
 """
 pdf_extractor.py
-Module for extracting text from PDF files using pdfplumber.
+Module for extracting text from PDF files using pdfplumber, and paragraphs using PyMuPDF.
 """
 
+import fitz  # PyMuPDF
 import pdfplumber
 import logging
 from pathlib import Path
 
-def extract_text_from_pdf(pdf_file_path: str) -> str:
+# get_text("blocks") 返回的 block 类型: 0 是文字, 1 是图片
+TEXT_BLOCK = 0
+
+def iter_pdf_pages(pdf_file_path: str):
     """
-    Extract all text from a PDF file.
+    Yield the text of a PDF file page by page, so that only one page is held in memory at a time.
+
+    Errors are logged and raised, also in the middle of the pages, so that a caller never takes a
+    partly read document for a complete one.
 
     :param pdf_file_path: str, path to the PDF file.
-    :return: str, the extracted text content from the PDF.
+    :return: generator of (page_number, text), page numbers start at 1; pages without text are skipped.
+    :raises FileNotFoundError: if the file does not exist
     """
     pdf_path = Path(pdf_file_path)
     if not pdf_path.is_file():
         logging.error(f"PDF file not found: {pdf_file_path}")
-        return ""
+        raise FileNotFoundError(f"PDF file not found: {pdf_file_path}")
 
-    all_text = []
     try:
         with pdfplumber.open(pdf_file_path) as pdf:
-            for page in pdf.pages:
+            for page_number, page in enumerate(pdf.pages, start=1):
                 text = page.extract_text()
+                # 释放页面缓存的字符/对象, 否则所有页面会一直留在内存里
+                page.close()
                 # text 可能为空, 如果当前页面没能抽取出任何可识别的文字
                 if text:
-                    all_text.append(text)
-        combined_text = "\n".join(all_text)
-        logging.info(f"Extracted text from {pdf_file_path}, length: {len(combined_text)} characters.")
-        return combined_text
+                    yield page_number, text
 
     except Exception as e:
         logging.error(f"Error while reading PDF {pdf_file_path}: {e}")
+        raise
+
+
+def read_pdf_paragraphs(pdf_file_path: str) -> list:
+    """
+    Read the paragraphs of a PDF file straight from its text layer, without converting it to DOCX.
+    Each text block found by PyMuPDF becomes a paragraph, its lines joined with spaces, in reading
+    order page by page; this matches the paragraphs pdf2docx builds for running text closely
+    enough for entity extraction.
+
+    Errors are raised, so that the caller can report the failed paper.
+
+    :param pdf_file_path: str, path to the PDF file.
+    :return: list of text paragraphs, without blank ones.
+    """
+    paragraphs = []
+    with fitz.open(pdf_file_path) as pdf:
+        for page in pdf:
+            for block in page.get_text("blocks", sort=True):
+                if block[6] != TEXT_BLOCK:
+                    continue
+                # 一个 block 里的换行只是排版换行, 不是段落结束
+                paragraph = " ".join(line.strip() for line in block[4].splitlines() if line.strip())
+                if paragraph:
+                    paragraphs.append(paragraph)
+    return paragraphs
+
+
+def extract_text_from_pdf(pdf_file_path: str) -> str:
+    """
+    Extract all text from a PDF file.
+
+    :param pdf_file_path: str, path to the PDF file.
+    :return: str, the extracted text content from the PDF, empty if the file cannot be read.
+    """
+    try:
+        combined_text = "\n".join(text for _, text in iter_pdf_pages(pdf_file_path))
+    except Exception:
+        # Already logged by iter_pdf_pages
         return ""
+    if combined_text:
+        logging.info(f"Extracted text from {pdf_file_path}, length: {len(combined_text)} characters.")
+    return combined_text
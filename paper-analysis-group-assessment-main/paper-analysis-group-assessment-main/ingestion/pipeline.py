@@ -0,0 +1,274 @@
+"""
+pipeline.py
+Module for running processing stages concurrently, joined by bounded queues.
+
+Each stage runs with its own concurrency (a process pool, or a thread working on batches) and hands
+its results to the next stage through a queue of limited size. A fast stage blocks on a full queue
+instead of piling up work in memory (backpressure), so the whole run takes about as long as the
+slowest stage rather than the sum of all stages.
+
+We provide:
+1) StageMetrics           -> Throughput, busy time and queue depth of a stage
+2) run_in_processes()     -> Stage that maps a function over jobs in a process pool
+3) run_batched()          -> Stage that applies a function to batches of queued items in a thread
+4) iter_queue()           -> Consume the output of the last stage in the calling thread
+5) start_stage()          -> Start a stage in a background thread
+6) format_stage_metrics() -> Summary table of the stages of a run
+"""
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+END = object()  # put on a queue after the last item
+POLL_SECONDS = 0.1  # how often blocked stages check whether the run was stopped
+
+
+class StageMetrics:
+    """
+    Counters of one stage: items processed, time spent working, and depth of its input queue.
+    """
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.queue_depth_max = 0
+        self._queue_depth_total = 0
+        self._queue_depth_samples = 0
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    def sample_queue(self, input_queue):
+        depth = input_queue.qsize()
+        with self._lock:
+            self.queue_depth_max = max(self.queue_depth_max, depth)
+            self._queue_depth_total += depth
+            self._queue_depth_samples += 1
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def as_dict(self):
+        wall_seconds = (self.finished or time.perf_counter()) - self.started
+        return {
+            'stage': self.name,
+            'items': self.items,
+            'wall_seconds': round(wall_seconds, 3),
+            'busy_seconds': round(self.busy_seconds, 3),
+            'items_per_second': round(self.items / wall_seconds, 3) if wall_seconds else 0.0,
+            'utilization': round(self.busy_seconds / (wall_seconds * self.workers), 3) if wall_seconds else 0.0,
+            'queue_depth_mean': round(self._queue_depth_total / self._queue_depth_samples, 2)
+            if self._queue_depth_samples else 0.0,
+            'queue_depth_max': self.queue_depth_max,
+        }
+
+
+def _put(output_queue, item, stop_event):
+    """
+    Put an item on a bounded queue, waiting while it is full unless the run is stopped.
+
+    :return: bool, False if the run was stopped before the item could be queued
+    """
+    while not stop_event.is_set():
+        try:
+            output_queue.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(input_queue, stop_event, block=True):
+    """
+    Get an item from a queue; END if the run is stopped, None if block is False and the queue is empty.
+    """
+    while not stop_event.is_set():
+        try:
+            return input_queue.get(timeout=POLL_SECONDS) if block else input_queue.get_nowait()
+        except queue.Empty:
+            if not block:
+                return None
+    return END
+
+
+def _timed_call(function, args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run_in_processes(function, jobs, workers, output_queue, metrics, stop_event, max_in_flight=None):
+    """
+    Stage that calls function(*job) for every job in a pool of worker processes. At most
+    max_in_flight jobs are submitted ahead of the queue, so a blocked downstream stage also stops
+    new jobs from being started. (job, result, exception or None) is queued as each job completes.
+
+    If a worker process dies (e.g. a crash in native code), the jobs in flight fail with
+    BrokenProcessPool and the run carries on in a new pool.
+
+    :param function: module-level function, so that it can be sent to worker processes
+    :param jobs: iterable of tuples of arguments
+    :param workers: int, number of worker processes
+    :param output_queue: queue.Queue the results are put on, followed by END
+    :param metrics: StageMetrics of the stage
+    :param stop_event: threading.Event set when the run is stopped
+    :param max_in_flight: int, defaults to twice the number of workers
+    """
+    max_in_flight = max_in_flight or 2 * workers
+    jobs = iter(jobs)
+    in_flight = {}
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        exhausted = False
+        while not stop_event.is_set():
+            while not exhausted and len(in_flight) < max_in_flight:
+                job = next(jobs, END)
+                if job is END:
+                    exhausted = True
+                    break
+                in_flight[executor.submit(_timed_call, function, job)] = job
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job = in_flight.pop(future)
+                try:
+                    result, seconds = future.result()
+                except Exception as e:
+                    result, seconds, error = None, 0.0, e
+                    broken = broken or isinstance(e, BrokenProcessPool)
+                else:
+                    error = None
+                metrics.record(1, seconds)
+                if not _put(output_queue, (job, result, error), stop_event):
+                    break
+
+            if broken:
+                # The other jobs of the dead pool fail too, before any job goes to the new pool
+                logging.warning("A worker process died, restarting the process pool")
+                for future, job in list(in_flight.items()):
+                    del in_flight[future]
+                    metrics.record(1, 0.0)
+                    _put(output_queue, (job, None, BrokenProcessPool("A worker process died")), stop_event)
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+
+        if stop_event.is_set():
+            for future in in_flight:
+                future.cancel()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        metrics.finish()
+        _put(output_queue, END, stop_event)
+
+
+def run_batched(function, input_queue, output_queue, batch_size, metrics, stop_event):
+    """
+    Stage that takes up to batch_size items from input_queue at a time and calls function(batch),
+    which returns the items to put on output_queue. A batch is started with whatever is queued,
+    it does not wait to fill up.
+
+    :param function: callable taking a list of items and returning an iterable of items
+    :param input_queue: queue.Queue of items, ended by END
+    :param output_queue: queue.Queue the results are put on, followed by END
+    :param batch_size: int, maximum number of items per call
+    :param metrics: StageMetrics of the stage
+    :param stop_event: threading.Event set when the run is stopped
+    """
+    try:
+        finished = False
+        while not finished:
+            metrics.sample_queue(input_queue)
+            item = _get(input_queue, stop_event)
+            if item is END:
+                break
+            batch = [item]
+            while len(batch) < batch_size:
+                item = _get(input_queue, stop_event, block=False)
+                if item is None:
+                    break
+                if item is END:
+                    finished = True
+                    break
+                batch.append(item)
+
+            start = time.perf_counter()
+            results = list(function(batch))
+            metrics.record(len(batch), time.perf_counter() - start)
+            for result in results:
+                if not _put(output_queue, result, stop_event):
+                    return
+    finally:
+        metrics.finish()
+        _put(output_queue, END, stop_event)
+
+
+def iter_queue(input_queue, metrics, stop_event):
+    """
+    Yield the items of the queue of the last stage until END. The caller records its own work
+    in metrics.
+
+    :param input_queue: queue.Queue of items, ended by END
+    :param metrics: StageMetrics of the consuming stage
+    :param stop_event: threading.Event set when the run is stopped
+    """
+    try:
+        while True:
+            metrics.sample_queue(input_queue)
+            item = _get(input_queue, stop_event)
+            if item is END:
+                return
+            yield item
+    finally:
+        metrics.finish()
+
+
+def start_stage(target, *args):
+    """
+    Run a stage function in a background thread. An unexpected error stops the run and is kept on
+    the thread as `error`, so that the caller can raise it after joining.
+
+    :return: threading.Thread
+    """
+    stop_event = args[-1]
+
+    def run():
+        try:
+            target(*args)
+        except BaseException as e:
+            logging.exception(f"Pipeline stage {getattr(target, '__name__', target)} failed")
+            thread.error = e
+            stop_event.set()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.error = None
+    thread.start()
+    return thread
+
+
+def format_stage_metrics(stage_metrics):
+    """
+    :param stage_metrics: list of StageMetrics
+    :return: str, one line per stage
+    """
+    lines = [f"{'stage':<10}{'items':>8}{'wall s':>10}{'busy s':>10}{'items/s':>10}{'util':>7}{'queue avg':>11}"
+             f"{'queue max':>11}"]
+    for metrics in stage_metrics:
+        row = metrics.as_dict()
+        lines.append(f"{row['stage']:<10}{row['items']:>8}{row['wall_seconds']:>10.2f}{row['busy_seconds']:>10.2f}"
+                     f"{row['items_per_second']:>10.2f}{row['utilization']:>7.2f}{row['queue_depth_mean']:>11.2f}"
+                     f"{row['queue_depth_max']:>11}")
+    return "\n".join(lines)
@@ -0,0 +1,133 @@
+"""
+query_cache.py
+Module for memoizing query results between database writes.
+
+Table 'data_generation' holds one counter that every write of papers or entities increments, in the
+same transaction as the write (see bump_generation). A QueryCache remembers the rows of the query
+plans it ran together with the generation they were read at; before answering from memory it reads
+the counter again, a single primary key lookup, and forgets everything if it moved. Writes made by
+another process, e.g. an ingestion running next to the query prompt, are seen once they are
+committed.
+
+We provide:
+1) GENERATION_TABLE  -> Statement creating the counter table (schema migration 5)
+2) bump_generation() -> Invalidate the cached results of every connection
+3) QueryCache        -> Size-bounded LRU cache of query results keyed on the query plan
+"""
+
+import logging
+import sqlite3
+from collections import OrderedDict
+
+QUERY_RESULT_CACHE_SIZE = 512  # query plans whose rows are kept
+QUERY_RESULT_MAX_ROWS = 10000  # larger results are not cached
+
+GENERATION_TABLE = """
+    CREATE TABLE IF NOT EXISTS data_generation (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        generation INTEGER NOT NULL
+    )
+"""
+
+
+def read_generation(cur):
+    """
+    :param cur: connection cursor
+    :return: int, current generation, 0 if the table is missing or empty
+    """
+    try:
+        row = cur.execute("SELECT generation FROM data_generation WHERE id = 0").fetchone()
+    except sqlite3.OperationalError:
+        # A database older than schema version 5, nothing ever bumps it
+        return 0
+    return row[0] if row is not None else 0
+
+
+def bump_generation(cur):
+    """
+    Increment the generation, so that every QueryCache drops the results it read before this write.
+    Call it in the transaction of the write.
+
+    :param cur: connection cursor
+    """
+    cur.execute("""
+        INSERT INTO data_generation(id, generation) VALUES(0, 1)
+        ON CONFLICT(id) DO UPDATE SET generation=generation+1
+    """)
+
+
+class QueryCache:
+    """
+    Rows of query plans, kept in an LRU dictionary of at most max_entries plans and valid for one
+    generation of the data.
+    """
+
+    def __init__(self, cur, max_entries=QUERY_RESULT_CACHE_SIZE, max_rows=QUERY_RESULT_MAX_ROWS):
+        """
+        :param cur: connection cursor the queries are run with
+        :param max_entries: int, maximum number of query plans whose rows are kept
+        :param max_rows: int, results with more rows are returned but not kept
+        """
+        self.cur = cur
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.generation = None
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def execute(self, query_plan):
+        """
+        Rows of a query plan, from memory if it ran since the data last changed.
+
+        :param query_plan: QueryPlan, see document_processor.parse_user_query
+        :return: list of result rows
+        """
+        return self.fetch(query_plan)[1]
+
+    def fetch(self, query_plan):
+        """
+        Like execute, with the names of the result columns.
+
+        :param query_plan: QueryPlan, see document_processor.parse_user_query
+        :return: (list of column names, list of result rows)
+        """
+        generation = read_generation(self.cur)
+        if generation != self.generation:
+            if self._results:
+                self.invalidations += 1
+                logging.debug(f"Data changed (generation {self.generation} -> {generation}), query cache cleared")
+            self._results.clear()
+            self.generation = generation
+
+        key = (query_plan.sql, tuple(query_plan.params))
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.hits += 1
+            return self._results[key]
+
+        self.misses += 1
+        rows = self.cur.execute(query_plan.sql, query_plan.params).fetchall()
+        result = ([column[0] for column in self.cur.description], rows)
+        if self.max_entries > 0 and len(rows) <= self.max_rows:
+            self._results[key] = result
+            if len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        self._results.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'lookups': lookups,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'cached_queries': len(self._results),
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+            'generation': self.generation,
+        }
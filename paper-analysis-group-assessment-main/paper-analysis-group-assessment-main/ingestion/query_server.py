@@ -0,0 +1,357 @@
+"""
+query_server.py
+Module for querying the paper/entity database over HTTP, for dashboards and scripts.
+
+A QueryServer answers each request in its own thread with a connection borrowed from a
+ConnectionPool of read-only SQLite connections. SQLite releases the GIL while it steps through a
+statement, so requests are answered in parallel; in WAL mode they neither block nor are blocked by
+an ingestion writing to the same database. Every pooled connection has its own QueryCache, which
+drops its results when the data changes.
+
+Endpoints (GET, JSON):
+    /query?q=get all papers that mention person Fiona Calvert
+        a question in the grammar of the query prompt, see document_processor.parse_user_query;
+        'search' returns every matching paper, best first, in pages like the other questions
+    /papers?person=Fiona Calvert&organisation=Google&match=any
+        papers that mention entities: person, organisation, work, or entity for any type, each
+        repeatable; all of them must be mentioned, any of them with match=any
+    /stats
+        counters of the server, the connection pool and the query caches
+
+Results come in pages of 'limit' rows (default PAGE_SIZE, at most MAX_PAGE_SIZE) starting at
+'offset', as {"rows": [...], "offset", "limit", "next_offset", "generation"}. 'next_offset' is null
+on the last page, and a change of 'generation' between two pages means the data changed in between.
+With stream=1 the rows from 'offset' on (at most 'limit' if given) are sent as JSON lines, read from
+the database while they are sent; the connection stays borrowed until the last row is written.
+
+We provide:
+1) ConnectionPool -> Fixed-size pool of read-only connections and their query caches
+2) page_plan()    -> Query plan of a window of the rows of another query plan
+3) filter_plan()  -> Query plan of the structured filters of a /papers request
+4) QueryServer    -> Threaded HTTP server of the endpoints
+5) serve()        -> Run a QueryServer until interrupted
+"""
+
+import os
+import json
+import queue
+import signal
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from ingestion import document_processor as dp
+from ingestion.query_cache import QueryCache
+
+SERVER_HOST = os.environ.get("PSD_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("PSD_SERVER_PORT", 8765))
+POOL_SIZE = int(os.environ.get("PSD_POOL_SIZE", min(8, os.cpu_count() or 1)))
+POOL_TIMEOUT = 5.0  # seconds a request waits for a free connection before it is answered 503
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_ROWS = 500  # rows read and sent per chunk of a streamed result
+
+# Parameters of /papers and the entity type they filter on
+FILTER_TYPES = {'person': 'PERSON', 'organisation': 'ORG', 'work': 'WORK_OF_ART', 'entity': None}
+
+
+class ConnectionPool:
+    """
+    Read-only connections to one database, each with its QueryCache, opened up front and lent to
+    one thread at a time.
+    """
+
+    def __init__(self, db_file, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        """
+        :param db_file: str, SQLite database file, in WAL mode
+        :param size: int, number of connections
+        :param timeout: float, seconds connection() waits for a free connection
+        """
+        self.db_file = db_file
+        self.size = max(1, size)
+        self.timeout = timeout
+        # Last in, first out: under light load the same few connections, with warm caches, do the work
+        self._idle = queue.LifoQueue()
+        self._caches = []
+        self._lock = threading.Lock()
+        self.borrowed = 0
+        self.waits = 0
+        self.timeouts = 0
+        for _ in range(self.size):
+            conn = self._connect()
+            query_cache = QueryCache(conn.cursor())
+            self._caches.append(query_cache)
+            self._idle.put((conn, query_cache))
+
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode != 'wal':
+            logging.warning(f"{db_file} is in {journal_mode} journal mode, queries and writes block each other")
+
+    def _connect(self):
+        uri = Path(self.db_file).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=dp.QUERY_CACHE_SIZE)
+        # The connections share the page cache budget of one connection; the memory map serves the rest
+        conn.execute(f"PRAGMA cache_size=-{max(2048, dp.DB_CACHE_SIZE_KIB // self.size)}")
+        conn.execute(f"PRAGMA mmap_size={int(dp.DB_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection and its QueryCache for the duration of the with block.
+
+        :raises TimeoutError: if no connection became free within the timeout
+        """
+        try:
+            item = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.waits += 1
+            try:
+                item = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self.timeouts += 1
+                raise TimeoutError(f"No free database connection within {self.timeout}s") from None
+        with self._lock:
+            self.borrowed += 1
+        try:
+            yield item
+        finally:
+            self._idle.put(item)
+
+    def close(self):
+        """Close the connections, waiting up to the timeout for each borrowed one."""
+        for _ in range(self.size):
+            try:
+                conn, _ = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                logging.warning("A database connection is still in use, not closing it")
+                continue
+            conn.close()
+
+    def stats(self):
+        hits = sum(query_cache.hits for query_cache in self._caches)
+        lookups = hits + sum(query_cache.misses for query_cache in self._caches)
+        with self._lock:
+            return {
+                'size': self.size,
+                'idle': self._idle.qsize(),
+                'borrowed': self.borrowed,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'cache_lookups': lookups,
+                'cache_hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'cache_invalidations': sum(query_cache.invalidations for query_cache in self._caches),
+            }
+
+
+def page_plan(query_plan, limit, offset):
+    """
+    :param query_plan: QueryPlan of the whole result
+    :param limit: int, maximum number of rows, -1 for every row after offset
+    :param offset: int, number of rows skipped
+    :return: QueryPlan of the rows [offset, offset + limit) of query_plan, in its order
+    """
+    return dp.QueryPlan(f"SELECT * FROM ({query_plan.sql}) LIMIT ? OFFSET ?",
+                        tuple(query_plan.params) + (limit, offset))
+
+
+def filter_plan(args):
+    """
+    :param args: dictionary of the request parameters, as returned by parse_qs
+    :return: QueryPlan of the papers that mention the entities of FILTER_TYPES parameters
+    :raises ValueError: if there is no filter, or match is neither 'all' nor 'any'
+    """
+    conditions = [(entity_type, name.strip()) for parameter, entity_type in FILTER_TYPES.items()
+                  for name in args.get(parameter, []) if name.strip()]
+    if not conditions:
+        raise ValueError(f"Give at least one of the parameters {', '.join(FILTER_TYPES)}")
+    match = args.get('match', ['all'])[-1].lower()
+    if match not in ('all', 'any'):
+        raise ValueError("match must be 'all' or 'any'")
+    operator = 'and' if match == 'all' else 'or'
+    return dp.build_mention_plan(conditions, [operator] * (len(conditions) - 1))
+
+
+def parse_paging(args):
+    """
+    :param args: dictionary of the request parameters, as returned by parse_qs
+    :return: (limit or None if not given, offset, whether to stream)
+    :raises ValueError: if limit or offset is not a number in range
+    """
+    limit = args.get('limit', [None])[-1]
+    offset = args.get('offset', ['0'])[-1]
+    stream = args.get('stream', ['0'])[-1].lower() in ('1', 'true', 'yes')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError("limit must be a positive number")
+        limit = int(limit)
+        if not stream and limit > MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be at most {MAX_PAGE_SIZE}, use stream=1 for larger results")
+    if not offset.isdigit():
+        raise ValueError("offset must be a number")
+    return limit, int(offset), stream
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections for the clients, and chunked transfer for the streamed results
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes: with Nagle's algorithm the body would wait for the
+    # delayed ACK of the headers, about 40ms per response on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        args = parse_qs(url.query)
+        try:
+            if url.path == '/stats':
+                self.send_json(HTTPStatus.OK, self.server.stats())
+                return
+            if url.path == '/query':
+                # Searches are paged here like every other result, not cut at SEARCH_RESULT_LIMIT
+                query_plan = dp.parse_user_query(args.get('q', [''])[-1], search_limit=-1)
+                if query_plan is None:
+                    raise ValueError("Invalid query")
+            elif url.path == '/papers':
+                query_plan = filter_plan(args)
+            else:
+                self.send_json(HTTPStatus.NOT_FOUND, {'error': f"Unknown endpoint {url.path}"})
+                return
+
+            limit, offset, stream = parse_paging(args)
+            if stream:
+                self.send_stream(query_plan, limit, offset)
+            else:
+                self.send_page(query_plan, limit or PAGE_SIZE, offset)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+        except TimeoutError as e:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': str(e)})
+        except sqlite3.Error as e:
+            logging.exception(f"Query failed: {self.path}")
+            self.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+
+    def send_page(self, query_plan, limit, offset):
+        with self.server.pool.connection() as (_, query_cache):
+            # One row more than asked for tells whether there is a next page
+            columns, rows = query_cache.fetch(page_plan(query_plan, limit + 1, offset))
+            generation = query_cache.generation
+        self.send_json(HTTPStatus.OK, {
+            'rows': [dict(zip(columns, row)) for row in rows[:limit]],
+            'offset': offset,
+            'limit': limit,
+            'next_offset': offset + limit if len(rows) > limit else None,
+            'generation': generation,
+        })
+
+    def send_stream(self, query_plan, limit, offset):
+        with self.server.pool.connection() as (conn, _):
+            cur = conn.cursor()
+            try:
+                plan = page_plan(query_plan, limit if limit is not None else -1, offset)
+                cur.execute(plan.sql, plan.params)
+                columns = [column[0] for column in cur.description]
+                self.send_response(HTTPStatus.OK)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    while True:
+                        rows = cur.fetchmany(STREAM_BATCH_ROWS)
+                        if not rows:
+                            break
+                        self.write_chunk(''.join(json.dumps(dict(zip(columns, row))) + '\n'
+                                                 for row in rows).encode('utf-8'))
+                    self.write_chunk(b"")
+                except (sqlite3.Error, OSError) as e:
+                    # The status is sent already: end the response without its last chunk, so that
+                    # the client sees the result is incomplete
+                    logging.warning(f"Stream of {self.path} interrupted: {e}")
+                    self.close_connection = True
+            finally:
+                cur.close()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_request(self, code='-', size='-'):
+        self.server.count_response(code)
+        logging.debug(f"{self.address_string()} {self.requestline} {code}")
+
+    def log_message(self, format, *args):
+        logging.warning(f"{self.address_string()} {format % args}")
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    HTTP server of the query endpoints, one thread per client connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, db_file, host=SERVER_HOST, port=SERVER_PORT, pool_size=POOL_SIZE):
+        """
+        :param db_file: str, SQLite database file, in WAL mode
+        :param host: str, address to listen on
+        :param port: int, port to listen on, 0 for any free port
+        :param pool_size: int, number of read-only database connections
+        """
+        super().__init__((host, port), QueryRequestHandler)
+        try:
+            self.pool = ConnectionPool(db_file, pool_size)
+        except Exception:
+            super().server_close()
+            raise
+        self._lock = threading.Lock()
+        self.responses = Counter()
+
+    def count_response(self, code):
+        with self._lock:
+            self.responses[int(code)] += 1
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+
+    def stats(self):
+        with self._lock:
+            responses = {str(code): count for code, count in sorted(self.responses.items())}
+        return {'responses': responses, 'pool': self.pool.stats()}
+
+
+def serve(db_file, host=SERVER_HOST, port=SERVER_PORT, pool_size=POOL_SIZE):
+    """
+    Answer queries over HTTP until SIGINT or SIGTERM.
+
+    :param db_file: str, SQLite database file, in WAL mode
+    :param host: str, address to listen on
+    :param port: int, port to listen on, 0 for any free port
+    :param pool_size: int, number of read-only database connections
+    """
+    server = QueryServer(db_file, host, port, pool_size)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    host, port = server.server_address[:2]
+    logging.info(f"Answering queries on http://{host}:{port}/ with {server.pool.size} database connections")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info(f"Query server: {server.stats()}")
+        server.server_close()
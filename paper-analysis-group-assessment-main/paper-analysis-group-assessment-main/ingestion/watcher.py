@@ -0,0 +1,273 @@
+"""
+watcher.py
+Module for ingesting papers as they arrive, without a batch run over the whole index.
+
+A PaperWatcher is a long-running asyncio service. It polls a directory (Papers/, or any directory
+used as a drop-box queue) for PDFs, and a PDF whose size and modification time did not change
+between two polls is taken as completely written. New and changed PDFs go through the same
+functions as a batch run: conversion in a pool of worker processes, then NER and the database write
+in a single thread that owns the SQLite connection and the NLP model. Every paper is committed on
+its own, with its journal row, so it can be queried as soon as it is written. PDFs the journal
+shows as loaded (or failed) from the same file are skipped, so restarting the service only picks up
+what changed while it was down. A PDF rewritten while its previous version is still being ingested
+waits for it, and only its latest version is ingested next, so an older result never overwrites a
+newer one.
+
+The service keeps running counters and the last WATCH_RECENT_PAPERS traces and failures, so its
+memory does not grow with the number of papers it has seen.
+
+Papers are named after the title given by the index (reloaded when it changes), or after their file
+name if the index does not list them.
+
+We provide:
+1) scan_pdfs()   -> Size and modification time of the PDFs of a directory
+2) PaperWatcher  -> Watch a directory and ingest new or changed PDFs
+"""
+
+import os
+import time
+import signal
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ingestion import document_processor as dp
+from ingestion.entity_resolver import EntityResolver
+from ingestion.instrumentation import Instrumentation
+from ingestion.manifest import Manifest
+
+WATCH_POLL_SECONDS = float(os.environ.get("PSD_WATCH_POLL", 2.0))  # seconds between two scans
+WATCH_RECENT_PAPERS = 1000  # traces and failures kept for the summary of the service
+
+
+def scan_pdfs(directory):
+    """
+    :param directory: str, directory to scan (not recursively)
+    :return: dictionary mapping the file name of each PDF to its (size in bytes, mtime in ns)
+    """
+    pdfs = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith('.pdf') and not entry.name.startswith('.') and entry.is_file():
+                    stat = entry.stat()
+                    pdfs[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        logging.warning(f"Watched directory {directory} does not exist")
+    return pdfs
+
+
+class PaperWatcher:
+    """
+    Ingest the PDFs of a directory as they appear or change. Conversion runs in a process pool;
+    NER and the database writes run in one dedicated thread, so the event loop only schedules.
+    """
+
+    def __init__(self, db_file, watch_dir=dp.SOURCE_PATH, xlsx_path=None, workers=dp.NUM_WORKERS,
+                 text_source=dp.TEXT_SOURCE, poll_seconds=WATCH_POLL_SECONDS, nlp_model=None, instrumentation=None):
+        """
+        :param db_file: str, SQLite database file
+        :param watch_dir: str, directory watched for PDFs
+        :param xlsx_path: str, Excel index the titles of the papers are read from, if given
+        :param workers: int, number of conversion worker processes
+        :param text_source: str, one of TEXT_SOURCES
+        :param poll_seconds: float, seconds between two scans of watch_dir
+        :param nlp_model: spaCy NLP model, loaded with load_nlp_model if not given
+        :param instrumentation: Instrumentation collecting the paper traces, best with max_finished set
+        """
+        self.db_file = db_file
+        self.watch_dir = watch_dir
+        self.xlsx_path = xlsx_path
+        self.workers = max(1, workers)
+        self.text_source = text_source
+        self.poll_seconds = poll_seconds
+        self.nlp_model = nlp_model
+        self.instrumentation = instrumentation or Instrumentation(max_finished=WATCH_RECENT_PAPERS)
+        self.loaded = 0
+        self.failed = 0
+        # pdf path -> error of the papers whose latest version failed, the last WATCH_RECENT_PAPERS of them
+        self.failed_files = OrderedDict()
+        self._titles = {}
+        self._titles_mtime = None
+        self._stop = None
+        self._loop = None
+        # Set up by _open() in the database thread
+        self.conn = None
+        self.cur = None
+        self.manifest = None
+        self.versions = None
+        self.resolver = None
+
+    def stop(self):
+        """Stop after the papers in flight are written; safe to call from any thread."""
+        if self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def run(self, once=False):
+        """
+        Watch the directory until stop() is called (or SIGINT/SIGTERM is received).
+
+        :param once: bool, ingest the PDFs present now, without waiting for them to be stable, and return
+        :return: dictionary mapping the pdf path of each paper whose latest version failed to its error
+        """
+        loop = self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not the main thread, or a platform without signal handlers in the event loop
+                pass
+
+        self._database = ThreadPoolExecutor(max_workers=1, thread_name_prefix='psd-database')
+        self._converters = ProcessPoolExecutor(max_workers=self.workers)
+        self._slots = asyncio.Semaphore(self.workers)
+        in_flight = {}  # file name -> task ingesting it
+        try:
+            await loop.run_in_executor(self._database, self._open)
+            logging.info(f"Watching {self.watch_dir} for PDFs every {self.poll_seconds}s")
+            previous = {}
+            submitted = {}
+            while True:
+                current = scan_pdfs(self.watch_dir)
+                # A PDF is complete once two scans agree on it; each version of a file is submitted once,
+                # after the ingestion of its previous version (a newer version found meanwhile is
+                # submitted by the first scan after it)
+                ready = [name for name, fingerprint in sorted(current.items())
+                         if (once or previous.get(name) == fingerprint) and submitted.get(name) != fingerprint
+                         and name not in in_flight]
+                previous = current
+                if ready:
+                    for name in ready:
+                        submitted[name] = current[name]
+                    jobs = await loop.run_in_executor(self._database, self._unfinished,
+                                                      {name: current[name] for name in ready})
+                    for paper, records in jobs:
+                        name = os.path.basename(paper['paper_pdf'])
+                        task = asyncio.create_task(self._ingest(paper, records, time.perf_counter()))
+                        in_flight[name] = task
+                        task.add_done_callback(lambda _, name=name: in_flight.pop(name, None))
+                for name in set(submitted) - set(current):
+                    # Deleted: ingest it again if it comes back
+                    del submitted[name]
+
+                if once:
+                    break
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.poll_seconds)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if in_flight:
+                logging.info(f"Waiting for {len(in_flight)} papers in flight")
+                await asyncio.gather(*in_flight.values(), return_exceptions=True)
+            self._converters.shutdown(wait=True, cancel_futures=True)
+            await loop.run_in_executor(self._database, self._close)
+            self._database.shutdown(wait=True)
+        return self.failed_files
+
+    async def _ingest(self, paper, records, detected):
+        loop = asyncio.get_running_loop()
+        result = error = None
+        async with self._slots:
+            converters = self._converters
+            try:
+                result = await loop.run_in_executor(converters, dp.trace_convert_document, paper, records,
+                                                    self.versions, self.text_source)
+            except BrokenProcessPool as e:
+                # A worker died (e.g. out of memory on a huge PDF): fail the paper, start a new pool
+                error = e
+                if self._converters is converters:
+                    logging.warning("Conversion worker process died, restarting the pool")
+                    self._converters = ProcessPoolExecutor(max_workers=self.workers)
+            except Exception as e:
+                error = e
+        try:
+            await loop.run_in_executor(self._database, self._write, paper, result, error, detected)
+        except Exception:
+            # e.g. the database is locked: the paper is picked up again when the service restarts
+            logging.exception(f"Failed to write {paper['paper_pdf']}")
+            self.instrumentation.discard(paper['paper_pdf'])
+            self.instrumentation.count('papers_write_errors')
+
+    def _open(self):
+        if self.nlp_model is None:
+            self.nlp_model = dp.load_nlp_model()
+        self.conn = dp.get_database_connection(self.db_file)
+        dp.setup_database(self.conn)
+        self.cur = self.conn.cursor()
+        self.manifest = Manifest(dp.MANIFEST_FILE)
+        self.versions = dp.get_stage_versions(self.nlp_model, self.text_source)
+        self.resolver = EntityResolver(self.cur)
+
+    def _close(self):
+        if self.conn is None:
+            return
+        self.conn.commit()
+        self.manifest.save()
+        logging.info(f"Ingested {self.loaded} papers, {self.failed} failed")
+        logging.info(f"Entity resolver: {self.resolver.stats()}")
+        logging.info("Paper traces:\n" + self.instrumentation.format_summary())
+        self.instrumentation.close()
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+        self.conn = None
+
+    def _paper(self, pdf_name, fingerprint):
+        if self.xlsx_path and os.path.exists(self.xlsx_path):
+            mtime = os.stat(self.xlsx_path).st_mtime_ns
+            if mtime != self._titles_mtime:
+                self._titles_mtime = mtime
+                try:
+                    self._titles = {os.path.basename(row['paper_pdf']): row['paper_name']
+                                    for row in dp.iter_paper_index(self.xlsx_path)}
+                except Exception as e:
+                    # e.g. the index is being saved: keep the titles read before, until it changes again
+                    logging.warning(f"Could not read the titles of {self.xlsx_path}: {e}")
+        # The journal records the version that was scanned, not the one on disk when the paper is written
+        return {'paper_name': self._titles.get(pdf_name, pdf_name), **dp.paper_paths(pdf_name, self.watch_dir),
+                'pdf_fingerprint': fingerprint}
+
+    def _unfinished(self, fingerprints):
+        """
+        :param fingerprints: dictionary mapping PDF file names to their (size, mtime in ns)
+        :return: list of (paper, stage records) of the PDFs the journal does not show as done
+        """
+        papers = [self._paper(pdf_name, fingerprint) for pdf_name, fingerprint in fingerprints.items()]
+        papers = dp.iter_unfinished_papers(papers, dp.load_journal(self.cur), dp.get_versions_key(self.versions),
+                                           instrumentation=self.instrumentation)
+        return [(paper, self.manifest.get(paper['paper_pdf'])) for paper in papers]
+
+    def _write(self, paper, result, error, detected):
+        if error is not None:
+            document = (paper, None, None, None, error)
+        else:
+            full_text_array, records, trace = result
+            self.instrumentation.add(trace)
+            extracted, _ = dp.extract_traced_entities([(paper, full_text_array, records)], self.nlp_model,
+                                                      self.versions, self.instrumentation)
+            document = extracted[0]
+        failed_files = {}
+        try:
+            loaded = dp.write_document(document, self.cur, self.manifest, self.versions, self.resolver,
+                                       self.instrumentation, [], failed_files)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            self.resolver.invalidate()
+            raise
+        self.manifest.save()
+
+        pdf = paper['paper_pdf']
+        self.failed_files.pop(pdf, None)
+        if loaded:
+            self.loaded += 1
+            logging.info(f"Ingested {pdf} {time.perf_counter() - detected:.2f}s after it was found")
+        else:
+            self.failed += 1
+            self.failed_files[pdf] = failed_files[pdf]
+            if len(self.failed_files) > WATCH_RECENT_PAPERS:
+                self.failed_files.popitem(last=False)
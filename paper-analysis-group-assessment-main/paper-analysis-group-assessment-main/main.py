@@ -2,81 +2,403 @@
 
 import sys
 import os
+import json
+import glob
+import time
 import logging
+import argparse
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
 from pathlib import Path
 
 # 导入提取器
-from ingestion.pdf_extractor import extract_text_from_pdf
-from ingestion.docx_extractor import extract_text_from_docx
-from ingestion.excel_extractor import extract_data_from_excel
+from ingestion.pdf_extractor import iter_pdf_pages
+from ingestion.docx_extractor import read_text_from_docx
+from ingestion.excel_extractor import iter_rows_from_excel
 
 # 导入清洗器
-from ingestion.cleaners import clean_text, normalize_text, clean_row
+from ingestion.cleaners import clean_text, normalize_text, clean_rows, clean_text_stream, normalize_text_stream
+from ingestion.manifest import atomic_write
+from ingestion.instrumentation import Instrumentation, PaperTrace, stage_timer
 
 logging.basicConfig(level=logging.INFO)
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python main.py <file1> <file2> ...")
-        sys.exit(1)
+ROWS_PER_CHUNK = 1000  # 表格每次清洗的行数
+OUTPUT_DIR = "data/extracted"
+FAILED_FILE = ".failed.json"  # 输出目录里记下上次提取失败的文件, 下次运行时不管输出新旧都重新提取
+PROGRESS_SECONDS = 5  # 批量模式下每隔多少秒打印一次进度
 
-    output_dir = Path("data/extracted")
-    output_dir.mkdir(parents=True, exist_ok=True)
+# 一种文件格式的提取函数 function(file_path, out_file, trace) -> 写出的字符数, 以及输出文件的后缀
+Extractor = namedtuple('Extractor', ['function', 'output_suffix'])
 
-    for file_path in sys.argv[1:]:
-        path_obj = Path(file_path)
-        ext = path_obj.suffix.lower()
 
-        if not path_obj.exists():
-            logging.error(f"File not found: {file_path}")
-            continue
+def available_cores():
+    """
+    Number of cores this process may run on (the CPU affinity where the platform has one).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def iter_pdf_text(file_path):
+    """
+    Yield the text of a PDF page by page, with the newline that separates pages.
+    """
+    for page_index, (page_number, text) in enumerate(iter_pdf_pages(file_path)):
+        if page_index:
+            yield "\n"
+        logging.debug(f"Read page {page_number} of {file_path}, length: {len(text)} chars.")
+        yield text
+
+
+def iter_table_lines(rows):
+    """
+    Clean rows chunk by chunk with clean_rows() and yield them as comma separated lines.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, ROWS_PER_CHUNK))
+        if not chunk:
+            break
+        for r in clean_rows(chunk):
+            # 把列表 join 成文本, 用逗号隔开
+            yield ",".join(r) + "\n"
+
+
+def write_text_stream(out_file, pieces):
+    """
+    Append text pieces to out_file as they arrive; the file only appears once it is complete.
+
+    :return: int, number of characters written
+    """
+    written = 0
+    with atomic_write(out_file, encoding="utf-8") as f:
+        for piece in pieces:
+            f.write(piece)
+            written += len(piece)
+    return written
+
+
+def extract_pdf(file_path, out_file, trace=None):
+    # 逐页读取、清洗、normalization, 边处理边写入, 内存只和单页大小有关
+    # (读、洗、写交替进行, 所以只能整体计时)
+    pieces = normalize_text_stream(clean_text_stream(iter_pdf_text(file_path)))
+    with stage_timer(trace, 'stream'):
+        written = write_text_stream(out_file, pieces)
+    logging.info(f"Saved PDF text to {out_file}, length: {written} characters.")
+    return written
+
+
+def extract_docx(file_path, out_file, trace=None):
+    with stage_timer(trace, 'extract'):
+        raw_text = read_text_from_docx(file_path)
+    # 同样清洗
+    with stage_timer(trace, 'clean'):
+        normalized = normalize_text(clean_text(raw_text))
+    with stage_timer(trace, 'write'):
+        written = write_text_stream(out_file, [normalized])
+    logging.info(f"Saved DOCX text to {out_file}")
+    return written
+
+
+def extract_xlsx(file_path, out_file, trace=None):
+    # read-only 模式逐行读取, 按块清洗后马上写出, 不把整张表放进内存
+    rows = (row for row in iter_rows_from_excel(file_path) if row)
+    # 写到 .txt（或 CSV）
+    with stage_timer(trace, 'stream'):
+        written = write_text_stream(out_file, iter_table_lines(rows))
+    logging.info(f"Saved Excel data to {out_file}")
+    return written
 
-        if ext == ".pdf":
-            raw_text = extract_text_from_pdf(file_path)
-            # 调用清洗
-            cleaned = clean_text(raw_text)
-            # 可选：再做 normalization
-            normalized = normalize_text(cleaned)
-
-            out_file = output_dir / (path_obj.stem + ".txt")
-            with open(out_file, "w", encoding="utf-8") as f:
-                f.write(normalized)
-            logging.info(f"Saved PDF text to {out_file}")
-
-        elif ext == ".docx":
-            raw_text = extract_text_from_docx(file_path)
-            # 同样清洗
-            cleaned = clean_text(raw_text)
-            normalized = normalize_text(cleaned)
-
-            out_file = output_dir / (path_obj.stem + ".txt")
-            with open(out_file, "w", encoding="utf-8") as f:
-                f.write(normalized)
-            logging.info(f"Saved DOCX text to {out_file}")
-
-        elif ext == ".xlsx":
-            rows = extract_data_from_excel(file_path)
-
-            # 逐行清洗
-            cleaned_rows = []
-            for row in rows:
-                if not row:
-                    continue
-                # 用 clean_row
-                c_row = clean_row(row)
-                cleaned_rows.append(c_row)
-
-            # 写到 .txt（或 CSV）
-            out_file = output_dir / (path_obj.stem + "_table.txt")
-            with open(out_file, "w", encoding="utf-8") as f:
-                for r in cleaned_rows:
-                    # 把列表 join 成文本, 用逗号隔开
-                    line = ",".join(r)
-                    f.write(line + "\n")
-
-            logging.info(f"Saved Excel data to {out_file}")
+
+# 按扩展名分派; 新的格式只需要在这里登记一个提取函数
+EXTRACTORS = {
+    ".pdf": Extractor(extract_pdf, ".txt"),
+    ".docx": Extractor(extract_docx, ".txt"),
+    ".xlsx": Extractor(extract_xlsx, "_table.txt"),
+}
+
+
+def output_path(file_path, output_dir, relative_path=None):
+    """
+    The text of a file is written to output_dir as <stem>.txt (<stem>_table.txt for tables). Files
+    whose names would collide are given relative_path, and are written under output_dir at that
+    path with the output suffix appended to their full name (a/x.pdf -> a/x.pdf.txt) instead.
+
+    :param relative_path: path of the file relative to the input it was found by, see expand_inputs
+    :return: Path of the text file written for file_path, None if its format is not supported
+    """
+    path_obj = Path(file_path)
+    extractor = EXTRACTORS.get(path_obj.suffix.lower())
+    if extractor is None:
+        return None
+    if relative_path is None:
+        return Path(output_dir) / (path_obj.stem + extractor.output_suffix)
+    relative_path = Path(relative_path)
+    return Path(output_dir) / relative_path.parent / (relative_path.name + extractor.output_suffix)
+
+
+def glob_root(pattern):
+    """
+    :return: Path, directory part of a glob pattern before its first wildcard
+    """
+    root = []
+    for part in Path(pattern).parts:
+        if glob.has_magic(part):
+            break
+        root.append(part)
+    return Path(*root) if root else Path(".")
+
+
+def expand_inputs(inputs):
+    """
+    Expand the command line inputs into the files to extract, in order and without duplicates:
+    a directory stands for every supported file below it, a pattern with *, ? or [ is globbed
+    (** matches across directories), anything else is taken as a file path. Files whose
+    <stem>.txt would collide with that of another file keep their path relative to the directory
+    or the fixed part of the pattern, and their extension, in the output directory instead.
+
+    :param inputs: list of str
+    :return: list of (file path, path relative to its input or None), both str, see output_path
+    :raises ValueError: if two different files would still be written to the same output file
+    """
+    files = {}
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(str(path) for path in Path(item).rglob("*")
+                             if path.is_file() and path.suffix.lower() in EXTRACTORS)
+            root = Path(item)
+        elif glob.has_magic(item):
+            matches = sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+            if not matches:
+                logging.warning(f"No files match {item}")
+            root = glob_root(item)
         else:
-            logging.warning(f"Unsupported file extension '{ext}' for {file_path}. Skipping.")
+            matches = [item]
+            root = Path(item).parent
+        for match in matches:
+            files.setdefault(match, str(Path(match).relative_to(root)))
+
+    def output_key(file_path, relative_path=None):
+        out_file = output_path(file_path, "", relative_path)
+        return os.path.normcase(str(out_file)) if out_file is not None else None
+
+    keys = {file_path: output_key(file_path) for file_path in files}
+    names = Counter(key for key in keys.values() if key is not None)
+    expanded = [(file_path, relative_path if names[keys[file_path]] > 1 else None)
+                for file_path, relative_path in files.items()]
+
+    outputs = {}
+    for file_path, relative_path in expanded:
+        key = output_key(file_path, relative_path)
+        # Unsupported files are skipped by extract_file
+        if key is None:
+            continue
+        other = outputs.setdefault(key, file_path)
+        if other != file_path:
+            raise ValueError(f"{other} and {file_path} would both be extracted to {key}; "
+                             f"extract them in separate runs with different output directories")
+    return expanded
+
+
+def is_up_to_date(file_path, out_file):
+    """
+    :return: bool, True if out_file exists and is not older than file_path
+    """
+    try:
+        return os.stat(out_file).st_mtime_ns >= os.stat(file_path).st_mtime_ns
+    except OSError:
+        return False
+
+
+def output_name(file_path, relative_path=None):
+    """
+    :return: str, path of the output of file_path relative to the output directory, None if its
+        format is not supported
+    """
+    out_file = output_path(file_path, "", relative_path)
+    return out_file.as_posix() if out_file is not None else None
+
+
+def load_failed(output_dir):
+    """
+    :return: dictionary of the files whose last extraction into output_dir failed, by output name
+        (see output_name): {'file': file path, 'error': error message}
+    """
+    try:
+        with open(Path(output_dir) / FAILED_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable {FAILED_FILE} in {output_dir}: {e}")
+        return {}
+
+
+def save_failed(output_dir, failed):
+    """
+    Replace the failed files recorded in output_dir with failed, see load_failed.
+    """
+    failed_file = Path(output_dir) / FAILED_FILE
+    if not failed:
+        failed_file.unlink(missing_ok=True)
+        return
+    with atomic_write(failed_file, encoding="utf-8") as f:
+        json.dump(failed, f, indent=2, sort_keys=True)
+
+
+def extract_file(file_path, output_dir, trace=None, force=False, relative_path=None):
+    """
+    Extract, clean and save the text of one file.
+
+    :param file_path: str, path to a PDF, DOCX or XLSX file
+    :param output_dir: Path, directory the text file is written to, see output_path
+    :param trace: PaperTrace the stage durations and sizes are added to, if given
+    :param force: bool, extract the file even if its output is newer than it
+        (iter_extracted_files forces the files that failed in the last run)
+    :param relative_path: str, path of the file relative to its input if its name collides, see expand_inputs
+    :return: str, 'ok', or 'missing'/'unsupported'/'unchanged' if the file was skipped
+    """
+    path_obj = Path(file_path)
+    if not path_obj.exists():
+        logging.error(f"File not found: {file_path}")
+        return 'missing'
+    out_file = output_path(file_path, output_dir, relative_path)
+    if out_file is None:
+        logging.warning(f"Unsupported file extension '{path_obj.suffix.lower()}' for {file_path}. Skipping.")
+        return 'unsupported'
+    if not force and is_up_to_date(file_path, out_file):
+        logging.debug(f"Skipping {file_path}, {out_file} is up to date.")
+        return 'unchanged'
+
+    if trace is not None:
+        trace.bytes['input'] = path_obj.stat().st_size
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    EXTRACTORS[path_obj.suffix.lower()].function(file_path, out_file, trace)
+    if trace is not None:
+        trace.bytes['output'] = out_file.stat().st_size
+    return 'ok'
+
+
+def extract_file_traced(file_path, output_dir, force=False, relative_path=None):
+    """
+    extract_file for a worker process: errors and the trace of the file are sent back as data.
+
+    :return: (status, error message or None, PaperTrace)
+    """
+    trace = PaperTrace(file_path)
+    try:
+        return extract_file(file_path, output_dir, trace, force, relative_path), None, trace
+    except Exception as e:
+        return 'failed', str(e), trace
+
+
+def iter_extracted_files(files, output_dir, workers, force=False, failed=()):
+    """
+    Extract files in-process (workers == 1) or in a pool of worker processes.
+
+    :param failed: output names of files extracted even if their output is up to date, see load_failed
+    :param files: list of (file path, path relative to its input or None), as returned by expand_inputs
+    :return: generator of (status, error message or None, PaperTrace), in completion order
+    """
+    # 上次失败的文件可能留着更早的输出, 它比输入新也不算最新
+    files = [(file_path, relative_path, force or output_name(file_path, relative_path) in failed)
+             for file_path, relative_path in files]
+    if workers <= 1:
+        for file_path, relative_path, file_force in files:
+            yield extract_file_traced(file_path, output_dir, file_force, relative_path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 大文件排在前面, 免得最后只剩一个进程在处理一个大文件
+        by_size = sorted(files, key=lambda file: os.path.getsize(file[0]) if os.path.isfile(file[0]) else 0,
+                         reverse=True)
+        futures = {executor.submit(extract_file_traced, file_path, output_dir, file_force, relative_path): file_path
+                   for file_path, relative_path, file_force in by_size}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # 例如 worker 进程崩溃 (BrokenProcessPool)
+                yield 'failed', str(e), PaperTrace(futures[future])
+
+
+def format_rate(files, input_bytes, seconds):
+    seconds = max(seconds, 1e-9)
+    return f"{files / seconds:.2f} files/s, {input_bytes / (1024 * 1024) / seconds:.2f} MB/s"
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract and clean the text of PDF, DOCX and XLSX files.",
+        epilog="Inputs may be files, directories (every supported file below them) or glob patterns, "
+               "e.g. 'Papers/**/*.pdf' (quoted, so that ** is expanded here).")
+    parser.add_argument('inputs', nargs='+', help="files, directories or glob patterns")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help=f"where the text files go (default: {OUTPUT_DIR})")
+    parser.add_argument('--workers', type=int, default=available_cores(),
+                        help="worker processes (default: the available cores)")
+    parser.add_argument('--force', action='store_true', help="extract files even if their output is up to date")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        files = expand_inputs(args.inputs)
+    except ValueError as e:
+        logging.error(e)
+        return 2
+    workers = max(1, min(args.workers, len(files)))
+    logging.info(f"Extracting {len(files)} files with {workers} worker process(es)")
+
+    # 失败的文件不写输出; 记在 FAILED_FILE 里, 直到提取成功为止每次运行都重新提取并报告错误
+    failed = load_failed(output_dir)
+    names = {file_path: output_name(file_path, relative_path) for file_path, relative_path in files}
+    retried = sum(1 for name in names.values() if name in failed)
+    if retried:
+        logging.info(f"Extracting {retried} files that failed in the last run again")
+
+    # 每个文件的耗时/大小写到 PSD_TRACE_FILE (JSONL), 结束时打印汇总表
+    instrumentation = Instrumentation()
+    start = last_progress = time.perf_counter()
+    done = extracted = input_bytes = 0
+    try:
+        with instrumentation.profiling():
+            for status, error, trace in iter_extracted_files(files, output_dir, workers, args.force, set(failed)):
+                instrumentation.add(trace)
+                instrumentation.finish(trace.paper, status, error)
+                name = names.get(trace.paper)
+                if error is not None:
+                    logging.error(f"Failed to extract {trace.paper}: {error}")
+                    if name is not None:
+                        failed[name] = {'file': trace.paper, 'error': error}
+                done += 1
+                if status == 'ok':
+                    extracted += 1
+                    input_bytes += trace.bytes.get('input', 0)
+                    failed.pop(name, None)
+                now = time.perf_counter()
+                if now - last_progress >= PROGRESS_SECONDS:
+                    logging.info(f"[{done}/{len(files)}] {format_rate(extracted, input_bytes, now - start)}")
+                    last_progress = now
+    finally:
+        save_failed(output_dir, failed)
+    instrumentation.close()
+
+    seconds = time.perf_counter() - start
+    counters = instrumentation.counters
+    logging.info("File traces:\n" + instrumentation.format_summary())
+    logging.info(f"Extracted {extracted} of {len(files)} files in {seconds:.2f}s "
+                 f"({format_rate(extracted, input_bytes, seconds)}); skipped {counters['papers_unchanged']} up to "
+                 f"date, {counters['papers_missing'] + counters['papers_unsupported']} missing or unsupported, "
+                 f"{counters['papers_failed']} failed")
+    return 1 if counters['papers_failed'] else 0
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
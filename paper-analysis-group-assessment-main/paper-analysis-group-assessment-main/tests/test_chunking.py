@@ -0,0 +1,103 @@
+import re
+
+import pytest
+
+from ingestion import document_processor as dp
+from ingestion.chunking import chunk_spans, join_paragraphs, merge_chunk_entities
+
+
+def whitespace_tokens(text):
+    return [match.span() for match in re.finditer(r"\S+", text)]
+
+
+def chunk_texts(text, max_tokens, overlap=0):
+    return [text[start:end] for start, end in chunk_spans(text, whitespace_tokens(text), max_tokens, overlap)]
+
+
+def entity(start_char, end_char, chunk, label="PERSON"):
+    return {"text": "", "start_char": start_char, "end_char": end_char, "label": label, "chunk": chunk}
+
+
+def test_sentences_are_packed_with_overlap():
+    text = "a b. c d. e f. g h."
+    assert chunk_texts(text, max_tokens=4, overlap=2) == ["a b. c d.", "c d. e f.", "e f. g h."]
+
+
+def test_sentences_are_packed_without_overlap():
+    text = "a b. c d. e f. g h."
+    assert chunk_texts(text, max_tokens=4) == ["a b. c d.", "e f. g h."]
+
+
+def test_long_sentence_falls_back_to_token_windows():
+    text = " ".join(f"w{index}" for index in range(10)) + "."
+    assert chunk_texts(text, max_tokens=4, overlap=1) == ["w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9."]
+
+
+def test_overlap_does_not_repeat_the_previous_chunk():
+    # The long sentence does not fit after any of 'b. c.': it starts its own windows
+    text = "a. b. c. " + " ".join(f"w{index}" for index in range(10)) + "."
+    assert chunk_texts(text, max_tokens=6, overlap=3) == [
+        "a. b. c.", "w0 w1 w2 w3 w4 w5", "w3 w4 w5 w6 w7 w8", "w6 w7 w8 w9."]
+
+
+def test_overlap_is_shortened_to_fit_the_next_sentence():
+    text = "a. b. c. d e f g h."
+    assert chunk_texts(text, max_tokens=6, overlap=3) == ["a. b. c.", "c. d e f g h."]
+
+
+def test_chunk_ends_always_advance():
+    text = "one. two three. " + " ".join(f"w{index}" for index in range(30)) + ". four five six. seven."
+    spans = chunk_spans(text, whitespace_tokens(text), max_tokens=7, overlap=3)
+    assert all(end > previous_end for (_, previous_end), (_, end) in zip(spans, spans[1:]))
+
+
+def test_empty_text_has_no_chunks():
+    assert chunk_spans("", [], max_tokens=4, overlap=1) == []
+    assert chunk_spans(" \n ", [], max_tokens=4, overlap=1) == []
+
+
+@pytest.mark.parametrize("overlap", [4, 5])
+def test_overlap_must_be_smaller_than_max_tokens(overlap):
+    with pytest.raises(ValueError):
+        chunk_spans("a b c.", whitespace_tokens("a b c."), max_tokens=4, overlap=overlap)
+
+
+def test_entity_found_in_two_chunks_is_kept_once():
+    merged = merge_chunk_entities([entity(10, 15, 0), entity(10, 15, 1), entity(30, 35, 1)])
+    assert [(ent["start_char"], ent["end_char"]) for ent in merged] == [(10, 15), (30, 35)]
+
+
+def test_entity_cut_at_a_chunk_boundary_keeps_the_longer_span():
+    # Cut at the end of chunk 0, complete in chunk 1
+    merged = merge_chunk_entities([entity(10, 15, 0), entity(10, 22, 1)])
+    assert [(ent["start_char"], ent["end_char"], ent["chunk"]) for ent in merged] == [(10, 22, 1)]
+    # Cut at the start of chunk 1, complete in chunk 0
+    merged = merge_chunk_entities([entity(5, 15, 0), entity(10, 15, 1)])
+    assert [(ent["start_char"], ent["end_char"], ent["chunk"]) for ent in merged] == [(5, 15, 0)]
+
+
+def test_overlapping_entities_of_one_chunk_are_both_kept():
+    merged = merge_chunk_entities([entity(10, 20, 0), entity(12, 18, 0, label="ORG")])
+    assert len(merged) == 2
+
+
+def test_entity_offsets_index_the_joined_text(monkeypatch):
+    spacy = pytest.importorskip("spacy")
+    nlp_model = spacy.blank("en")
+    ruler = nlp_model.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "PERSON", "pattern": "Fiona Calvert"}, {"label": "ORG", "pattern": "Google"}])
+    monkeypatch.setattr(dp, "MAX_TOKEN_LENGTH", 12)
+    monkeypatch.setattr(dp, "CHUNK_OVERLAP", 4)
+
+    paragraphs = [
+        "Fiona Calvert wrote it. The study of number lines was run at Google with children.",
+        "",
+        "Results: Google and Fiona Calvert agree. " + "filler " * 20 + "Fiona Calvert.",
+    ]
+    entities = list(dp.extract_entities(paragraphs, nlp_model))
+    full_text = join_paragraphs(paragraphs)
+
+    for ent in entities:
+        assert full_text[ent["start_char"]:ent["end_char"]] == ent["text"]
+    # Every mention once, although the chunks overlap
+    assert [ent["text"] for ent in entities] == ["Fiona Calvert", "Google", "Google", "Fiona Calvert", "Fiona Calvert"]
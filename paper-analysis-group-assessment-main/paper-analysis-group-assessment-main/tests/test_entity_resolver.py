@@ -0,0 +1,80 @@
+import pytest
+
+from ingestion import document_processor as dp
+from ingestion.entity_resolver import EntityResolver, normalize_entity_name
+
+
+@pytest.fixture
+def cur(tmp_path):
+    conn = dp.get_database_connection(str(tmp_path / "test.sqlite"))
+    dp.setup_database(conn)
+    yield conn.cursor()
+    conn.close()
+
+
+def test_short_form_is_merged_into_the_full_name(cur):
+    resolver = EntityResolver(cur)
+    short_id = resolver.resolve("Calvert", "PERSON")
+    full_id = resolver.resolve("Fiona Calvert", "PERSON")
+    assert resolver.canonical_id(short_id) == full_id
+    assert resolver.resolve("CALVERT", "PERSON") == full_id
+    assert resolver.resolve("F. Calvert", "PERSON") == full_id
+    assert cur.execute("SELECT COUNT(*) FROM entities").fetchone()[0] == 1
+
+
+def test_merge_moves_the_cached_keys_of_the_source(cur):
+    resolver = EntityResolver(cur)
+    source_id = resolver.resolve("Org A", "ORG")
+    resolver.resolve("ORG  A.", "ORG")
+    target_id = resolver.resolve("Org B", "ORG")
+    resolver.merge(source_id, target_id)
+    assert resolver._cache[("org a", "ORG")] == target_id
+    assert resolver._keys_by_id == {target_id: {("org a", "ORG"), ("org b", "ORG")}}
+    assert resolver.resolve("Org A", "ORG") == target_id
+
+
+def test_evicted_keys_leave_the_reverse_index(cur):
+    resolver = EntityResolver(cur, cache_size=2)
+    ids = [resolver.resolve(f"Org {index}", "ORG") for index in range(4)]
+    assert list(resolver._cache) == [("org 2", "ORG"), ("org 3", "ORG")]
+    assert resolver._keys_by_id == {ids[2]: {("org 2", "ORG")}, ids[3]: {("org 3", "ORG")}}
+
+
+def resolve_papers(cur, papers, batched):
+    resolver = EntityResolver(cur)
+    for mentions in papers:
+        if batched:
+            resolver.resolve_many(mentions)
+        else:
+            for name, entity_type in sorted(mentions, key=lambda mention: -len(normalize_entity_name(mention[0]))):
+                resolver.resolve(name, entity_type)
+    return (sorted(cur.execute("SELECT entity_name, entity_type FROM entities").fetchall()),
+            sorted(cur.execute("""
+                SELECT variant_key, entity_variants.entity_type, entity_name FROM entity_variants
+                LEFT JOIN entities USING(entity_id)
+            """).fetchall(), key=str))
+
+
+def test_resolve_many_matches_resolve_one_at_a_time(tmp_path):
+    papers = [
+        [("Ali Brown", "PERSON"), ("Brown", "PERSON"), ("Org", "ORG")],
+        # Both full names claim 'ali brown', which was an entity of its own: it is merged into the
+        # first, then becomes ambiguous and gets an entity of its own again
+        [("Brown", "PERSON"), ("Ali Q Brown", "PERSON"), ("Ali M Brown", "PERSON"), ("Ali Brown", "PERSON"),
+         ("A. Brown", "PERSON")],
+        [("Fiona Calvert", "PERSON"), ("FIONA  CALVERT", "PERSON"), ("Calvert", "PERSON"), ("ORG.", "ORG")],
+    ]
+    results = []
+    for batched in (False, True):
+        conn = dp.get_database_connection(str(tmp_path / f"{batched}.sqlite"))
+        dp.setup_database(conn)
+        results.append(resolve_papers(conn.cursor(), papers, batched))
+        conn.close()
+    assert results[0] == results[1]
+
+
+def test_resolve_many_resolves_variants_to_one_entity(cur):
+    resolver = EntityResolver(cur)
+    resolved = resolver.resolve_many([("Calvert", "PERSON"), ("F. Calvert", "PERSON"), ("Fiona Calvert", "PERSON")])
+    assert len({resolver.canonical_id(entity_id) for entity_id in resolved.values()}) == 1
+    assert resolver.resolve("FIONA CALVERT", "PERSON") == resolved[("Fiona Calvert", "PERSON")]
@@ -0,0 +1,40 @@
+import openpyxl
+import pytest
+
+from ingestion.excel_extractor import extract_data_from_excel, iter_rows_from_excel
+
+
+def make_workbook(path, sheet_title="Sheet1", rows=(("paper_name", "paper_pdf"), ("A paper", "a.pdf"))):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = sheet_title
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def test_rows_are_read_from_the_named_sheet(tmp_path):
+    make_workbook(tmp_path / "index.xlsx")
+    assert list(iter_rows_from_excel(tmp_path / "index.xlsx", sheet_name="Sheet1")) == [
+        ("paper_name", "paper_pdf"), ("A paper", "a.pdf")]
+
+
+def test_missing_file_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        list(iter_rows_from_excel(tmp_path / "missing.xlsx"))
+
+
+def test_missing_sheet_raises(tmp_path):
+    make_workbook(tmp_path / "index.xlsx", sheet_title="Papers")
+    with pytest.raises(KeyError):
+        list(iter_rows_from_excel(tmp_path / "index.xlsx", sheet_name="Sheet1"))
+
+
+def test_corrupt_file_raises(tmp_path):
+    (tmp_path / "index.xlsx").write_bytes(b"not a workbook")
+    with pytest.raises(Exception):
+        list(iter_rows_from_excel(tmp_path / "index.xlsx"))
+
+
+def test_extract_data_from_excel_returns_no_rows_on_errors(tmp_path):
+    assert extract_data_from_excel(tmp_path / "missing.xlsx") == []
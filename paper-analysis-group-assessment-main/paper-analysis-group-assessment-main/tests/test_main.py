@@ -0,0 +1,80 @@
+import pytest
+
+import main
+
+
+def make_files(root, *names):
+    for name in names:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+
+
+def test_outputs_are_named_by_stem(tmp_path):
+    make_files(tmp_path, "papers/a/x.pdf", "papers/y.docx", "index.xlsx")
+    files = main.expand_inputs([str(tmp_path / "papers"), str(tmp_path / "index.xlsx")])
+    outputs = {main.output_path(file_path, "out", relative_path) for file_path, relative_path in files}
+    assert {str(path) for path in outputs} == {"out/x.txt", "out/y.txt", "out/index_table.txt"}
+
+
+def test_colliding_outputs_keep_the_directory_and_extension(tmp_path):
+    make_files(tmp_path, "papers/a/x.pdf", "papers/b/x.pdf", "papers/b/x.docx", "papers/b/y.pdf")
+    files = main.expand_inputs([str(tmp_path / "papers")])
+    outputs = {main.output_path(file_path, "out", relative_path) for file_path, relative_path in files}
+    assert {str(path) for path in outputs} == {"out/a/x.pdf.txt", "out/b/x.pdf.txt", "out/b/x.docx.txt", "out/y.txt"}
+
+
+def test_glob_outputs_are_relative_to_the_fixed_part(tmp_path):
+    make_files(tmp_path, "papers/a/x.pdf", "papers/x.pdf", "papers/y.pdf")
+    files = main.expand_inputs([str(tmp_path / "papers" / "**" / "*.pdf")])
+    assert sorted(relative_path or "" for _, relative_path in files) == ["", "a/x.pdf", "x.pdf"]
+
+
+def test_unsupported_files_do_not_collide(tmp_path):
+    make_files(tmp_path, "one/x.txt", "two/x.txt")
+    files = main.expand_inputs([str(tmp_path / "one" / "x.txt"), str(tmp_path / "two" / "x.txt")])
+    assert [relative_path for _, relative_path in files] == [None, None]
+
+
+def test_duplicate_inputs_are_extracted_once(tmp_path):
+    make_files(tmp_path, "papers/x.pdf")
+    files = main.expand_inputs([str(tmp_path / "papers"), str(tmp_path / "papers" / "x.pdf")])
+    assert files == [(str(tmp_path / "papers" / "x.pdf"), None)]
+
+
+def test_files_with_the_same_output_are_rejected(tmp_path):
+    make_files(tmp_path, "one/x.pdf", "two/x.pdf")
+    with pytest.raises(ValueError):
+        main.expand_inputs([str(tmp_path / "one"), str(tmp_path / "two")])
+
+
+@pytest.mark.parametrize("name", ["bad.pdf", "bad.docx"])
+def test_unreadable_file_fails_without_output(tmp_path, name):
+    make_files(tmp_path, "in/" + name)
+    (tmp_path / "in" / name).write_bytes(b"not a document")
+    status, error, _ = main.extract_file_traced(str(tmp_path / "in" / name), tmp_path / "out")
+    assert status == 'failed' and error
+    assert not any((tmp_path / "out").rglob("*"))
+
+
+def test_failed_file_is_extracted_again_until_it_succeeds(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    source = tmp_path / "in" / "t.xlsx"
+    make_files(tmp_path, "in/t.xlsx", "out/t_table.txt")
+    source.write_bytes(b"not a workbook")
+    # An output newer than the file, left by an earlier run
+    (tmp_path / "out" / "t_table.txt").write_text("old\n")
+    argv = [str(source), "--output-dir", str(tmp_path / "out"), "--workers", "1"]
+
+    assert main.main(argv + ["--force"]) == 1
+    assert list(main.load_failed(tmp_path / "out")) == ["t_table.txt"]
+    # Not skipped as up to date: the error is reported again
+    assert main.main(argv) == 1
+
+    workbook = openpyxl.Workbook()
+    workbook.active.append(["a", "b"])
+    workbook.save(source)
+    assert main.main(argv) == 0
+    assert (tmp_path / "out" / "t_table.txt").read_text() == "a,b\n"
+    assert main.load_failed(tmp_path / "out") == {}
+    assert not (tmp_path / "out" / main.FAILED_FILE).exists()
@@ -0,0 +1,85 @@
+import json
+import threading
+import http.client
+from urllib.parse import urlencode
+
+import pytest
+
+from ingestion import document_processor as dp
+from ingestion.entity_resolver import EntityResolver
+from ingestion.entity_store import EntityTable
+from ingestion.query_server import QueryServer
+
+PAPERS = 45
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    db_file = str(tmp_path_factory.mktemp("db") / "papers.sqlite")
+    conn = dp.get_database_connection(db_file)
+    dp.setup_database(conn)
+    cur = conn.cursor()
+    resolver = EntityResolver(cur)
+    for index in range(PAPERS):
+        paper = {'paper_name': f"Paper {index}", **dp.paper_paths(f"paper{index}.pdf")}
+        entities = EntityTable()
+        entities.append("Fiona Calvert", 0, 13, "PERSON")
+        dp.update_database(cur, paper, entities, [f"Numerical board games, study {index}."], resolver=resolver)
+    conn.commit()
+    conn.close()
+
+    query_server = QueryServer(db_file, port=0, pool_size=2)
+    threading.Thread(target=query_server.serve_forever, daemon=True).start()
+    yield query_server
+    query_server.shutdown()
+    query_server.server_close()
+
+
+def get(server, path, **params):
+    conn = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    try:
+        conn.request("GET", f"{path}?{urlencode(params)}")
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def test_pages_cover_every_paper(server):
+    names, offset = [], 0
+    while offset is not None:
+        status, body = get(server, "/query", q="get all papers", limit=20, offset=offset)
+        assert status == 200
+        page = json.loads(body)
+        names += [row['paper_name'] for row in page['rows']]
+        offset = page['next_offset']
+    assert names == [f"Paper {index}" for index in range(PAPERS)]
+
+
+def test_search_pages_go_past_the_prompt_limit(server):
+    assert PAPERS > dp.SEARCH_RESULT_LIMIT
+    status, body = get(server, "/query", q="search numerical games", limit=20, offset=40)
+    page = json.loads(body)
+    assert status == 200
+    assert len(page['rows']) == PAPERS - 40
+    assert page['next_offset'] is None
+
+
+def test_structured_filters(server):
+    status, body = get(server, "/papers", person="F. Calvert", limit=1)
+    page = json.loads(body)
+    assert status == 200
+    assert page['rows'][0]['paper_name'] == "Paper 0"
+    assert page['next_offset'] == 1
+
+
+def test_stream_sends_every_row(server):
+    status, body = get(server, "/query", q="search numerical", stream=1)
+    assert status == 200
+    assert len(body.decode('utf-8').splitlines()) == PAPERS
+
+
+@pytest.mark.parametrize("params", [{'q': "hello"}, {'q': "get all papers", 'limit': 0},
+                                    {'q': "get all papers", 'limit': 5000}, {'q': "get all papers", 'offset': "x"}])
+def test_invalid_requests(server, params):
+    assert get(server, "/query", **params)[0] == 400